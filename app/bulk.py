@@ -0,0 +1,254 @@
+import argparse
+import csv
+import io
+import json
+import sys
+import time
+from dataclasses import dataclass
+
+from sqlalchemy import text
+
+from app.crud_mongo import flush_logs
+from app.crud_postgres import normalize_phone, query_cache, safe_log, stream_rows
+from app.db import begin, connect
+
+# Массовая загрузка и выгрузка справочников:
+#   python -m app.bulk import customers customers.csv
+#   python -m app.bulk import inventory stock.jsonl --chunk-size 20000
+#   python -m app.bulk export customers -o customers.csv
+#   python -m app.bulk export menu_items --format jsonl > menu.jsonl
+#
+# Импорт читает файл потоком, пачку строк кладёт COPY во временную таблицу и переносит
+# одним INSERT ... SELECT с ON CONFLICT; каждая пачка — своя транзакция.
+# В журнал пишется одна итоговая запись на весь импорт, а не по записи на строку.
+
+DEFAULT_CHUNK_SIZE = 10000
+
+
+@dataclass(frozen=True)
+class Entity:
+    table: str
+    columns: tuple           # допустимые колонки файла
+    required: tuple          # обязательные колонки
+    conflict: tuple = ()     # ключ upsert; пусто — только вставка
+    order_by: str = ""       # порядок выгрузки
+    invalidate: tuple = ()   # сущности кэша справочников
+    normalize: tuple = ()    # (колонка, функция) — привести значение перед загрузкой
+
+
+ENTITIES = {
+    "customers": Entity(
+        "Customer", ("name", "phone", "email", "loyalty_points"), ("name", "phone"),
+        conflict=("phone",), order_by="customer_id", invalidate=("customers_hot",),
+        normalize=(("phone", normalize_phone),)),
+    "menu_items": Entity(
+        "MenuItem", ("name", "description", "price", "calories", "is_available", "image_url"), ("name", "price"),
+        order_by="item_id", invalidate=("menu_items", "menu")),
+    "inventory": Entity(
+        "Inventory", ("branch_id", "item_name", "quantity", "unit"), ("branch_id", "item_name", "quantity"),
+        conflict=("branch_id", "item_name"), order_by="inventory_id"),
+    "supplier_items": Entity(
+        "SupplierMenuItem", ("supplier_id", "item_id", "supply_price"), ("supplier_id", "item_id", "supply_price"),
+        conflict=("supplier_id", "item_id"), order_by="supplier_id, item_id", invalidate=("supplier_items",)),
+}
+
+
+def _entity(name):
+    if name not in ENTITIES:
+        raise ValueError(f"Неизвестная сущность: {name}. Доступны: {', '.join(ENTITIES)}")
+    return ENTITIES[name]
+
+def _progress(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+# ===== Чтение входного файла =====
+def _detect_format(path, fmt):
+    if fmt:
+        return fmt
+    return "jsonl" if str(path).endswith((".jsonl", ".json", ".ndjson")) else "csv"
+
+def read_records(stream, fmt):
+    """Поток (колонки, итератор строк-списков); колонки берутся из заголовка CSV или первой JSON-строки."""
+    if fmt == "csv":
+        reader = csv.reader(stream)
+        header = [c.strip() for c in next(reader, [])]
+        return header, reader
+
+    lines = (line for line in stream if line.strip())
+    first = next(lines, None)
+    if first is None:
+        return [], iter(())
+    first = json.loads(first)
+    header = list(first)
+
+    def rows():
+        yield [first.get(c) for c in header]
+        for line in lines:
+            record = json.loads(line)
+            yield [record.get(c) for c in header]
+    return header, rows()
+
+def _chunks(rows, size):
+    chunk = []
+    for row in rows:
+        chunk.append(row)
+        if len(chunk) >= size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+
+# ===== Импорт =====
+def _normalized(rows, normalizers):
+    for number, row in enumerate(rows, start=1):
+        row = list(row)
+        for index, fn in normalizers:
+            if index < len(row) and row[index] not in (None, ""):
+                try:
+                    row[index] = fn(row[index])
+                except ValueError as e:
+                    raise ValueError(f"строка {number}: {e}") from e
+        yield row
+
+def _upsert_sql(entity, columns):
+    cols = ", ".join(columns)
+    if not entity.conflict:
+        return f"INSERT INTO {entity.table} ({cols}) SELECT {cols} FROM _bulk_stage ORDER BY _line RETURNING TRUE"
+    key = ", ".join(entity.conflict)
+    updates = [c for c in columns if c not in entity.conflict]
+    action = ("DO UPDATE SET " + ", ".join(f"{c} = EXCLUDED.{c}" for c in updates)) if updates else "DO NOTHING"
+    if entity.table == "Inventory" and updates:
+        action += ", last_updated = NOW()"
+    # DISTINCT ON: повтор ключа внутри пачки — побеждает последняя строка файла
+    return f"""
+        INSERT INTO {entity.table} ({cols})
+        SELECT DISTINCT ON ({key}) {cols} FROM _bulk_stage ORDER BY {key}, _line DESC
+        ON CONFLICT ({key}) {action}
+        RETURNING (xmax = 0)
+    """
+
+def _load_chunk(conn, entity, columns, chunk, first_line):
+    conn.execute(text(f"""
+        CREATE TEMP TABLE _bulk_stage ON COMMIT DROP AS
+        SELECT {", ".join(columns)} FROM {entity.table} WITH NO DATA
+    """))
+    conn.execute(text("ALTER TABLE _bulk_stage ADD COLUMN _line BIGINT"))
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    for offset, row in enumerate(chunk):
+        writer.writerow([*("" if v is None else v for v in row), first_line + offset])
+    buffer.seek(0)
+    conn.connection.dbapi_connection.cursor().copy_expert(
+        f"COPY _bulk_stage ({', '.join(columns)}, _line) FROM STDIN WITH (FORMAT csv)", buffer)
+    inserted = updated = 0
+    for (is_insert,) in conn.execute(text(_upsert_sql(entity, columns))):
+        if is_insert:
+            inserted += 1
+        else:
+            updated += 1
+    return inserted, updated
+
+def import_records(entity_name, stream, fmt="csv", chunk_size=DEFAULT_CHUNK_SIZE, start_line=1):
+    """
+    Загрузить записи из открытого файла. Каждая пачка фиксируется отдельно: при ошибке
+    загруженное раньше остаётся, а повторить можно с start_line из текста ошибки
+    """
+    entity = _entity(entity_name)
+    header, rows = read_records(stream, fmt)
+    unknown = [c for c in header if c not in entity.columns]
+    if unknown:
+        raise ValueError(f"{entity_name}: неизвестные колонки {unknown}; допустимы {list(entity.columns)}")
+    missing = [c for c in entity.required if c not in header]
+    if missing:
+        raise ValueError(f"{entity_name}: нет обязательных колонок {missing}")
+
+    normalizers = [(header.index(column), fn) for column, fn in entity.normalize if column in header]
+    if normalizers:
+        rows = _normalized(rows, normalizers)
+
+    started = time.perf_counter()
+    stats = {"entity": entity_name, "rows": 0, "inserted": 0, "updated": 0, "chunks": 0}
+    line = 1
+    for chunk in _chunks(rows, chunk_size):
+        if line + len(chunk) <= start_line:
+            line += len(chunk)
+            continue
+        skip = max(0, start_line - line)
+        chunk, line = chunk[skip:], line + skip
+        try:
+            with begin() as conn:
+                inserted, updated = _load_chunk(conn, entity, header, chunk, line)
+        except Exception as e:
+            raise RuntimeError(f"{entity_name}: пачка со строки {line} не загружена "
+                               f"(повторить: --start-line {line}): {e}") from e
+        line += len(chunk)
+        stats["rows"] += len(chunk)
+        stats["inserted"] += inserted
+        stats["updated"] += updated
+        stats["chunks"] += 1
+        elapsed = time.perf_counter() - started
+        _progress(f"{entity_name}: {stats['rows']} строк, {stats['rows'] / elapsed:.0f} строк/с")
+
+    stats["seconds"] = round(time.perf_counter() - started, 3)
+    for cache_entity in entity.invalidate:
+        query_cache.invalidate(cache_entity)
+    safe_log(0, "bulk_import", stats)
+    return stats
+
+
+# ===== Экспорт =====
+def export_records(entity_name, out, fmt="csv"):
+    """
+    Выгрузить таблицу потоком: CSV — через COPY TO STDOUT, JSON Lines — серверным курсором.
+    В памяти не держится больше одной порции строк
+    """
+    entity = _entity(entity_name)
+    query = f"SELECT * FROM {entity.table} ORDER BY {entity.order_by}"
+    count = 0
+    if fmt == "csv":
+        with connect() as conn:
+            cursor = conn.connection.dbapi_connection.cursor()
+            cursor.copy_expert(f"COPY ({query}) TO STDOUT WITH (FORMAT csv, HEADER)", out)
+            count = cursor.rowcount
+    else:
+        for row in stream_rows(query, {}):
+            out.write(json.dumps(row, ensure_ascii=False, default=str))
+            out.write("\n")
+            count += 1
+    safe_log(0, "bulk_export", {"entity": entity_name, "rows": count, "format": fmt})
+    return count
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.bulk", description="Массовый импорт и экспорт")
+    sub = parser.add_subparsers(dest="command", required=True)
+    imp = sub.add_parser("import", help="загрузить CSV или JSON Lines")
+    imp.add_argument("entity", choices=list(ENTITIES))
+    imp.add_argument("path", help="файл или - для stdin")
+    imp.add_argument("--format", choices=["csv", "jsonl"])
+    imp.add_argument("--chunk-size", type=int, default=DEFAULT_CHUNK_SIZE)
+    imp.add_argument("--start-line", type=int, default=1, help="пропустить записи до этой (нумерация с 1)")
+    exp = sub.add_parser("export", help="выгрузить таблицу")
+    exp.add_argument("entity", choices=list(ENTITIES))
+    exp.add_argument("-o", "--output", help="файл (по умолчанию stdout)")
+    exp.add_argument("--format", choices=["csv", "jsonl"])
+    args = parser.parse_args()
+
+    if args.command == "import":
+        fmt = _detect_format(args.path, args.format)
+        stream = sys.stdin if args.path == "-" else open(args.path, encoding="utf-8", newline="")
+        try:
+            with stream:
+                result = import_records(args.entity, stream, fmt, args.chunk_size, args.start_line)
+        except (ValueError, RuntimeError) as e:
+            raise SystemExit(f"❌ {e}")
+        print(json.dumps(result, ensure_ascii=False))
+    else:
+        fmt = _detect_format(args.output or "", args.format)
+        out = sys.stdout if not args.output else open(args.output, "w", encoding="utf-8", newline="")
+        with out:
+            rows = export_records(args.entity, out, fmt)
+        _progress(f"{args.entity}: выгружено {rows} строк")
+    flush_logs(timeout=5)
@@ -0,0 +1,133 @@
+import threading
+import time
+from collections import OrderedDict
+
+INVALIDATION_CHANNEL = "cache_invalidation"
+
+
+class TTLCache:
+    """LRU-кэш с ограничением по размеру и временем жизни записей."""
+
+    def __init__(self, ttl, maxsize):
+        self.ttl = ttl
+        self.maxsize = maxsize
+        self._data = OrderedDict()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def get(self, key):
+        entry = self._data.get(key)
+        if entry is None or entry[0] < time.monotonic():
+            if entry is not None:
+                del self._data[key]
+                self.evictions += 1
+            self.misses += 1
+            return None
+        self._data.move_to_end(key)
+        self.hits += 1
+        return entry
+
+    def set(self, key, value):
+        self._data[key] = (time.monotonic() + self.ttl, value)
+        self._data.move_to_end(key)
+        while len(self._data) > self.maxsize:
+            self._data.popitem(last=False)
+            self.evictions += 1
+
+    def pop(self, key):
+        if self._data.pop(key, None) is not None:
+            self.invalidations += 1
+
+    def clear(self):
+        self.invalidations += len(self._data)
+        self._data.clear()
+
+    def stats(self):
+        return {"size": len(self._data), "hits": self.hits, "misses": self.misses,
+                "evictions": self.evictions, "invalidations": self.invalidations}
+
+
+class QueryCache:
+    """
+    Read-through кэш результатов запросов, разбитый по сущностям.
+    settings: {entity: (ttl_seconds, maxsize)}
+    """
+
+    def __init__(self, settings):
+        self._caches = {entity: TTLCache(ttl, maxsize) for entity, (ttl, maxsize) in settings.items()}
+        # Поколение сущности растёт при каждой инвалидации: результат загрузки,
+        # начатой до инвалидации, в кэш уже не попадёт
+        self._generations = {entity: 0 for entity in settings}
+        self._lock = threading.Lock()
+        self._broker = None
+        self._unsubscribe = None
+
+    def get_or_load(self, entity, key, loader, bypass=False):
+        cache = self._caches[entity]
+        if not bypass:
+            with self._lock:
+                entry = cache.get(key)
+            if entry is not None:
+                return entry[1]
+        with self._lock:
+            generation = self._generations[entity]
+        value = loader()
+        with self._lock:
+            if self._generations[entity] == generation:
+                cache.set(key, value)
+        return value
+
+    async def aget_or_load(self, entity, key, loader, bypass=False):
+        """То же, что get_or_load, для корутины-загрузчика."""
+        cache = self._caches[entity]
+        if not bypass:
+            with self._lock:
+                entry = cache.get(key)
+            if entry is not None:
+                return entry[1]
+        with self._lock:
+            generation = self._generations[entity]
+        value = await loader()
+        with self._lock:
+            if self._generations[entity] == generation:
+                cache.set(key, value)
+        return value
+
+    def invalidate(self, entity, key=None, publish=True):
+        """Сбросить одну запись сущности или, если key не задан, все её записи."""
+        with self._lock:
+            self._generations[entity] += 1
+            if key is None:
+                self._caches[entity].clear()
+            else:
+                self._caches[entity].pop(key)
+        if publish and self._broker is not None:
+            self._broker.publish(INVALIDATION_CHANNEL, {"entity": entity, "key": key})
+
+    def clear(self):
+        for entity in self._caches:
+            self.invalidate(entity, publish=False)
+
+    def stats(self):
+        with self._lock:
+            return {entity: cache.stats() for entity, cache in self._caches.items()}
+
+    # ===== Межпроцессная инвалидация =====
+    def attach(self, broker):
+        """Подписаться на инвалидации других процессов и рассылать свои."""
+        self.detach()
+        self._broker = broker
+        # после переподключения брокера инвалидации могли потеряться — сбрасываем всё
+        self._unsubscribe = broker.subscribe(INVALIDATION_CHANNEL, self._on_message, on_resync=self.clear)
+
+    def detach(self):
+        if self._unsubscribe is not None:
+            self._unsubscribe()
+        self._broker = None
+        self._unsubscribe = None
+
+    def _on_message(self, payload):
+        if payload.get("entity") in self._caches:
+            self.invalidate(payload["entity"], payload.get("key"), publish=False)
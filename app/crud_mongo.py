@@ -1,36 +1,191 @@
-from pymongo import MongoClient
+import queue
+import threading
 from datetime import datetime
+from bson import ObjectId
+from app.db import get_mongo_db
+from app.log_spool import new_log_id, spool_overflow, spool_stats, write_logs
+from app.log_storage import ARCHIVE, ensure_archive_collection, get_logs
+from app.log_writer import BatchWriter, register_shutdown
+from app.order_feed import HISTORY
+from app.review_analytics import DAILY, DAILY_RETENTION_DAYS, record_review
+from app.settings import get_settings
 
-client = MongoClient("mongodb://localhost:27017/")
-db = client["cafe_mongo"]
+# Клиент MongoDB создаётся лениво (app/db.py), коллекции берём при обращении
+def _reviews():
+    return get_mongo_db()["reviews"]
 
-reviews = db["reviews"]
-logs = db["logs"]
+def _logs():
+    return get_mongo_db()["logs"]
+
+# ===== Indexes =====
+# коллекция -> [(ключи, опции)]
+MONGO_INDEXES = {
+    "reviews": [
+        # _id в конце — порядок страниц get_reviews: отзывы с одинаковым created_at
+        ([("branch_id", 1), ("created_at", -1), ("_id", -1)], {}),
+        ([("item_id", 1), ("created_at", -1), ("_id", -1)], {"sparse": True}),
+        ([("created_at", -1), ("_id", -1)], {}),
+        ([("comment", "text")], {"name": "comment_text", "default_language": "russian"}),
+    ],
+    DAILY: [
+        ([("day", 1)], {"expireAfterSeconds": DAILY_RETENTION_DAYS * 86400}),
+        ([("scope", 1), ("ref_id", 1), ("day", 1)], {}),
+    ],
+    "logs": [
+        ([("timestamp", -1)], {}),
+        ([("user_id", 1), ("timestamp", -1)], {}),
+        ([("action", 1), ("timestamp", -1)], {}),
+        # ключ дедупликации при переносе спула (app/log_spool.py)
+        ([("log_id", 1)], {"unique": True, "sparse": True}),
+    ],
+    ARCHIVE: [
+        ([("meta.user_id", 1), ("timestamp", -1)], {}),
+        ([("meta.action", 1), ("timestamp", -1)], {}),
+    ],
+    HISTORY: [
+        ([("order_id", 1)], {"unique": True}),
+        ([("branch_id", 1), ("updated_at", -1)], {}),
+    ],
+}
+
+def ensure_indexes():
+    ensure_archive_collection()
+    db = get_mongo_db()
+    for collection, indexes in MONGO_INDEXES.items():
+        for keys, options in indexes:
+            db[collection].create_index(keys, **options)
 
 # ===== Reviews =====
-def add_review(customer_id, branch_id, rating, comment, sentiment):
+REVIEWS_PAGE_SIZE = 50
+
+def _review_doc(customer_id, branch_id, rating, comment, sentiment, item_id=None):
     if not (1 <= sentiment <= 5):
         raise ValueError("sentiment должен быть числом от 1 до 5")
-    reviews.insert_one({
+    doc = {
         "customer_id": customer_id,
         "branch_id": branch_id,
         "rating": rating,
         "comment": comment,
         "sentiment": sentiment,
         "created_at": datetime.utcnow()
-    })
+    }
+    if item_id is not None:
+        doc["item_id"] = item_id
+    return doc
+
+def add_review(customer_id, branch_id, rating, comment, sentiment, item_id=None):
+    doc = _review_doc(customer_id, branch_id, rating, comment, sentiment, item_id)
+    _reviews().insert_one(doc)
+    # сводки для дашбордов (app/review_analytics.py) — инкрементально
+    record_review(doc)
 
-def get_reviews(branch_id=None):
+REVIEWS_PAGE_SORT = [("created_at", -1), ("_id", -1)]
+
+def review_filter(branch_id=None, item_id=None, min_rating=None, max_rating=None,
+                  sentiment=None, since=None, until=None, before=None, before_id=None):
+    """
+    Условие find() для отзывов; before и before_id — created_at и _id последнего отзыва
+    предыдущей страницы (без before_id отзывы с тем же created_at пропускаются)
+    """
     query = {}
     if branch_id:
         query["branch_id"] = branch_id
-    return list(reviews.find(query, {"_id": 0}))
+    if item_id:
+        query["item_id"] = item_id
+    rating = {}
+    if min_rating is not None:
+        rating["$gte"] = min_rating
+    if max_rating is not None:
+        rating["$lte"] = max_rating
+    if rating:
+        query["rating"] = rating
+    if sentiment is not None:
+        query["sentiment"] = {"$in": list(sentiment)} if isinstance(sentiment, (list, tuple, set)) else sentiment
+    created = {}
+    if since is not None:
+        created["$gte"] = since
+    if until is not None:
+        created["$lt"] = until
+    if before is not None and before_id is None:
+        created["$lt"] = min(before, created.get("$lt", before))
+    if created:
+        query["created_at"] = created
+    if before is not None and before_id is not None:
+        query["$or"] = [{"created_at": {"$lt": before}},
+                        {"created_at": before, "_id": {"$lt": ObjectId(before_id)}}]
+    return query
+
+def get_reviews(branch_id=None, item_id=None, min_rating=None, max_rating=None, sentiment=None,
+                since=None, until=None, before=None, before_id=None, limit=None):
+    """
+    Отзывы от новых к старым. Без limit — все подходящие (как раньше);
+    с limit — страница вместе с _id, следующая запрашивается с
+    before=<created_at>, before_id=<_id> последнего отзыва
+    """
+    query = review_filter(branch_id, item_id, min_rating, max_rating, sentiment, since, until, before, before_id)
+    if limit is None and before is None:
+        return list(_reviews().find(query, {"_id": 0}))
+    return list(_reviews().find(query).sort(REVIEWS_PAGE_SORT).limit(limit or REVIEWS_PAGE_SIZE))
+
+def search_reviews(text_query, branch_id=None, limit=20):
+    """Полнотекстовый поиск по comment (текстовый индекс comment_text), лучшие совпадения первыми"""
+    query = {"$text": {"$search": text_query}}
+    if branch_id:
+        query["branch_id"] = branch_id
+    return list(_reviews()
+                .find(query, {"_id": 0, "score": {"$meta": "textScore"}})
+                .sort([("score", {"$meta": "textScore"})])
+                .limit(limit))
 
 # ===== Logs =====
-def log_action(user_id, action, details=None):
-    logs.insert_one({
+# Записи уходят в очередь и пишутся фоновым потоком через insert_many;
+# размер пачки, интервал и политика переполнения — в настройках (log_*).
+# Если MongoDB недоступна или не укладывается в бюджет, пачка уходит в спул на диске (app/log_spool.py)
+_log_writer = None
+_log_writer_lock = threading.Lock()
+
+def get_log_writer():
+    global _log_writer
+    if _log_writer is None:
+        with _log_writer_lock:
+            if _log_writer is None:
+                s = get_settings()
+                _log_writer = BatchWriter(
+                    write_logs,
+                    batch_size=s.log_batch_size,
+                    flush_interval=s.log_flush_interval,
+                    max_queue=s.log_queue_size,
+                    overflow=s.log_overflow_policy,
+                    sample_rate=s.log_sample_rate,
+                    name="mongo-log-writer",
+                )
+                register_shutdown(_log_writer)
+    return _log_writer
+
+def log_action(user_id, action, details=None, block=True):
+    """
+    Поставить запись в очередь журнала. block=False — для event loop: при полной очереди
+    (политика block) запись не ждёт, а уходит в буфер спула — на диск её пишет фоновый поток
+    """
+    doc = {
+        "log_id": new_log_id(),
         "user_id": user_id,
         "action": action,
         "details": details,
         "timestamp": datetime.utcnow()
-    })
+    }
+    try:
+        get_log_writer().enqueue(doc, block=block)
+    except queue.Full:
+        spool_overflow([doc])
+
+def flush_logs(timeout=None):
+    return get_log_writer().flush(timeout)
+
+def close_logs(timeout=None):
+    get_log_writer().close(timeout)
+
+def get_log_stats():
+    data = get_log_writer().stats()
+    data.update(spool_stats())
+    return data
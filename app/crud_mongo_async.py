@@ -0,0 +1,52 @@
+from datetime import datetime
+from app import crud_mongo
+from app.review_analytics import arecord_review
+from app.db import get_async_mongo_db
+from app.log_spool import new_log_id
+
+# Асинхронный двойник crud_mongo поверх pymongo AsyncMongoClient
+def _reviews():
+    return get_async_mongo_db()["reviews"]
+
+def _logs():
+    return get_async_mongo_db()["logs"]
+
+# ===== Reviews =====
+async def add_review(customer_id, branch_id, rating, comment, sentiment, item_id=None):
+    doc = crud_mongo._review_doc(customer_id, branch_id, rating, comment, sentiment, item_id)
+    await _reviews().insert_one(doc)
+    await arecord_review(doc)
+
+async def get_reviews(branch_id=None, item_id=None, min_rating=None, max_rating=None, sentiment=None,
+                      since=None, until=None, before=None, before_id=None, limit=None):
+    query = crud_mongo.review_filter(branch_id, item_id, min_rating, max_rating, sentiment, since, until,
+                                     before, before_id)
+    if limit is None and before is None:
+        return await _reviews().find(query, {"_id": 0}).to_list()
+    cursor = _reviews().find(query).sort(crud_mongo.REVIEWS_PAGE_SORT).limit(limit or crud_mongo.REVIEWS_PAGE_SIZE)
+    return await cursor.to_list()
+
+async def search_reviews(text_query, branch_id=None, limit=20):
+    query = {"$text": {"$search": text_query}}
+    if branch_id:
+        query["branch_id"] = branch_id
+    cursor = (_reviews()
+              .find(query, {"_id": 0, "score": {"$meta": "textScore"}})
+              .sort([("score", {"$meta": "textScore"})])
+              .limit(limit))
+    return await cursor.to_list()
+
+# ===== Logs =====
+async def log_action(user_id, action, details=None):
+    # запись уходит в общую фоновую очередь и не ждёт ни MongoDB, ни места в очереди
+    crud_mongo.log_action(user_id, action, details, block=False)
+
+async def log_action_now(user_id, action, details=None):
+    """Записать в журнал сразу, дождавшись подтверждения MongoDB."""
+    await _logs().insert_one({
+        "log_id": new_log_id(),
+        "user_id": user_id,
+        "action": action,
+        "details": details,
+        "timestamp": datetime.utcnow()
+    })
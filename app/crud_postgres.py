@@ -1,45 +1,270 @@
-from sqlalchemy import create_engine, text
+import re
+from sqlalchemy import text
 from datetime import datetime
 from decimal import Decimal
 from app.crud_mongo import log_action  # твоя функция логирования
+from app.cache import QueryCache
+from app.db import after_commit, begin, connect_read, current_unit_of_work, get_engine, unit_of_work
+from app.order_feed import (
+    EVENT_CREATED, EVENT_DELETED, EVENT_STATUS, order_event, publish_order_events,
+)
+from app.partitions import maybe_ensure_order_partitions
+from app.pubsub import PostgresBroker
+from app.records import SHAPE_COLUMNS, SHAPE_DICT, check_shape, row_count, shape_partition, shape_rows
+from app.statements import update_row, update_rows
 
 # ===== Настройки подключения =====
-POSTGRES_USER = "postgres"
-POSTGRES_PASSWORD = "postgres"
-POSTGRES_HOST = "localhost"
-POSTGRES_DB = "cafe_db"
+# Параметры подключения и пула — в app/settings.py (переменные окружения / CAFE_CONFIG),
+# движок создаётся лениво при первом запросе.
+# Чтение (connect_read) может уйти на реплику из replica_urls, запись (begin) — всегда на основной
+# Несколько вызовов одной транзакцией: with unit_of_work(): ... (app/db.py)
+# Функции чтения списков принимают shape="dict" | "record" | "columns" (app/records.py):
+# для больших выборок — записи с __slots__ или колонки NumPy вместо списка словарей
 
-engine = create_engine(f"postgresql://{POSTGRES_USER}:{POSTGRES_PASSWORD}@{POSTGRES_HOST}:5432/{POSTGRES_DB}")
+# ===== Кэш справочников: сущность -> (TTL в секундах, максимум записей) =====
+CACHE_SETTINGS = {
+    "menu_items": (300, 1),
+    "menu": (300, 1),
+    "menu_categories": (600, 1),
+    "branches": (600, 1),
+    "suppliers": (600, 1),
+    "supplier_items": (600, 256),
+    # постоянные гости: клиент по телефону / email (ключи "phone:...", "email:...")
+    "customers_hot": (120, 2048),
+}
+
+query_cache = QueryCache(CACHE_SETTINGS)
 
 # ===== ВСПОМОГАТЕЛЬНЫЕ =====
+def _safe_details(value):
+    """Decimal -> float для записи в MongoDB"""
+    if isinstance(value, Decimal):
+        return float(value)
+    if isinstance(value, dict):
+        return {k: _safe_details(v) for k, v in value.items()}
+    if isinstance(value, list):
+        return [_safe_details(v) for v in value]
+    return value
+
 def safe_log(user_id, action, details=None):
     """
     Логирование с конверсией Decimal -> float
     """
-    def convert(value):
-        if isinstance(value, Decimal):
-            return float(value)
-        if isinstance(value, dict):
-            return {k: convert(v) for k, v in value.items()}
-        if isinstance(value, list):
-            return [convert(v) for v in value]
-        return value
+    # внутри unit_of_work запись уходит в журнал после фиксации, при откате — не пишется
+    after_commit(log_action, user_id=user_id, action=action, details=_safe_details(details or {}))
+
+def cached_select(entity, key, query, params=None, use_cache=True):
+    """
+    SELECT через кэш справочников; use_cache=False читает из базы в обход кэша
+    """
+    def load():
+        with connect_read() as conn:
+            result = conn.execute(text(query), params or {})
+            return tuple(dict(r._mapping) for r in result)
+    if current_unit_of_work() is not None:
+        # единица работы читает свои незафиксированные строки: в общий кэш их не кладём
+        # (инвалидация отложена до commit, а при откате её не будет вовсе)
+        return [dict(r) for r in load()]
+    rows = query_cache.get_or_load(entity, key, load, bypass=not use_cache)
+    return [dict(r) for r in rows]
+
+def enable_cache_sync(broker=None):
+    """
+    Общая инвалидация кэша между процессами (по умолчанию через LISTEN/NOTIFY)
+    """
+    query_cache.attach(broker or PostgresBroker(get_engine()))
+
+def get_cache_stats():
+    return query_cache.stats()
+
+# ===== Постраничное чтение и потоковая выгрузка =====
+STREAM_CHUNK_SIZE = 1000
+
+def paged_query(query, key_column, conditions=(), after_id=None, limit=None):
+    """
+    Дописывает к запросу фильтры и keyset-пагинацию по key_column
+    """
+    conditions = list(conditions)
+    if after_id is not None:
+        conditions.append(f"{key_column} > :after_id")
+    if conditions:
+        query += " WHERE " + " AND ".join(conditions)
+    if after_id is not None or limit is not None:
+        query += f" ORDER BY {key_column}"
+    if limit is not None:
+        query += " LIMIT :limit"
+    return query
 
-    safe_details = convert(details or {})
-    log_action(user_id=user_id, action=action, details=safe_details)
+def stream_rows(query, params, chunk_size=STREAM_CHUNK_SIZE, shape=SHAPE_DICT, name="Row",
+                action=None, details=None):
+    """
+    Серверный курсор: в памяти одновременно не больше chunk_size строк.
+    shape="dict"/"record" — по строке, shape="columns" — по порции {колонка: массив}.
+    action — запись в журнал, когда поток закончен (дочитан, закрыт раньше или упал):
+    сколько строк отдано и дочитан ли он до конца
+    """
+    check_shape(shape)
+    rows, completed = 0, False
+    try:
+        with connect_read() as conn:
+            result = conn.execute(text(query), params, execution_options={"yield_per": chunk_size})
+            if shape == SHAPE_DICT:
+                for r in result:
+                    rows += 1
+                    yield dict(r._mapping)
+            else:
+                names = list(result.keys())
+                for partition in result.partitions(chunk_size):
+                    for item in shape_partition(names, partition, shape, name):
+                        rows += row_count(item) if shape == SHAPE_COLUMNS else 1
+                        yield item
+        completed = True
+    finally:
+        if action:
+            safe_log(0, action, {**(details or {}), "rows": rows, "completed": completed})
 
 
 # ===================================================
 # ===============  КЛИЕНТЫ  ========================
 # ===================================================
 
-def get_customers():
-    with engine.connect() as conn:
-        result = conn.execute(text("SELECT * FROM Customer"))
-        return [dict(r._mapping) for r in result]
+def get_customers(after_id=None, limit=None, shape=SHAPE_DICT):
+    query = paged_query("SELECT * FROM Customer", "customer_id", after_id=after_id, limit=limit)
+    with connect_read() as conn:
+        result = conn.execute(text(query), {"after_id": after_id, "limit": limit})
+        return shape_rows(result, shape, "Customer")
+
+def iter_customers(chunk_size=STREAM_CHUNK_SIZE, shape=SHAPE_DICT):
+    return stream_rows("SELECT * FROM Customer", {}, chunk_size, shape, "Customer", "iter_customers")
+
+# ===== Телефон и поиск =====
+CUSTOMER_SEARCH_LIMIT = 20
+SEARCH_PREFIX = "prefix"
+SEARCH_FUZZY = "fuzzy"
+
+def normalize_phone(phone):
+    """
+    Телефон к одному виду: только цифры, ведущий + (или 00) сохраняется как +.
+    "+31-620-111-333" -> "+31620111333", "8 (999) 123-45-67" -> "89991234567".
+    Те же правила — у SQL-функции normalize_phone (migrations/004_customer_search.sql)
+    """
+    if phone is None:
+        return None
+    raw = str(phone).strip()
+    digits = re.sub(r"\D", "", raw)
+    if not digits:
+        raise ValueError(f"Некорректный номер телефона: {phone!r}")
+    if raw.startswith("+"):
+        return "+" + digits
+    if raw.startswith("00"):
+        return "+" + digits[2:]
+    return digits
+
+def _hot_keys(customer):
+    keys = []
+    if customer.get("phone"):
+        keys.append(f"phone:{customer['phone']}")
+    if customer.get("email"):
+        keys.append(f"email:{customer['email'].lower()}")
+    return keys
+
+def _forget_customers(*customers):
+    for customer in customers:
+        for key in _hot_keys(customer or {}):
+            after_commit(query_cache.invalidate, "customers_hot", key)
+
+def _like_prefix(value):
+    return re.sub(r"([\\%_])", r"\\\1", value.lower()) + "%"
+
+FIND_BY_PHONE_SQL = "SELECT * FROM Customer WHERE phone = :phone"
+# при нескольких клиентах с одним email — самый ранний
+FIND_BY_EMAIL_SQL = "SELECT * FROM Customer WHERE lower(email) = :email ORDER BY customer_id LIMIT 1"
+SEARCH_PREFIX_SQL = """
+    SELECT * FROM Customer
+    WHERE lower(name) COLLATE "C" LIKE :pattern
+    ORDER BY lower(name) COLLATE "C", customer_id
+    LIMIT :limit
+"""
+SEARCH_TRGM_SQL = """
+    SELECT *, similarity(name, :query) AS score FROM Customer
+    WHERE name % :query
+    ORDER BY name <-> :query, customer_id
+    LIMIT :limit
+"""
+# без pg_trgm: подстрока без индекса
+SEARCH_SUBSTRING_SQL = """
+    SELECT * FROM Customer
+    WHERE lower(name) LIKE '%' || :substring
+    ORDER BY customer_id
+    LIMIT :limit
+"""
+
+_trigram_available = None
+
+def _has_trigram(conn):
+    global _trigram_available
+    if _trigram_available is None:
+        _trigram_available = conn.execute(
+            text("SELECT EXISTS (SELECT 1 FROM pg_extension WHERE extname = 'pg_trgm')")).scalar()
+    return _trigram_available
+
+def _search_query(conn, query, mode, limit):
+    """(SQL, параметры) для search_customers"""
+    query = (query or "").strip()
+    if not query:
+        raise ValueError("Пустой поисковый запрос")
+    if limit is None or limit < 1:
+        raise ValueError("limit должен быть положительным")
+    if mode == SEARCH_PREFIX:
+        return SEARCH_PREFIX_SQL, {"pattern": _like_prefix(query), "limit": limit}
+    if mode == SEARCH_FUZZY:
+        if _has_trigram(conn):
+            return SEARCH_TRGM_SQL, {"query": query, "limit": limit}
+        return SEARCH_SUBSTRING_SQL, {"substring": _like_prefix(query), "limit": limit}
+    raise ValueError(f"Неизвестный режим поиска: {mode}")
+
+def _find_customer(key, query, params, use_cache):
+    def load():
+        with connect_read() as conn:
+            row = conn.execute(text(query), params).fetchone()
+            return dict(row._mapping) if row else None
+    if current_unit_of_work() is not None:
+        customer = load()  # незафиксированные строки — мимо общего кэша, как в cached_select
+    else:
+        customer = query_cache.get_or_load("customers_hot", key, load, bypass=not use_cache)
+    return dict(customer) if customer else None
+
+def find_customer_by_phone(phone, use_cache=True):
+    """Клиент по телефону в любом написании (индекс UNIQUE phone); None, если нет"""
+    phone = normalize_phone(phone)
+    customer = _find_customer(f"phone:{phone}", FIND_BY_PHONE_SQL, {"phone": phone}, use_cache)
+    safe_log(customer["customer_id"] if customer else 0, "find_customer_by_phone", {"found": customer is not None})
+    return customer
+
+def find_customer_by_email(email, use_cache=True):
+    """Клиент по email без учёта регистра; None, если нет"""
+    email = (email or "").strip().lower()
+    if not email:
+        raise ValueError("Пустой email")
+    customer = _find_customer(f"email:{email}", FIND_BY_EMAIL_SQL, {"email": email}, use_cache)
+    safe_log(customer["customer_id"] if customer else 0, "find_customer_by_email", {"found": customer is not None})
+    return customer
+
+def search_customers(query, mode=SEARCH_PREFIX, limit=CUSTOMER_SEARCH_LIMIT, shape=SHAPE_DICT):
+    """
+    Поиск по имени: mode="prefix" — имя начинается с query (без учёта регистра),
+    mode="fuzzy" — похожие имена по триграммам, ближайшие первыми (с полем score).
+    Не больше limit клиентов
+    """
+    with connect_read() as conn:
+        sql, params = _search_query(conn, query, mode, limit)
+        customers = shape_rows(conn.execute(text(sql), params), shape, "Customer")
+    safe_log(0, "search_customers", {"query": query, "mode": mode, "found": row_count(customers)})
+    return customers
 
 def add_customer(name, phone, email):
-    with engine.begin() as conn:
+    phone = normalize_phone(phone)
+    with begin() as conn:
         result = conn.execute(
             text("""
                 INSERT INTO Customer (name, phone, email, registration_date)
@@ -49,19 +274,32 @@ def add_customer(name, phone, email):
             {"name": name, "phone": phone, "email": email}
         )
         customer_id = result.scalar()
+    # в кэше мог остаться «не найден» для этого телефона или email
+    _forget_customers({"phone": phone, "email": email})
     safe_log(customer_id, "add_customer", {"name": name, "phone": phone, "email": email})
     return customer_id
 
 def update_customer(customer_id, **kwargs):
-    fields = ', '.join([f"{k} = :{k}" for k in kwargs])
-    kwargs["customer_id"] = customer_id
-    with engine.begin() as conn:
-        conn.execute(text(f"UPDATE Customer SET {fields} WHERE customer_id=:customer_id"), kwargs)
+    """Обновить поля клиента; вернуть обновлённую строку (None, если клиента нет)"""
+    if kwargs.get("phone") is not None:
+        kwargs["phone"] = normalize_phone(kwargs["phone"])
+    with begin() as conn:
+        previous = None
+        if "phone" in kwargs or "email" in kwargs:
+            row = conn.execute(text("SELECT phone, email FROM Customer WHERE customer_id=:id"),
+                               {"id": customer_id}).fetchone()
+            previous = dict(row._mapping) if row else None
+        customer = update_row(conn, "Customer", customer_id, kwargs)
+    _forget_customers(previous, customer)
     safe_log(customer_id, "update_customer", kwargs)
+    return customer
 
 def delete_customer(customer_id):
-    with engine.begin() as conn:
-        conn.execute(text("DELETE FROM Customer WHERE customer_id=:id"), {"id": customer_id})
+    with begin() as conn:
+        row = conn.execute(text("DELETE FROM Customer WHERE customer_id=:id RETURNING phone, email"),
+                           {"id": customer_id}).fetchone()
+    if row:
+        _forget_customers(dict(row._mapping))
     safe_log(customer_id, "delete_customer")
 
 
@@ -70,7 +308,7 @@ def delete_customer(customer_id):
 # ===================================================
 
 def add_employee(name, position, hire_date, salary, email, is_active=True):
-    with engine.begin() as conn:
+    with begin() as conn:
         result = conn.execute(
             text("""
                 INSERT INTO Employee (name, position, hire_date, salary, email, is_active)
@@ -85,7 +323,7 @@ def add_employee(name, position, hire_date, salary, email, is_active=True):
     return employee_id
 
 def assign_employee_to_branch(employee_id, branch_id):
-    with engine.begin() as conn:
+    with begin() as conn:
         conn.execute(
             text("""
                 INSERT INTO EmployeeBranch (employee_id, branch_id, assigned_date)
@@ -96,31 +334,59 @@ def assign_employee_to_branch(employee_id, branch_id):
         )
     safe_log(employee_id, "assign_employee_to_branch", {"branch_id": branch_id})
 
-def get_employees(branch_id=None):
+def _employees_query(branch_id=None, after_id=None, limit=None):
     query = """
         SELECT e.*, eb.branch_id 
         FROM Employee e
         LEFT JOIN EmployeeBranch eb ON e.employee_id = eb.employee_id
     """
-    params = {}
     if branch_id:
-        query += " WHERE eb.branch_id=:branch_id"
-        params["branch_id"] = branch_id
-    with engine.connect() as conn:
+        # с фильтром по филиалу на каждого сотрудника приходится ровно одна строка
+        return paged_query(query, "e.employee_id", ["eb.branch_id=:branch_id"], after_id, limit)
+    if limit is None:
+        return paged_query(query, "e.employee_id", after_id=after_id)
+    # без фильтра сотрудник может занимать несколько строк: limit считаем по сотрудникам
+    return query + """
+        WHERE e.employee_id IN (
+            SELECT employee_id FROM Employee
+            WHERE employee_id > COALESCE(:after_id, 0)
+            ORDER BY employee_id LIMIT :limit
+        )
+        ORDER BY e.employee_id, eb.branch_id
+    """
+
+def get_employees(branch_id=None, after_id=None, limit=None, shape=SHAPE_DICT):
+    query = _employees_query(branch_id, after_id, limit)
+    params = {"branch_id": branch_id, "after_id": after_id, "limit": limit}
+    with connect_read() as conn:
         result = conn.execute(text(query), params)
-        employees = [dict(r._mapping) for r in result]
+        employees = shape_rows(result, shape, "Employee")
     safe_log(0, "get_employees", {"branch_id": branch_id})
     return employees
 
+def iter_employees(branch_id=None, chunk_size=STREAM_CHUNK_SIZE, shape=SHAPE_DICT):
+    return stream_rows(_employees_query(branch_id), {"branch_id": branch_id}, chunk_size, shape, "Employee",
+                       "iter_employees", {"branch_id": branch_id})
+
 def update_employee(employee_id, **kwargs):
-    fields = ', '.join([f"{k} = :{k}" for k in kwargs])
-    kwargs["employee_id"] = employee_id
-    with engine.begin() as conn:
-        conn.execute(text(f"UPDATE Employee SET {fields} WHERE employee_id=:employee_id"), kwargs)
+    with begin() as conn:
+        employee = update_row(conn, "Employee", employee_id, kwargs)
     safe_log(employee_id, "update_employee", kwargs)
+    return employee
+
+def deactivate_employees(employee_ids):
+    """Снять с работы сразу многих сотрудников одним запросом; вернуть обновлённые строки"""
+    employee_ids = list(dict.fromkeys(employee_ids))
+    if not employee_ids:
+        return []
+    with begin() as conn:
+        employees = update_rows(conn, "Employee",
+                                [{"employee_id": i, "is_active": False} for i in employee_ids])
+    safe_log(0, "deactivate_employees", {"employee_ids": [e["employee_id"] for e in employees]})
+    return employees
 
 def remove_employee(employee_id):
-    with engine.begin() as conn:
+    with begin() as conn:
         conn.execute(text("DELETE FROM Employee WHERE employee_id=:id"), {"id": employee_id})
     safe_log(employee_id, "remove_employee")
 
@@ -130,22 +396,21 @@ def remove_employee(employee_id):
 # ===================================================
 
 def add_menu_category(name, description=None):
-    with engine.begin() as conn:
+    with begin() as conn:
         conn.execute(
             text("INSERT INTO MenuCategory (name, description) VALUES (:name, :description)"),
             {"name": name, "description": description}
         )
+    after_commit(query_cache.invalidate, "menu_categories")
     safe_log(0, "add_menu_category", {"name": name, "description": description})
 
-def get_menu_categories():
-    with engine.connect() as conn:
-        result = conn.execute(text("SELECT * FROM MenuCategory"))
-        categories = [dict(r._mapping) for r in result]
+def get_menu_categories(use_cache=True):
+    categories = cached_select("menu_categories", None, "SELECT * FROM MenuCategory", use_cache=use_cache)
     safe_log(0, "get_menu_categories")
     return categories
 
 def add_menu_item(name, description, price, calories, is_available=True, image_url=None):
-    with engine.begin() as conn:
+    with begin() as conn:
         conn.execute(
             text("""
                 INSERT INTO MenuItem (name, description, price, calories, is_available, image_url)
@@ -154,10 +419,12 @@ def add_menu_item(name, description, price, calories, is_available=True, image_u
             {"name": name, "description": description, "price": price,
              "calories": calories, "is_available": is_available, "image_url": image_url}
         )
+    after_commit(query_cache.invalidate, "menu_items")
+    after_commit(query_cache.invalidate, "menu")
     safe_log(0, "add_menu_item", {"name": name, "price": price})
 
 def assign_item_to_category(item_id, category_id):
-    with engine.begin() as conn:
+    with begin() as conn:
         conn.execute(
             text("""
                 INSERT INTO MenuCategoryItem (category_id, item_id)
@@ -166,31 +433,57 @@ def assign_item_to_category(item_id, category_id):
             """),
             {"category_id": category_id, "item_id": item_id}
         )
+    after_commit(query_cache.invalidate, "menu")
     safe_log(0, "assign_item_to_category", {"item_id": item_id, "category_id": category_id})
 
-def get_menu():
+def get_menu(use_cache=True):
     query = """
         SELECT mi.item_id, mi.name, mi.price, mi.is_available, mc.name AS category
         FROM MenuItem mi
         LEFT JOIN MenuCategoryItem mci ON mi.item_id = mci.item_id
         LEFT JOIN MenuCategory mc ON mci.category_id = mc.category_id
     """
-    with engine.connect() as conn:
-        result = conn.execute(text(query))
-        menu = [dict(r._mapping) for r in result]
+    menu = cached_select("menu", None, query, use_cache=use_cache)
     safe_log(0, "get_menu")
     return menu
 
 def update_menu_item(item_id, **kwargs):
-    fields = ', '.join([f"{k} = :{k}" for k in kwargs])
-    kwargs["item_id"] = item_id
-    with engine.begin() as conn:
-        conn.execute(text(f"UPDATE MenuItem SET {fields} WHERE item_id=:item_id"), kwargs)
+    with begin() as conn:
+        item = update_row(conn, "MenuItem", item_id, kwargs)
+    after_commit(query_cache.invalidate, "menu_items")
+    after_commit(query_cache.invalidate, "menu")
+    if "name" in kwargs:
+        after_commit(query_cache.invalidate, "supplier_items")
     safe_log(item_id, "update_menu_item", kwargs)
+    return item
+
+def update_menu_items(rows):
+    """
+    Пакетное обновление пунктов меню: rows — [{"item_id": ..., поле: значение, ...}, ...]
+    """
+    rows = list(rows)
+    if not rows:
+        return []
+    with begin() as conn:
+        items = update_rows(conn, "MenuItem", rows)
+    after_commit(query_cache.invalidate, "menu_items")
+    after_commit(query_cache.invalidate, "menu")
+    if any("name" in row for row in rows):
+        after_commit(query_cache.invalidate, "supplier_items")
+    safe_log(0, "update_menu_items", {"item_ids": [i["item_id"] for i in items]})
+    return items
+
+def reprice_menu_items(prices):
+    """Новые цены: {item_id: price} или [(item_id, price), ...] — одним запросом"""
+    prices = dict(prices)
+    return update_menu_items([{"item_id": item_id, "price": price} for item_id, price in prices.items()])
 
 def remove_menu_item(item_id):
-    with engine.begin() as conn:
+    with begin() as conn:
         conn.execute(text("DELETE FROM MenuItem WHERE item_id=:item_id"), {"item_id": item_id})
+    after_commit(query_cache.invalidate, "menu_items")
+    after_commit(query_cache.invalidate, "menu")
+    after_commit(query_cache.invalidate, "supplier_items")
     safe_log(item_id, "remove_menu_item")
 
 
@@ -199,69 +492,129 @@ def remove_menu_item(item_id):
 # ===================================================
 
 def create_order(customer_id, branch_id, employee_id, total_amount):
-    with engine.begin() as conn:
+    maybe_ensure_order_partitions()
+    with begin() as conn:
         result = conn.execute(
             text("""
                 INSERT INTO "Order" (customer_id, branch_id, employee_id, total_amount, status)
                 VALUES (:customer_id, :branch_id, :employee_id, :total_amount, 'created')
-                RETURNING order_id
+                RETURNING *
             """),
             {"customer_id": customer_id, "branch_id": branch_id,
              "employee_id": employee_id, "total_amount": total_amount}
         )
-        order_id = result.scalar()
-    safe_log(customer_id, "create_order", {"order_id": order_id, "total_amount": total_amount})
-    return order_id
-
-def get_orders():
-    with engine.connect() as conn:
-        result = conn.execute(text('SELECT * FROM "Order"'))
-        orders = [dict(r._mapping) for r in result]
-    safe_log(0, "get_orders")
+        order = dict(result.fetchone()._mapping)
+    after_commit(publish_order_events, [order_event(EVENT_CREATED, order)])
+    safe_log(customer_id, "create_order", {"order_id": order["order_id"], "total_amount": total_amount})
+    return order["order_id"]
+
+def _order_filters(status=None, branch_id=None, since=None, until=None):
+    conditions = []
+    if status is not None:
+        if isinstance(status, str):
+            conditions.append("status = :status")
+        else:
+            conditions.append("status = ANY(:status)")
+    if branch_id is not None:
+        conditions.append("branch_id = :branch_id")
+    if since is not None:
+        conditions.append("order_time >= :since")
+    if until is not None:
+        conditions.append("order_time < :until")
+    params = {"status": status if status is None or isinstance(status, str) else list(status),
+              "branch_id": branch_id, "since": since, "until": until}
+    return conditions, params
+
+def get_orders(after_id=None, limit=None, status=None, branch_id=None, since=None, until=None,
+               shape=SHAPE_DICT):
+    conditions, params = _order_filters(status, branch_id, since, until)
+    query = paged_query('SELECT * FROM "Order"', "order_id", conditions, after_id, limit)
+    with connect_read() as conn:
+        result = conn.execute(text(query), dict(params, after_id=after_id, limit=limit))
+        orders = shape_rows(result, shape, "Order")
+    safe_log(0, "get_orders", {"after_id": after_id, "limit": limit})
     return orders
 
+def iter_orders(status=None, branch_id=None, since=None, until=None, chunk_size=STREAM_CHUNK_SIZE,
+                shape=SHAPE_DICT):
+    conditions, params = _order_filters(status, branch_id, since, until)
+    return stream_rows(paged_query('SELECT * FROM "Order"', "order_id", conditions), params, chunk_size,
+                       shape, "Order", "iter_orders", {"branch_id": branch_id})
+
+# прежний статус берётся из заблокированной строки, чтобы событие ленты было точным
+UPDATE_ORDER_STATUS_SQL = """
+    UPDATE "Order" o SET status = :status
+    FROM (SELECT order_id, status FROM "Order" WHERE order_id = :id FOR UPDATE) old
+    WHERE o.order_id = old.order_id
+    RETURNING o.*, old.status AS previous_status
+"""
+
+def _status_events(rows):
+    events = []
+    for row in rows:
+        order = dict(row._mapping)
+        previous = order.pop("previous_status")
+        if previous != order["status"]:
+            events.append(order_event(EVENT_STATUS, order, previous))
+    return events
+
 def update_order_status(order_id, status):
-    with engine.begin() as conn:
-        conn.execute(text('UPDATE "Order" SET status=:status WHERE order_id=:id'),
-                     {"status": status, "id": order_id})
+    with begin() as conn:
+        events = _status_events(conn.execute(text(UPDATE_ORDER_STATUS_SQL), {"status": status, "id": order_id}))
+    after_commit(publish_order_events, events)
     safe_log(0, "update_order_status", {"order_id": order_id, "status": status})
 
 def delete_order(order_id):
-    with engine.begin() as conn:
-        conn.execute(text('DELETE FROM "Order" WHERE order_id=:id'), {"id": order_id})
+    with begin() as conn:
+        rows = conn.execute(text('DELETE FROM "Order" WHERE order_id=:id RETURNING *'), {"id": order_id})
+        events = [order_event(EVENT_DELETED, dict(r._mapping)) for r in rows]
+    after_commit(publish_order_events, events)
     safe_log(0, "delete_order", {"order_id": order_id})
 
 def get_order(order_id):
-    with engine.connect() as conn:
+    with connect_read() as conn:
         result = conn.execute(text('SELECT * FROM "Order" WHERE order_id=:id'), {"id": order_id}).fetchone()
         order = dict(result._mapping) if result else None
     safe_log(0, "get_order", {"order_id": order_id})
     return order
 
-def get_orders_by_customer(customer_id):
-    with engine.connect() as conn:
+def get_orders_by_customer(customer_id, since=None, until=None, shape=SHAPE_DICT):
+    """
+    Заказы клиента от новых к старым; since/until ограничивают order_time —
+    читаются только секции нужных месяцев
+    """
+    conditions, params = _order_filters(since=since, until=until)
+    where = " AND ".join(["customer_id = :cid"] + conditions)
+    with connect_read() as conn:
         result = conn.execute(
-            text('SELECT * FROM "Order" WHERE customer_id=:cid ORDER BY order_time DESC'),
-            {"cid": customer_id}
+            text(f'SELECT * FROM "Order" WHERE {where} ORDER BY order_time DESC'),
+            dict(params, cid=customer_id)
         )
-        orders = [dict(r._mapping) for r in result]
+        orders = shape_rows(result, shape, "Order")
     safe_log(customer_id, "get_orders_by_customer")
     return orders
 
+# order_time — ключ секции: позиция ложится в секцию месяца своего заказа
+ADD_ORDER_ITEM_SQL = """
+    INSERT INTO OrderItem (order_id, order_time, item_id, quantity, price)
+    SELECT o.order_id, o.order_time, :item_id, :quantity, :price
+    FROM "Order" o WHERE o.order_id = :order_id
+"""
+
 def add_order_item(order_id, item_id, quantity):
-    with engine.begin() as conn:
+    with begin() as conn:
         price = conn.execute(text("SELECT price FROM MenuItem WHERE item_id=:id"), {"id": item_id}).scalar()
-        conn.execute(
-            text("""
-                INSERT INTO OrderItem (order_id, item_id, quantity, price)
-                VALUES (:order_id, :item_id, :quantity, :price)
-            """),
+        added = conn.execute(
+            text(ADD_ORDER_ITEM_SQL),
             {"order_id": order_id, "item_id": item_id, "quantity": quantity, "price": price}
-        )
+        ).rowcount
+        if not added:
+            raise ValueError(f"Заказ не найден: {order_id}")
     safe_log(0, "add_order_item", {"order_id": order_id, "item_id": item_id, "quantity": quantity, "price": price})
 
 def update_order_total(order_id):
-    with engine.begin() as conn:
+    # Итог и так поддерживается триггером на OrderItem; здесь — полная сверка одного заказа
+    with begin() as conn:
         total = conn.execute(
             text("SELECT SUM(quantity * price) FROM OrderItem WHERE order_id=:id"),
             {"id": order_id}
@@ -271,12 +624,242 @@ def update_order_total(order_id):
     safe_log(0, "update_order_total", {"order_id": order_id, "total_amount": total or 0})
 
 
+def _create_orders(conn, orders):
+    """
+    Создание пачки заказов с позициями в рамках одной транзакции conn.
+    orders — список словарей customer_id, branch_id, employee_id, items=[(item_id, quantity), ...]
+    """
+    item_ids = sorted({item_id for o in orders for item_id, _ in o["items"]})
+    prices = dict(conn.execute(
+        text("SELECT item_id, price FROM MenuItem WHERE item_id = ANY(:ids)"),
+        {"ids": item_ids}
+    ).all())
+    missing = [i for i in item_ids if i not in prices]
+    if missing:
+        raise ValueError(f"Пункты меню не найдены: {missing}")
+    # без цены нельзя посчитать сумму заказа, а позиция с NULL-ценой выпала бы из агрегатов
+    unpriced = [i for i in item_ids if prices[i] is None]
+    if unpriced:
+        raise ValueError(f"У пунктов меню не указана цена: {unpriced}")
+
+    # id заказов выделяем заранее, чтобы связать их с позициями без опоры на порядок RETURNING
+    order_ids = conn.execute(
+        text("""SELECT nextval(pg_get_serial_sequence('"Order"', 'order_id'))
+                FROM generate_series(1, :n)"""),
+        {"n": len(orders)}
+    ).scalars().all()
+
+    # total_amount наращивает триггер по вставленным позициям (migrations/001_sales_rollups.sql)
+    created = conn.execute(
+        text("""
+            INSERT INTO "Order" (order_id, customer_id, branch_id, employee_id, total_amount, status)
+            SELECT u.order_id, u.customer_id, u.branch_id, u.employee_id, 0, 'created'
+            FROM unnest(CAST(:order_ids AS INT[]), CAST(:customer_ids AS INT[]),
+                        CAST(:branch_ids AS INT[]), CAST(:employee_ids AS INT[]))
+                 AS u(order_id, customer_id, branch_id, employee_id)
+            RETURNING *
+        """),
+        {"order_ids": order_ids,
+         "customer_ids": [o["customer_id"] for o in orders],
+         "branch_ids": [o["branch_id"] for o in orders],
+         "employee_ids": [o["employee_id"] for o in orders]}
+    )
+    result = {r.order_id: dict(r._mapping) for r in created}
+    for order_id, o in zip(order_ids, orders):
+        result[order_id]["total_amount"] = sum((prices[i] * q for i, q in o["items"]), Decimal("0.00"))
+
+    line_order_ids, line_order_times, line_item_ids, line_quantities, line_prices = [], [], [], [], []
+    for order_id, o in zip(order_ids, orders):
+        for item_id, quantity in o["items"]:
+            line_order_ids.append(order_id)
+            line_order_times.append(result[order_id]["order_time"])
+            line_item_ids.append(item_id)
+            line_quantities.append(quantity)
+            line_prices.append(prices[item_id])
+    lines = conn.execute(
+        text("""
+            INSERT INTO OrderItem (order_id, order_time, item_id, quantity, price)
+            SELECT * FROM unnest(CAST(:order_ids AS INT[]), CAST(:order_times AS TIMESTAMP[]),
+                                 CAST(:item_ids AS INT[]), CAST(:quantities AS INT[]),
+                                 CAST(:prices AS NUMERIC[]))
+            RETURNING *
+        """),
+        {"order_ids": line_order_ids, "order_times": line_order_times, "item_ids": line_item_ids,
+         "quantities": line_quantities, "prices": line_prices}
+    )
+    for order in result.values():
+        order["items"] = []
+    for r in lines:
+        result[r.order_id]["items"].append(dict(r._mapping))
+    return [result[order_id] for order_id in order_ids]
+
+def create_order_with_items(customer_id, branch_id, employee_id, items,
+                            deduct_stock=False, on_shortage="reject"):
+    """
+    deduct_stock=True — в той же транзакции списать ингредиенты (см. finalize_order)
+    """
+    maybe_ensure_order_partitions()
+    order_spec = {"customer_id": customer_id, "branch_id": branch_id,
+                  "employee_id": employee_id, "items": list(items)}
+    with begin() as conn:
+        order = _create_orders(conn, [order_spec])[0]
+        if deduct_stock:
+            order["status"] = _deduct_stock(conn, [order["order_id"]], on_shortage)[order["order_id"]]
+    after_commit(publish_order_events, [order_event(EVENT_CREATED, order)])
+    safe_log(customer_id, "create_order_with_items",
+             {"order_id": order["order_id"], "total_amount": order["total_amount"],
+              "items": [[i, q] for i, q in order_spec["items"]], "status": order["status"]})
+    return order
+
+def create_orders_batch(orders, deduct_stock=False, on_shortage="reject"):
+    orders = [dict(o, items=list(o["items"])) for o in orders]
+    if not orders:
+        return []
+    maybe_ensure_order_partitions()
+    with begin() as conn:
+        created = _create_orders(conn, orders)
+        if deduct_stock:
+            statuses = _deduct_stock(conn, [o["order_id"] for o in created], on_shortage)
+            for o in created:
+                o["status"] = statuses[o["order_id"]]
+    after_commit(publish_order_events, [order_event(EVENT_CREATED, o) for o in created])
+    safe_log(0, "create_orders_batch",
+             {"order_ids": [o["order_id"] for o in created], "count": len(created)})
+    return created
+
+
+# ===================================================
+# ===============  СПИСАНИЕ ИНГРЕДИЕНТОВ  ===========
+# ===================================================
+# Рецепты — InventoryMenuItem: сколько единиц строки склада (quantity_used) уходит
+# на одну порцию пункта меню. Строки склада принадлежат филиалам, поэтому учитываются
+# только те, что относятся к филиалу заказа.
+
+SHORTAGE_REJECT = "reject"   # нехватка -> StockShortage, транзакция откатывается
+SHORTAGE_FLAG = "flag"       # нехватка -> заказ получает статус stock_shortage, склад не трогается
+
+STATUS_CONFIRMED = "confirmed"
+STATUS_STOCK_SHORTAGE = "stock_shortage"
+
+
+class StockShortage(ValueError):
+    """Недостаточно ингредиентов; shortages — {order_id: [(item_name, нужно, есть), ...]}"""
+
+    def __init__(self, shortages):
+        self.shortages = shortages
+        details = "; ".join(f"заказ {order_id}: " + ", ".join(f"{name} (нужно {need}, есть {have})"
+                                                              for name, need, have in lines)
+                            for order_id, lines in shortages.items())
+        super().__init__(f"Недостаточно ингредиентов: {details}")
+
+
+def _deduct_stock(conn, order_ids, on_shortage=SHORTAGE_REJECT):
+    """
+    Списать ингредиенты по всем позициям заказов в транзакции conn.
+    Блокировки всегда берутся в одном порядке — заказы, затем строки склада по inventory_id,
+    поэтому параллельные заказы одного филиала ждут друг друга, но не взаимоблокируются.
+    Возвращает {order_id: новый статус}
+    """
+    if on_shortage not in (SHORTAGE_REJECT, SHORTAGE_FLAG):
+        raise ValueError(f"Неизвестная политика нехватки: {on_shortage}")
+    order_ids = sorted(set(order_ids))
+    orders = dict(conn.execute(
+        text('SELECT order_id, status FROM "Order" WHERE order_id = ANY(:ids) ORDER BY order_id FOR UPDATE'),
+        {"ids": order_ids}
+    ).all())
+    missing = [i for i in order_ids if i not in orders]
+    if missing:
+        raise ValueError(f"Заказы не найдены: {missing}")
+    processed = [i for i in order_ids if orders[i] != "created"]
+    if processed:
+        raise ValueError(f"Заказы уже подтверждены или отменены: {processed}")
+
+    # Потребность по заказам и строкам склада; строки склада блокируются по возрастанию id
+    needs = conn.execute(
+        text("""
+            WITH need AS (
+                SELECT oi.order_id, imi.inventory_id, SUM(oi.quantity * imi.quantity_used) AS qty
+                FROM OrderItem oi
+                JOIN "Order" o ON o.order_id = oi.order_id AND o.order_time = oi.order_time
+                JOIN InventoryMenuItem imi ON imi.item_id = oi.item_id
+                JOIN Inventory inv ON inv.inventory_id = imi.inventory_id AND inv.branch_id = o.branch_id
+                WHERE oi.order_id = ANY(:ids)
+                GROUP BY oi.order_id, imi.inventory_id
+            ),
+            locked AS (
+                SELECT inventory_id, item_name, quantity FROM Inventory
+                WHERE inventory_id IN (SELECT inventory_id FROM need)
+                ORDER BY inventory_id
+                FOR UPDATE
+            )
+            SELECT need.order_id, need.inventory_id, need.qty, locked.item_name, locked.quantity
+            FROM need JOIN locked USING (inventory_id)
+        """),
+        {"ids": order_ids}
+    ).all()
+    stock = {r.inventory_id: (r.item_name, r.quantity) for r in needs}
+    available = {inventory_id: quantity for inventory_id, (_, quantity) in stock.items()}
+    by_order = {}
+    for r in needs:
+        by_order.setdefault(r.order_id, []).append((r.inventory_id, r.qty))
+
+    # Заказы пачки проверяются по порядку id: каждый следующий видит остаток после предыдущих
+    statuses, shortages, deltas = {}, {}, {}
+    for order_id in order_ids:
+        lines = by_order.get(order_id, [])
+        short = [(stock[inv][0], qty, available[inv]) for inv, qty in lines if available[inv] < qty]
+        if short:
+            shortages[order_id] = short
+            statuses[order_id] = STATUS_STOCK_SHORTAGE
+            continue
+        for inv, qty in lines:
+            available[inv] -= qty
+            deltas[inv] = deltas.get(inv, 0) + qty
+        statuses[order_id] = STATUS_CONFIRMED
+    if shortages and on_shortage == SHORTAGE_REJECT:
+        raise StockShortage(shortages)
+
+    if deltas:
+        conn.execute(
+            text("""
+                UPDATE Inventory inv
+                SET quantity = inv.quantity - d.qty, last_updated = NOW()
+                FROM unnest(CAST(:inventory_ids AS INT[]), CAST(:quantities AS NUMERIC[]))
+                     AS d(inventory_id, qty)
+                WHERE inv.inventory_id = d.inventory_id
+            """),
+            {"inventory_ids": list(deltas), "quantities": list(deltas.values())}
+        )
+    conn.execute(
+        text("""
+            UPDATE "Order" o SET status = s.status
+            FROM unnest(CAST(:order_ids AS INT[]), CAST(:statuses AS VARCHAR[])) AS s(order_id, status)
+            WHERE o.order_id = s.order_id
+        """),
+        {"order_ids": list(statuses), "statuses": list(statuses.values())}
+    )
+    return statuses
+
+def finalize_order(order_id, on_shortage=SHORTAGE_REJECT):
+    """
+    Подтвердить заказ: списать ингредиенты всех позиций одной транзакцией.
+    on_shortage="reject" — при нехватке StockShortage, ничего не меняется;
+    on_shortage="flag" — заказ получает статус stock_shortage. Возвращает новый статус
+    """
+    with begin() as conn:
+        status = _deduct_stock(conn, [order_id], on_shortage)[order_id]
+        order = dict(conn.execute(text('SELECT * FROM "Order" WHERE order_id=:id'), {"id": order_id}).one()._mapping)
+    after_commit(publish_order_events, [order_event(EVENT_STATUS, order, "created")])
+    safe_log(0, "finalize_order", {"order_id": order_id, "status": status})
+    return status
+
+
 # ===================================================
 # ===============  СКЛАД ============================
 # ===================================================
 
 def create_inventory(branch_id, item_name, quantity, unit):
-    with engine.begin() as conn:
+    with begin() as conn:
         conn.execute(
             text("""
                 INSERT INTO Inventory (branch_id, item_name, quantity, unit)
@@ -286,20 +869,24 @@ def create_inventory(branch_id, item_name, quantity, unit):
         )
     safe_log(0, "create_inventory", {"branch_id": branch_id, "item_name": item_name, "quantity": quantity})
 
-def get_inventory(branch_id=None):
-    query = "SELECT * FROM Inventory"
-    params = {}
-    if branch_id:
-        query += " WHERE branch_id=:branch_id"
-        params["branch_id"] = branch_id
-    with engine.connect() as conn:
+def get_inventory(branch_id=None, after_id=None, limit=None, shape=SHAPE_DICT):
+    conditions = ["branch_id=:branch_id"] if branch_id else []
+    query = paged_query("SELECT * FROM Inventory", "inventory_id", conditions, after_id, limit)
+    params = {"branch_id": branch_id, "after_id": after_id, "limit": limit}
+    with connect_read() as conn:
         result = conn.execute(text(query), params)
-        inventory = [dict(r._mapping) for r in result]
+        inventory = shape_rows(result, shape, "Inventory")
     safe_log(0, "get_inventory", {"branch_id": branch_id})
     return inventory
 
+def iter_inventory(branch_id=None, chunk_size=STREAM_CHUNK_SIZE, shape=SHAPE_DICT):
+    conditions = ["branch_id=:branch_id"] if branch_id else []
+    return stream_rows(paged_query("SELECT * FROM Inventory", "inventory_id", conditions),
+                       {"branch_id": branch_id}, chunk_size, shape, "Inventory", "iter_inventory",
+                       {"branch_id": branch_id})
+
 def update_inventory(branch_id, item_name, quantity_delta):
-    with engine.begin() as conn:
+    with begin() as conn:
         conn.execute(
             text("""
                 UPDATE Inventory
@@ -316,7 +903,7 @@ def update_inventory(branch_id, item_name, quantity_delta):
 # ===================================================
 
 def create_supply_order(supplier_id, branch_id, status="in_progress"):
-    with engine.begin() as conn:
+    with begin() as conn:
         result = conn.execute(
             text("""
                 INSERT INTO SupplyOrder (supplier_id, branch_id, status)
@@ -329,15 +916,30 @@ def create_supply_order(supplier_id, branch_id, status="in_progress"):
     safe_log(0, "create_supply_order", {"supply_order_id": supply_order_id})
     return supply_order_id
 
-def get_supply_orders():
-    with engine.connect() as conn:
-        result = conn.execute(text("SELECT * FROM SupplyOrder"))
-        orders = [dict(r._mapping) for r in result]
+def _supply_order_filters(status=None, branch_id=None):
+    conditions = []
+    if status is not None:
+        conditions.append("status = :status")
+    if branch_id is not None:
+        conditions.append("branch_id = :branch_id")
+    return conditions, {"status": status, "branch_id": branch_id}
+
+def get_supply_orders(after_id=None, limit=None, status=None, branch_id=None, shape=SHAPE_DICT):
+    conditions, params = _supply_order_filters(status, branch_id)
+    query = paged_query("SELECT * FROM SupplyOrder", "supply_order_id", conditions, after_id, limit)
+    with connect_read() as conn:
+        result = conn.execute(text(query), dict(params, after_id=after_id, limit=limit))
+        orders = shape_rows(result, shape, "SupplyOrder")
     safe_log(0, "get_supply_orders")
     return orders
 
+def iter_supply_orders(status=None, branch_id=None, chunk_size=STREAM_CHUNK_SIZE, shape=SHAPE_DICT):
+    conditions, params = _supply_order_filters(status, branch_id)
+    return stream_rows(paged_query("SELECT * FROM SupplyOrder", "supply_order_id", conditions),
+                       params, chunk_size, shape, "SupplyOrder", "iter_supply_orders")
+
 def get_supply_order(supply_order_id):
-    with engine.connect() as conn:
+    with connect_read() as conn:
         order = conn.execute(text("SELECT * FROM SupplyOrder WHERE supply_order_id=:id"),
                              {"id": supply_order_id}).fetchone()
         if not order:
@@ -350,7 +952,7 @@ def get_supply_order(supply_order_id):
     return data
 
 def add_item_to_supply(supply_order_id, item_id, quantity):
-    with engine.begin() as conn:
+    with begin() as conn:
         conn.execute(
             text("""
                 INSERT INTO SupplyOrderItem (supply_order_id, item_id, quantity)
@@ -366,7 +968,7 @@ def add_item_to_supply(supply_order_id, item_id, quantity):
 # ===================================================
 
 def add_supplier(name, phone, email, address):
-    with engine.begin() as conn:
+    with begin() as conn:
         conn.execute(
             text("""
                 INSERT INTO Supplier (name, phone, email, address)
@@ -374,10 +976,11 @@ def add_supplier(name, phone, email, address):
             """),
             {"name": name, "phone": phone, "email": email, "address": address}
         )
+    after_commit(query_cache.invalidate, "suppliers")
     safe_log(0, "add_supplier", {"name": name, "phone": phone})
 
 def link_supplier_item(supplier_id, item_id, supply_price):
-    with engine.begin() as conn:
+    with begin() as conn:
         conn.execute(
             text("""
                 INSERT INTO SupplierMenuItem (supplier_id, item_id, supply_price)
@@ -386,27 +989,25 @@ def link_supplier_item(supplier_id, item_id, supply_price):
             """),
             {"supplier_id": supplier_id, "item_id": item_id, "supply_price": supply_price}
         )
+    after_commit(query_cache.invalidate, "supplier_items", supplier_id)
     safe_log(0, "link_supplier_item", {"supplier_id": supplier_id, "item_id": item_id, "supply_price": supply_price})
 
-def get_suppliers():
-    with engine.connect() as conn:
-        result = conn.execute(text("SELECT * FROM Supplier"))
-        suppliers = [dict(r._mapping) for r in result]
+def get_suppliers(use_cache=True):
+    suppliers = cached_select("suppliers", None, "SELECT * FROM Supplier", use_cache=use_cache)
     safe_log(0, "get_suppliers")
     return suppliers
 
-def get_supplier_items(supplier_id):
-    with engine.connect() as conn:
-        result = conn.execute(
-            text("""
-                SELECT mi.name, smi.supply_price
-                FROM SupplierMenuItem smi
-                JOIN MenuItem mi ON smi.item_id = mi.item_id
-                WHERE smi.supplier_id=:id
-            """),
-            {"id": supplier_id}
-        )
-        items = [dict(r._mapping) for r in result]
+def get_supplier_items(supplier_id, use_cache=True):
+    items = cached_select(
+        "supplier_items", supplier_id,
+        """
+            SELECT mi.name, smi.supply_price
+            FROM SupplierMenuItem smi
+            JOIN MenuItem mi ON smi.item_id = mi.item_id
+            WHERE smi.supplier_id=:id
+        """,
+        {"id": supplier_id}, use_cache=use_cache
+    )
     safe_log(supplier_id, "get_supplier_items")
     return items
 
@@ -415,25 +1016,21 @@ def get_supplier_items(supplier_id):
 # ===============  ВСПОМОГАТЕЛЬНЫЕ ==================
 # ===================================================
 
-def get_branches():
-    with engine.connect() as conn:
-        result = conn.execute(text("SELECT * FROM CafeBranch"))
-        branches = [dict(r._mapping) for r in result]
+def get_branches(use_cache=True):
+    branches = cached_select("branches", None, "SELECT * FROM CafeBranch", use_cache=use_cache)
     safe_log(0, "get_branches")
     return branches
 
-def get_menu_items():
-    with engine.connect() as conn:
-        result = conn.execute(text("SELECT * FROM MenuItem ORDER BY item_id"))
-        items = [dict(r._mapping) for r in result]
+def get_menu_items(use_cache=True):
+    items = cached_select("menu_items", None, "SELECT * FROM MenuItem ORDER BY item_id", use_cache=use_cache)
     safe_log(0, "get_menu_items")
     return items
 
 
 # ===== NtoN функции =====
 
-def get_items_by_category(category_id):
-    with engine.connect() as conn:
+def get_items_by_category(category_id, shape=SHAPE_DICT):
+    with connect_read() as conn:
         result = conn.execute(
             text("""
                 SELECT mi.*
@@ -442,13 +1039,13 @@ def get_items_by_category(category_id):
                 WHERE mci.category_id=:cid
             """),
             {"cid": category_id}
-        ).fetchall()
-        items = [r._mapping for r in result]
+        )
+        items = shape_rows(result, shape, "MenuItem")
     safe_log(0, "get_items_by_category", {"category_id": category_id})
     return items
 
-def get_items_by_supplier(supplier_id):
-    with engine.connect() as conn:
+def get_items_by_supplier(supplier_id, shape=SHAPE_DICT):
+    with connect_read() as conn:
         result = conn.execute(
             text("""
                 SELECT mi.*, smi.supply_price
@@ -457,13 +1054,13 @@ def get_items_by_supplier(supplier_id):
                 WHERE smi.supplier_id=:sid
             """),
             {"sid": supplier_id}
-        ).fetchall()
-        items = [r._mapping for r in result]
+        )
+        items = shape_rows(result, shape, "MenuItem")
     safe_log(supplier_id, "get_items_by_supplier")
     return items
 
-def get_suppliers_by_item(item_id):
-    with engine.connect() as conn:
+def get_suppliers_by_item(item_id, shape=SHAPE_DICT):
+    with connect_read() as conn:
         result = conn.execute(
             text("""
                 SELECT s.*
@@ -472,13 +1069,13 @@ def get_suppliers_by_item(item_id):
                 WHERE smi.item_id=:iid
             """),
             {"iid": item_id}
-        ).fetchall()
-        suppliers = [r._mapping for r in result]
+        )
+        suppliers = shape_rows(result, shape, "Supplier")
     safe_log(0, "get_suppliers_by_item", {"item_id": item_id})
     return suppliers
 
-def get_branches_by_employee(employee_id):
-    with engine.connect() as conn:
+def get_branches_by_employee(employee_id, shape=SHAPE_DICT):
+    with connect_read() as conn:
         result = conn.execute(
             text("""
                 SELECT cb.*
@@ -487,7 +1084,85 @@ def get_branches_by_employee(employee_id):
                 WHERE eb.employee_id=:eid
             """),
             {"eid": employee_id}
-        ).fetchall()
-        branches = [r._mapping for r in result]
+        )
+        branches = shape_rows(result, shape, "CafeBranch")
     safe_log(employee_id, "get_branches_by_employee")
     return branches
+
+
+# ===== Пакетные NtoN загрузчики: один запрос на связь вместо запроса на каждый id =====
+
+def _group_rows(result, ids):
+    grouped = {i: [] for i in ids}
+    for r in result:
+        row = dict(r._mapping)
+        grouped.setdefault(row.pop("_key"), []).append(row)
+    return grouped
+
+def get_items_by_categories(category_ids):
+    ids = list(dict.fromkeys(category_ids))
+    with connect_read() as conn:
+        result = conn.execute(
+            text("""
+                SELECT mci.category_id AS _key, mi.*
+                FROM MenuItem mi
+                JOIN MenuCategoryItem mci ON mi.item_id = mci.item_id
+                WHERE mci.category_id = ANY(:ids)
+                ORDER BY mci.category_id, mi.item_id
+            """),
+            {"ids": ids}
+        )
+        items = _group_rows(result, ids)
+    safe_log(0, "get_items_by_categories", {"category_ids": ids})
+    return items
+
+def get_items_by_suppliers(supplier_ids):
+    ids = list(dict.fromkeys(supplier_ids))
+    with connect_read() as conn:
+        result = conn.execute(
+            text("""
+                SELECT smi.supplier_id AS _key, mi.*, smi.supply_price
+                FROM MenuItem mi
+                JOIN SupplierMenuItem smi ON mi.item_id = smi.item_id
+                WHERE smi.supplier_id = ANY(:ids)
+                ORDER BY smi.supplier_id, mi.item_id
+            """),
+            {"ids": ids}
+        )
+        items = _group_rows(result, ids)
+    safe_log(0, "get_items_by_suppliers", {"supplier_ids": ids})
+    return items
+
+def get_suppliers_by_items(item_ids):
+    ids = list(dict.fromkeys(item_ids))
+    with connect_read() as conn:
+        result = conn.execute(
+            text("""
+                SELECT smi.item_id AS _key, s.*
+                FROM Supplier s
+                JOIN SupplierMenuItem smi ON s.supplier_id = smi.supplier_id
+                WHERE smi.item_id = ANY(:ids)
+                ORDER BY smi.item_id, s.supplier_id
+            """),
+            {"ids": ids}
+        )
+        suppliers = _group_rows(result, ids)
+    safe_log(0, "get_suppliers_by_items", {"item_ids": ids})
+    return suppliers
+
+def get_branches_by_employees(employee_ids):
+    ids = list(dict.fromkeys(employee_ids))
+    with connect_read() as conn:
+        result = conn.execute(
+            text("""
+                SELECT eb.employee_id AS _key, cb.*
+                FROM CafeBranch cb
+                JOIN EmployeeBranch eb ON cb.branch_id = eb.branch_id
+                WHERE eb.employee_id = ANY(:ids)
+                ORDER BY eb.employee_id, cb.branch_id
+            """),
+            {"ids": ids}
+        )
+        branches = _group_rows(result, ids)
+    safe_log(0, "get_branches_by_employees", {"employee_ids": ids})
+    return branches
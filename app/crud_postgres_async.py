@@ -0,0 +1,750 @@
+import asyncio
+from contextlib import asynccontextmanager
+from datetime import date
+
+from sqlalchemy import text
+
+from app import crud_mongo_async
+from app.crud_postgres import (
+    ADD_ORDER_ITEM_SQL, CUSTOMER_SEARCH_LIMIT, FIND_BY_EMAIL_SQL, FIND_BY_PHONE_SQL, SEARCH_PREFIX,
+    SHORTAGE_REJECT, STREAM_CHUNK_SIZE, UPDATE_ORDER_STATUS_SQL, _create_orders, _deduct_stock, _employees_query,
+    _forget_customers, _group_rows, _order_filters, _safe_details, _search_query, _status_events,
+    _supply_order_filters, normalize_phone, paged_query, query_cache,
+)
+from app.crud_mongo import log_action
+from app.db import (
+    after_commit, after_commit_async, async_unit_of_work, connect_read_async, get_async_engine, mark_write,
+)
+from app.order_feed import EVENT_CREATED, EVENT_DELETED, EVENT_STATUS, apublish_order_events, order_event
+from app.partitions import amaybe_ensure_order_partitions
+from app.records import SHAPE_COLUMNS, SHAPE_DICT, check_shape, row_count, shape_partition, shape_rows
+from app.statements import update_row, update_rows
+
+# Асинхронный двойник crud_postgres: те же функции и те же формы результата,
+# но запросы идут через asyncpg и не блокируют event loop.
+# Журнал пишется через ту же фоновую очередь (safe_log), но без ожидания места в ней;
+# кэш справочников общий.
+# Единица работы — db.unit_of_work_async(): вызовы внутри неё идут одной транзакцией.
+
+
+# ===== ВСПОМОГАТЕЛЬНЫЕ =====
+def safe_log(user_id, action, details=None):
+    """
+    Как crud_postgres.safe_log, но при полной очереди журнала запись уходит в спул,
+    а не ждёт места: event loop не блокируется
+    """
+    after_commit(log_action, user_id=user_id, action=action, details=_safe_details(details or {}), block=False)
+
+@asynccontextmanager
+async def connect():
+    uow = async_unit_of_work()
+    if uow is not None:
+        yield uow.conn
+        return
+    async with get_async_engine().connect() as conn:
+        yield conn
+
+@asynccontextmanager
+async def connect_read():
+    """Чтение: реплика или основной сервер (см. app/db.py, раздел РЕПЛИКИ)"""
+    async with connect_read_async() as conn:
+        yield conn
+
+@asynccontextmanager
+async def begin():
+    # внутри unit_of_work_async — её соединение, фиксирует единица работы
+    uow = async_unit_of_work()
+    if uow is not None:
+        yield uow.conn
+        return
+    try:
+        async with get_async_engine().begin() as conn:
+            yield conn
+    finally:
+        mark_write()
+
+async def fetch_all(query, params=None, shape=SHAPE_DICT, name="Row"):
+    async with connect_read() as conn:
+        result = await conn.execute(text(query), params or {})
+        return shape_rows(result, shape, name)
+
+async def fetch_one(query, params=None):
+    async with connect_read() as conn:
+        row = (await conn.execute(text(query), params or {})).fetchone()
+        return dict(row._mapping) if row else None
+
+async def cached_select(entity, key, query, params=None, use_cache=True):
+    async def load():
+        return tuple(await fetch_all(query, params))
+    if async_unit_of_work() is not None:
+        # незафиксированные строки единицы работы — мимо общего кэша (см. crud_postgres.cached_select)
+        return [dict(r) for r in await load()]
+    rows = await query_cache.aget_or_load(entity, key, load, bypass=not use_cache)
+    return [dict(r) for r in rows]
+
+async def stream_rows(query, params, chunk_size=STREAM_CHUNK_SIZE, shape=SHAPE_DICT, name="Row",
+                      action=None, details=None):
+    check_shape(shape)
+    rows, completed = 0, False
+    try:
+        async with connect_read() as conn:
+            result = await conn.stream(text(query), params, execution_options={"yield_per": chunk_size})
+            if shape == SHAPE_DICT:
+                async for r in result:
+                    rows += 1
+                    yield dict(r._mapping)
+            else:
+                names = list(result.keys())
+                async for partition in result.partitions(chunk_size):
+                    for item in shape_partition(names, partition, shape, name):
+                        rows += row_count(item) if shape == SHAPE_COLUMNS else 1
+                        yield item
+        completed = True
+    finally:
+        if action:
+            safe_log(0, action, {**(details or {}), "rows": rows, "completed": completed})
+
+def _as_date(value):
+    # asyncpg не приводит строки к DATE сам
+    return date.fromisoformat(value) if isinstance(value, str) else value
+
+
+# ===================================================
+# ===============  КЛИЕНТЫ  ========================
+# ===================================================
+
+async def get_customers(after_id=None, limit=None, shape=SHAPE_DICT):
+    query = paged_query("SELECT * FROM Customer", "customer_id", after_id=after_id, limit=limit)
+    return await fetch_all(query, {"after_id": after_id, "limit": limit}, shape, "Customer")
+
+def iter_customers(chunk_size=STREAM_CHUNK_SIZE, shape=SHAPE_DICT):
+    return stream_rows("SELECT * FROM Customer", {}, chunk_size, shape, "Customer", "iter_customers")
+
+async def _find_customer(key, query, params, use_cache):
+    if async_unit_of_work() is not None:
+        customer = await fetch_one(query, params)
+    else:
+        customer = await query_cache.aget_or_load("customers_hot", key, lambda: fetch_one(query, params),
+                                                  bypass=not use_cache)
+    return dict(customer) if customer else None
+
+async def find_customer_by_phone(phone, use_cache=True):
+    phone = normalize_phone(phone)
+    customer = await _find_customer(f"phone:{phone}", FIND_BY_PHONE_SQL, {"phone": phone}, use_cache)
+    safe_log(customer["customer_id"] if customer else 0, "find_customer_by_phone", {"found": customer is not None})
+    return customer
+
+async def find_customer_by_email(email, use_cache=True):
+    email = (email or "").strip().lower()
+    if not email:
+        raise ValueError("Пустой email")
+    customer = await _find_customer(f"email:{email}", FIND_BY_EMAIL_SQL, {"email": email}, use_cache)
+    safe_log(customer["customer_id"] if customer else 0, "find_customer_by_email", {"found": customer is not None})
+    return customer
+
+async def search_customers(query, mode=SEARCH_PREFIX, limit=CUSTOMER_SEARCH_LIMIT, shape=SHAPE_DICT):
+    async with connect_read() as conn:
+        sql, params = await conn.run_sync(_search_query, query, mode, limit)
+        customers = shape_rows(await conn.execute(text(sql), params), shape, "Customer")
+    safe_log(0, "search_customers", {"query": query, "mode": mode, "found": row_count(customers)})
+    return customers
+
+async def add_customer(name, phone, email):
+    phone = normalize_phone(phone)
+    async with begin() as conn:
+        result = await conn.execute(
+            text("""
+                INSERT INTO Customer (name, phone, email, registration_date)
+                VALUES (:name, :phone, :email, NOW())
+                RETURNING customer_id
+            """),
+            {"name": name, "phone": phone, "email": email}
+        )
+        customer_id = result.scalar()
+    _forget_customers({"phone": phone, "email": email})
+    safe_log(customer_id, "add_customer", {"name": name, "phone": phone, "email": email})
+    return customer_id
+
+async def update_customer(customer_id, **kwargs):
+    if kwargs.get("phone") is not None:
+        kwargs["phone"] = normalize_phone(kwargs["phone"])
+    async with begin() as conn:
+        previous = None
+        if "phone" in kwargs or "email" in kwargs:
+            row = (await conn.execute(text("SELECT phone, email FROM Customer WHERE customer_id=:id"),
+                                      {"id": customer_id})).fetchone()
+            previous = dict(row._mapping) if row else None
+        customer = await conn.run_sync(update_row, "Customer", customer_id, kwargs)
+    _forget_customers(previous, customer)
+    safe_log(customer_id, "update_customer", kwargs)
+    return customer
+
+async def delete_customer(customer_id):
+    async with begin() as conn:
+        row = (await conn.execute(text("DELETE FROM Customer WHERE customer_id=:id RETURNING phone, email"),
+                                  {"id": customer_id})).fetchone()
+    if row:
+        _forget_customers(dict(row._mapping))
+    safe_log(customer_id, "delete_customer")
+
+
+# ===================================================
+# ===============  СОТРУДНИКИ  ======================
+# ===================================================
+
+async def add_employee(name, position, hire_date, salary, email, is_active=True):
+    async with begin() as conn:
+        result = await conn.execute(
+            text("""
+                INSERT INTO Employee (name, position, hire_date, salary, email, is_active)
+                VALUES (:name, :position, :hire_date, :salary, :email, :is_active)
+                RETURNING employee_id
+            """),
+            {"name": name, "position": position, "hire_date": _as_date(hire_date),
+             "salary": salary, "email": email, "is_active": is_active}
+        )
+        employee_id = result.scalar()
+    safe_log(employee_id, "add_employee", {"name": name, "position": position, "salary": salary})
+    return employee_id
+
+async def assign_employee_to_branch(employee_id, branch_id):
+    async with begin() as conn:
+        await conn.execute(
+            text("""
+                INSERT INTO EmployeeBranch (employee_id, branch_id, assigned_date)
+                VALUES (:employee_id, :branch_id, CURRENT_DATE)
+                ON CONFLICT DO NOTHING
+            """),
+            {"employee_id": employee_id, "branch_id": branch_id}
+        )
+    safe_log(employee_id, "assign_employee_to_branch", {"branch_id": branch_id})
+
+async def get_employees(branch_id=None, after_id=None, limit=None, shape=SHAPE_DICT):
+    query = _employees_query(branch_id, after_id, limit)
+    employees = await fetch_all(query, {"branch_id": branch_id, "after_id": after_id, "limit": limit},
+                                shape, "Employee")
+    safe_log(0, "get_employees", {"branch_id": branch_id})
+    return employees
+
+def iter_employees(branch_id=None, chunk_size=STREAM_CHUNK_SIZE, shape=SHAPE_DICT):
+    return stream_rows(_employees_query(branch_id), {"branch_id": branch_id}, chunk_size, shape, "Employee",
+                       "iter_employees", {"branch_id": branch_id})
+
+async def update_employee(employee_id, **kwargs):
+    async with begin() as conn:
+        employee = await conn.run_sync(update_row, "Employee", employee_id, kwargs)
+    safe_log(employee_id, "update_employee", kwargs)
+    return employee
+
+async def deactivate_employees(employee_ids):
+    employee_ids = list(dict.fromkeys(employee_ids))
+    if not employee_ids:
+        return []
+    async with begin() as conn:
+        employees = await conn.run_sync(update_rows, "Employee",
+                                        [{"employee_id": i, "is_active": False} for i in employee_ids])
+    safe_log(0, "deactivate_employees", {"employee_ids": [e["employee_id"] for e in employees]})
+    return employees
+
+async def remove_employee(employee_id):
+    async with begin() as conn:
+        await conn.execute(text("DELETE FROM Employee WHERE employee_id=:id"), {"id": employee_id})
+    safe_log(employee_id, "remove_employee")
+
+
+# ===================================================
+# ===============  МЕНЮ =============================
+# ===================================================
+
+async def add_menu_category(name, description=None):
+    async with begin() as conn:
+        await conn.execute(
+            text("INSERT INTO MenuCategory (name, description) VALUES (:name, :description)"),
+            {"name": name, "description": description}
+        )
+    after_commit(query_cache.invalidate, "menu_categories")
+    safe_log(0, "add_menu_category", {"name": name, "description": description})
+
+async def get_menu_categories(use_cache=True):
+    categories = await cached_select("menu_categories", None, "SELECT * FROM MenuCategory", use_cache=use_cache)
+    safe_log(0, "get_menu_categories")
+    return categories
+
+async def add_menu_item(name, description, price, calories, is_available=True, image_url=None):
+    async with begin() as conn:
+        await conn.execute(
+            text("""
+                INSERT INTO MenuItem (name, description, price, calories, is_available, image_url)
+                VALUES (:name, :description, :price, :calories, :is_available, :image_url)
+            """),
+            {"name": name, "description": description, "price": price,
+             "calories": calories, "is_available": is_available, "image_url": image_url}
+        )
+    after_commit(query_cache.invalidate, "menu_items")
+    after_commit(query_cache.invalidate, "menu")
+    safe_log(0, "add_menu_item", {"name": name, "price": price})
+
+async def assign_item_to_category(item_id, category_id):
+    async with begin() as conn:
+        await conn.execute(
+            text("""
+                INSERT INTO MenuCategoryItem (category_id, item_id)
+                VALUES (:category_id, :item_id)
+                ON CONFLICT DO NOTHING
+            """),
+            {"category_id": category_id, "item_id": item_id}
+        )
+    after_commit(query_cache.invalidate, "menu")
+    safe_log(0, "assign_item_to_category", {"item_id": item_id, "category_id": category_id})
+
+async def get_menu(use_cache=True):
+    query = """
+        SELECT mi.item_id, mi.name, mi.price, mi.is_available, mc.name AS category
+        FROM MenuItem mi
+        LEFT JOIN MenuCategoryItem mci ON mi.item_id = mci.item_id
+        LEFT JOIN MenuCategory mc ON mci.category_id = mc.category_id
+    """
+    menu = await cached_select("menu", None, query, use_cache=use_cache)
+    safe_log(0, "get_menu")
+    return menu
+
+async def update_menu_item(item_id, **kwargs):
+    async with begin() as conn:
+        item = await conn.run_sync(update_row, "MenuItem", item_id, kwargs)
+    after_commit(query_cache.invalidate, "menu_items")
+    after_commit(query_cache.invalidate, "menu")
+    if "name" in kwargs:
+        after_commit(query_cache.invalidate, "supplier_items")
+    safe_log(item_id, "update_menu_item", kwargs)
+    return item
+
+async def update_menu_items(rows):
+    rows = list(rows)
+    if not rows:
+        return []
+    async with begin() as conn:
+        items = await conn.run_sync(update_rows, "MenuItem", rows)
+    after_commit(query_cache.invalidate, "menu_items")
+    after_commit(query_cache.invalidate, "menu")
+    if any("name" in row for row in rows):
+        after_commit(query_cache.invalidate, "supplier_items")
+    safe_log(0, "update_menu_items", {"item_ids": [i["item_id"] for i in items]})
+    return items
+
+async def reprice_menu_items(prices):
+    prices = dict(prices)
+    return await update_menu_items([{"item_id": item_id, "price": price} for item_id, price in prices.items()])
+
+async def remove_menu_item(item_id):
+    async with begin() as conn:
+        await conn.execute(text("DELETE FROM MenuItem WHERE item_id=:item_id"), {"item_id": item_id})
+    after_commit(query_cache.invalidate, "menu_items")
+    after_commit(query_cache.invalidate, "menu")
+    after_commit(query_cache.invalidate, "supplier_items")
+    safe_log(item_id, "remove_menu_item")
+
+
+# ===================================================
+# ===============  ЗАКАЗЫ ===========================
+# ===================================================
+
+async def create_order(customer_id, branch_id, employee_id, total_amount):
+    await amaybe_ensure_order_partitions()
+    async with begin() as conn:
+        result = await conn.execute(
+            text("""
+                INSERT INTO "Order" (customer_id, branch_id, employee_id, total_amount, status)
+                VALUES (:customer_id, :branch_id, :employee_id, :total_amount, 'created')
+                RETURNING *
+            """),
+            {"customer_id": customer_id, "branch_id": branch_id,
+             "employee_id": employee_id, "total_amount": total_amount}
+        )
+        order = dict(result.fetchone()._mapping)
+    await after_commit_async(apublish_order_events, [order_event(EVENT_CREATED, order)])
+    safe_log(customer_id, "create_order", {"order_id": order["order_id"], "total_amount": total_amount})
+    return order["order_id"]
+
+async def get_orders(after_id=None, limit=None, status=None, branch_id=None, since=None, until=None,
+                     shape=SHAPE_DICT):
+    conditions, params = _order_filters(status, branch_id, since, until)
+    query = paged_query('SELECT * FROM "Order"', "order_id", conditions, after_id, limit)
+    orders = await fetch_all(query, dict(params, after_id=after_id, limit=limit), shape, "Order")
+    safe_log(0, "get_orders", {"after_id": after_id, "limit": limit})
+    return orders
+
+def iter_orders(status=None, branch_id=None, since=None, until=None, chunk_size=STREAM_CHUNK_SIZE,
+                shape=SHAPE_DICT):
+    conditions, params = _order_filters(status, branch_id, since, until)
+    return stream_rows(paged_query('SELECT * FROM "Order"', "order_id", conditions), params, chunk_size,
+                       shape, "Order", "iter_orders", {"branch_id": branch_id})
+
+async def update_order_status(order_id, status):
+    async with begin() as conn:
+        result = await conn.execute(text(UPDATE_ORDER_STATUS_SQL), {"status": status, "id": order_id})
+        events = _status_events(result)
+    await after_commit_async(apublish_order_events, events)
+    safe_log(0, "update_order_status", {"order_id": order_id, "status": status})
+
+async def delete_order(order_id):
+    async with begin() as conn:
+        rows = await conn.execute(text('DELETE FROM "Order" WHERE order_id=:id RETURNING *'), {"id": order_id})
+        events = [order_event(EVENT_DELETED, dict(r._mapping)) for r in rows]
+    await after_commit_async(apublish_order_events, events)
+    safe_log(0, "delete_order", {"order_id": order_id})
+
+async def get_order(order_id):
+    order = await fetch_one('SELECT * FROM "Order" WHERE order_id=:id', {"id": order_id})
+    safe_log(0, "get_order", {"order_id": order_id})
+    return order
+
+async def get_orders_by_customer(customer_id, since=None, until=None, shape=SHAPE_DICT):
+    conditions, params = _order_filters(since=since, until=until)
+    where = " AND ".join(["customer_id = :cid"] + conditions)
+    orders = await fetch_all(f'SELECT * FROM "Order" WHERE {where} ORDER BY order_time DESC',
+                             dict(params, cid=customer_id), shape, "Order")
+    safe_log(customer_id, "get_orders_by_customer")
+    return orders
+
+async def add_order_item(order_id, item_id, quantity):
+    async with begin() as conn:
+        price = (await conn.execute(text("SELECT price FROM MenuItem WHERE item_id=:id"),
+                                    {"id": item_id})).scalar()
+        added = (await conn.execute(
+            text(ADD_ORDER_ITEM_SQL),
+            {"order_id": order_id, "item_id": item_id, "quantity": quantity, "price": price}
+        )).rowcount
+        if not added:
+            raise ValueError(f"Заказ не найден: {order_id}")
+    safe_log(0, "add_order_item", {"order_id": order_id, "item_id": item_id, "quantity": quantity, "price": price})
+
+async def update_order_total(order_id):
+    async with begin() as conn:
+        total = (await conn.execute(
+            text("SELECT SUM(quantity * price) FROM OrderItem WHERE order_id=:id"),
+            {"id": order_id}
+        )).scalar()
+        await conn.execute(text('UPDATE "Order" SET total_amount=:t WHERE order_id=:id'),
+                           {"t": total or 0, "id": order_id})
+    safe_log(0, "update_order_total", {"order_id": order_id, "total_amount": total or 0})
+
+async def create_order_with_items(customer_id, branch_id, employee_id, items,
+                                  deduct_stock=False, on_shortage=SHORTAGE_REJECT):
+    order_spec = {"customer_id": customer_id, "branch_id": branch_id,
+                  "employee_id": employee_id, "items": list(items)}
+    await amaybe_ensure_order_partitions()
+    async with begin() as conn:
+        # та же логика, что в синхронном модуле, через sync-фасад соединения
+        order = (await conn.run_sync(_create_orders, [order_spec]))[0]
+        if deduct_stock:
+            statuses = await conn.run_sync(_deduct_stock, [order["order_id"]], on_shortage)
+            order["status"] = statuses[order["order_id"]]
+    await after_commit_async(apublish_order_events, [order_event(EVENT_CREATED, order)])
+    safe_log(customer_id, "create_order_with_items",
+             {"order_id": order["order_id"], "total_amount": order["total_amount"],
+              "items": [[i, q] for i, q in order_spec["items"]], "status": order["status"]})
+    return order
+
+async def create_orders_batch(orders, deduct_stock=False, on_shortage=SHORTAGE_REJECT):
+    orders = [dict(o, items=list(o["items"])) for o in orders]
+    if not orders:
+        return []
+    await amaybe_ensure_order_partitions()
+    async with begin() as conn:
+        created = await conn.run_sync(_create_orders, orders)
+        if deduct_stock:
+            statuses = await conn.run_sync(_deduct_stock, [o["order_id"] for o in created], on_shortage)
+            for o in created:
+                o["status"] = statuses[o["order_id"]]
+    await after_commit_async(apublish_order_events, [order_event(EVENT_CREATED, o) for o in created])
+    safe_log(0, "create_orders_batch",
+             {"order_ids": [o["order_id"] for o in created], "count": len(created)})
+    return created
+
+async def finalize_order(order_id, on_shortage=SHORTAGE_REJECT):
+    async with begin() as conn:
+        status = (await conn.run_sync(_deduct_stock, [order_id], on_shortage))[order_id]
+        order = dict((await conn.execute(text('SELECT * FROM "Order" WHERE order_id=:id'),
+                                         {"id": order_id})).one()._mapping)
+    await after_commit_async(apublish_order_events, [order_event(EVENT_STATUS, order, "created")])
+    safe_log(0, "finalize_order", {"order_id": order_id, "status": status})
+    return status
+
+
+# ===================================================
+# ===============  СКЛАД ============================
+# ===================================================
+
+async def create_inventory(branch_id, item_name, quantity, unit):
+    async with begin() as conn:
+        await conn.execute(
+            text("""
+                INSERT INTO Inventory (branch_id, item_name, quantity, unit)
+                VALUES (:branch_id, :item_name, :quantity, :unit)
+            """),
+            {"branch_id": branch_id, "item_name": item_name, "quantity": quantity, "unit": unit}
+        )
+    safe_log(0, "create_inventory", {"branch_id": branch_id, "item_name": item_name, "quantity": quantity})
+
+async def get_inventory(branch_id=None, after_id=None, limit=None, shape=SHAPE_DICT):
+    conditions = ["branch_id=:branch_id"] if branch_id else []
+    query = paged_query("SELECT * FROM Inventory", "inventory_id", conditions, after_id, limit)
+    inventory = await fetch_all(query, {"branch_id": branch_id, "after_id": after_id, "limit": limit},
+                                shape, "Inventory")
+    safe_log(0, "get_inventory", {"branch_id": branch_id})
+    return inventory
+
+def iter_inventory(branch_id=None, chunk_size=STREAM_CHUNK_SIZE, shape=SHAPE_DICT):
+    conditions = ["branch_id=:branch_id"] if branch_id else []
+    return stream_rows(paged_query("SELECT * FROM Inventory", "inventory_id", conditions),
+                       {"branch_id": branch_id}, chunk_size, shape, "Inventory", "iter_inventory",
+                       {"branch_id": branch_id})
+
+async def update_inventory(branch_id, item_name, quantity_delta):
+    async with begin() as conn:
+        await conn.execute(
+            text("""
+                UPDATE Inventory
+                SET quantity = quantity + :delta, last_updated = NOW()
+                WHERE branch_id=:b AND item_name=:n
+            """),
+            {"delta": quantity_delta, "b": branch_id, "n": item_name}
+        )
+    safe_log(0, "update_inventory", {"branch_id": branch_id, "item_name": item_name, "delta": quantity_delta})
+
+
+# ===================================================
+# ===============  ПОСТАВКИ =========================
+# ===================================================
+
+async def create_supply_order(supplier_id, branch_id, status="in_progress"):
+    async with begin() as conn:
+        result = await conn.execute(
+            text("""
+                INSERT INTO SupplyOrder (supplier_id, branch_id, status)
+                VALUES (:supplier_id, :branch_id, :status)
+                RETURNING supply_order_id
+            """),
+            {"supplier_id": supplier_id, "branch_id": branch_id, "status": status}
+        )
+        supply_order_id = result.scalar()
+    safe_log(0, "create_supply_order", {"supply_order_id": supply_order_id})
+    return supply_order_id
+
+async def get_supply_orders(after_id=None, limit=None, status=None, branch_id=None, shape=SHAPE_DICT):
+    conditions, params = _supply_order_filters(status, branch_id)
+    query = paged_query("SELECT * FROM SupplyOrder", "supply_order_id", conditions, after_id, limit)
+    orders = await fetch_all(query, dict(params, after_id=after_id, limit=limit), shape, "SupplyOrder")
+    safe_log(0, "get_supply_orders")
+    return orders
+
+def iter_supply_orders(status=None, branch_id=None, chunk_size=STREAM_CHUNK_SIZE, shape=SHAPE_DICT):
+    conditions, params = _supply_order_filters(status, branch_id)
+    return stream_rows(paged_query("SELECT * FROM SupplyOrder", "supply_order_id", conditions),
+                       params, chunk_size, shape, "SupplyOrder", "iter_supply_orders")
+
+async def get_supply_order(supply_order_id):
+    async with connect_read() as conn:
+        order = (await conn.execute(text("SELECT * FROM SupplyOrder WHERE supply_order_id=:id"),
+                                    {"id": supply_order_id})).fetchone()
+        if not order:
+            return None
+        items = await conn.execute(text("SELECT * FROM SupplyOrderItem WHERE supply_order_id=:id"),
+                                   {"id": supply_order_id})
+        data = dict(order._mapping)
+        data["items"] = [dict(r._mapping) for r in items]
+    safe_log(0, "get_supply_order", {"supply_order_id": supply_order_id})
+    return data
+
+async def add_item_to_supply(supply_order_id, item_id, quantity):
+    async with begin() as conn:
+        await conn.execute(
+            text("""
+                INSERT INTO SupplyOrderItem (supply_order_id, item_id, quantity)
+                VALUES (:sid, :iid, :q)
+            """),
+            {"sid": supply_order_id, "iid": item_id, "q": quantity}
+        )
+    safe_log(0, "add_item_to_supply", {"supply_order_id": supply_order_id, "item_id": item_id, "quantity": quantity})
+
+
+# ===================================================
+# ===============  ПОСТАВЩИКИ =======================
+# ===================================================
+
+async def add_supplier(name, phone, email, address):
+    async with begin() as conn:
+        await conn.execute(
+            text("""
+                INSERT INTO Supplier (name, phone, email, address)
+                VALUES (:name, :phone, :email, :address)
+            """),
+            {"name": name, "phone": phone, "email": email, "address": address}
+        )
+    after_commit(query_cache.invalidate, "suppliers")
+    safe_log(0, "add_supplier", {"name": name, "phone": phone})
+
+async def link_supplier_item(supplier_id, item_id, supply_price):
+    async with begin() as conn:
+        await conn.execute(
+            text("""
+                INSERT INTO SupplierMenuItem (supplier_id, item_id, supply_price)
+                VALUES (:supplier_id, :item_id, :supply_price)
+                ON CONFLICT DO NOTHING
+            """),
+            {"supplier_id": supplier_id, "item_id": item_id, "supply_price": supply_price}
+        )
+    after_commit(query_cache.invalidate, "supplier_items", supplier_id)
+    safe_log(0, "link_supplier_item", {"supplier_id": supplier_id, "item_id": item_id, "supply_price": supply_price})
+
+async def get_suppliers(use_cache=True):
+    suppliers = await cached_select("suppliers", None, "SELECT * FROM Supplier", use_cache=use_cache)
+    safe_log(0, "get_suppliers")
+    return suppliers
+
+async def get_supplier_items(supplier_id, use_cache=True):
+    items = await cached_select(
+        "supplier_items", supplier_id,
+        """
+            SELECT mi.name, smi.supply_price
+            FROM SupplierMenuItem smi
+            JOIN MenuItem mi ON smi.item_id = mi.item_id
+            WHERE smi.supplier_id=:id
+        """,
+        {"id": supplier_id}, use_cache=use_cache
+    )
+    safe_log(supplier_id, "get_supplier_items")
+    return items
+
+
+# ===================================================
+# ===============  ВСПОМОГАТЕЛЬНЫЕ ==================
+# ===================================================
+
+async def get_branches(use_cache=True):
+    branches = await cached_select("branches", None, "SELECT * FROM CafeBranch", use_cache=use_cache)
+    safe_log(0, "get_branches")
+    return branches
+
+async def get_menu_items(use_cache=True):
+    items = await cached_select("menu_items", None, "SELECT * FROM MenuItem ORDER BY item_id", use_cache=use_cache)
+    safe_log(0, "get_menu_items")
+    return items
+
+async def get_pos_overview(branch_id):
+    """Меню, филиалы и отзывы филиала — параллельно, одним awaitable."""
+    menu, branches, reviews = await asyncio.gather(
+        get_menu(), get_branches(), crud_mongo_async.get_reviews(branch_id)
+    )
+    return {"menu": menu, "branches": branches, "reviews": reviews}
+
+
+# ===== NtoN функции =====
+
+async def get_items_by_category(category_id, shape=SHAPE_DICT):
+    items = await fetch_all(
+        """
+            SELECT mi.*
+            FROM MenuItem mi
+            JOIN MenuCategoryItem mci ON mi.item_id = mci.item_id
+            WHERE mci.category_id=:cid
+        """,
+        {"cid": category_id}, shape, "MenuItem"
+    )
+    safe_log(0, "get_items_by_category", {"category_id": category_id})
+    return items
+
+async def get_items_by_supplier(supplier_id, shape=SHAPE_DICT):
+    items = await fetch_all(
+        """
+            SELECT mi.*, smi.supply_price
+            FROM MenuItem mi
+            JOIN SupplierMenuItem smi ON mi.item_id = smi.item_id
+            WHERE smi.supplier_id=:sid
+        """,
+        {"sid": supplier_id}, shape, "MenuItem"
+    )
+    safe_log(supplier_id, "get_items_by_supplier")
+    return items
+
+async def get_suppliers_by_item(item_id, shape=SHAPE_DICT):
+    suppliers = await fetch_all(
+        """
+            SELECT s.*
+            FROM Supplier s
+            JOIN SupplierMenuItem smi ON s.supplier_id = smi.supplier_id
+            WHERE smi.item_id=:iid
+        """,
+        {"iid": item_id}, shape, "Supplier"
+    )
+    safe_log(0, "get_suppliers_by_item", {"item_id": item_id})
+    return suppliers
+
+async def get_branches_by_employee(employee_id, shape=SHAPE_DICT):
+    branches = await fetch_all(
+        """
+            SELECT cb.*
+            FROM CafeBranch cb
+            JOIN EmployeeBranch eb ON cb.branch_id = eb.branch_id
+            WHERE eb.employee_id=:eid
+        """,
+        {"eid": employee_id}, shape, "CafeBranch"
+    )
+    safe_log(employee_id, "get_branches_by_employee")
+    return branches
+
+
+# ===== Пакетные NtoN загрузчики =====
+
+async def _grouped(query, ids):
+    async with connect_read() as conn:
+        result = await conn.execute(text(query), {"ids": ids})
+        return _group_rows(result, ids)
+
+async def get_items_by_categories(category_ids):
+    ids = list(dict.fromkeys(category_ids))
+    items = await _grouped("""
+        SELECT mci.category_id AS _key, mi.*
+        FROM MenuItem mi
+        JOIN MenuCategoryItem mci ON mi.item_id = mci.item_id
+        WHERE mci.category_id = ANY(:ids)
+        ORDER BY mci.category_id, mi.item_id
+    """, ids)
+    safe_log(0, "get_items_by_categories", {"category_ids": ids})
+    return items
+
+async def get_items_by_suppliers(supplier_ids):
+    ids = list(dict.fromkeys(supplier_ids))
+    items = await _grouped("""
+        SELECT smi.supplier_id AS _key, mi.*, smi.supply_price
+        FROM MenuItem mi
+        JOIN SupplierMenuItem smi ON mi.item_id = smi.item_id
+        WHERE smi.supplier_id = ANY(:ids)
+        ORDER BY smi.supplier_id, mi.item_id
+    """, ids)
+    safe_log(0, "get_items_by_suppliers", {"supplier_ids": ids})
+    return items
+
+async def get_suppliers_by_items(item_ids):
+    ids = list(dict.fromkeys(item_ids))
+    suppliers = await _grouped("""
+        SELECT smi.item_id AS _key, s.*
+        FROM Supplier s
+        JOIN SupplierMenuItem smi ON s.supplier_id = smi.supplier_id
+        WHERE smi.item_id = ANY(:ids)
+        ORDER BY smi.item_id, s.supplier_id
+    """, ids)
+    safe_log(0, "get_suppliers_by_items", {"item_ids": ids})
+    return suppliers
+
+async def get_branches_by_employees(employee_ids):
+    ids = list(dict.fromkeys(employee_ids))
+    branches = await _grouped("""
+        SELECT eb.employee_id AS _key, cb.*
+        FROM CafeBranch cb
+        JOIN EmployeeBranch eb ON cb.branch_id = eb.branch_id
+        WHERE eb.employee_id = ANY(:ids)
+        ORDER BY eb.employee_id, cb.branch_id
+    """, ids)
+    safe_log(0, "get_branches_by_employees", {"employee_ids": ids})
+    return branches
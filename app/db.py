@@ -0,0 +1,577 @@
+import inspect
+import itertools
+import threading
+import time
+from contextlib import asynccontextmanager, contextmanager
+from contextvars import ContextVar
+
+from pymongo import AsyncMongoClient, MongoClient, monitoring
+from sqlalchemy import create_engine, exc, text
+from sqlalchemy.ext.asyncio import create_async_engine
+
+from app.settings import get_settings
+
+# Движок и клиент создаются при первом обращении: импорт пакета не открывает соединений
+_engine = None
+_mongo_client = None
+_async_engine = None
+_async_mongo_client = None
+_lock = threading.Lock()
+
+_replicas = None
+_health_thread = None
+_health_stop = threading.Event()
+
+_pg_wait = {"checkouts": 0, "wait_total": 0.0, "wait_max": 0.0}
+# Вызываются с временем ожидания соединения (секунды) после каждой выдачи из пула
+checkout_listeners = []
+
+
+# ===================================================
+# ===============  POSTGRESQL  ======================
+# ===================================================
+
+def _create_engine(url):
+    s = get_settings()
+    connect_args = {}
+    if s.statement_timeout_ms:
+        connect_args["options"] = f"-c statement_timeout={s.statement_timeout_ms}"
+    return create_engine(
+        url,
+        pool_size=s.pool_size,
+        max_overflow=s.max_overflow,
+        pool_timeout=s.pool_timeout,
+        pool_recycle=s.pool_recycle,
+        pool_pre_ping=s.pool_pre_ping,
+        connect_args=connect_args,
+    )
+
+def get_engine():
+    global _engine
+    if _engine is None:
+        with _lock:
+            if _engine is None:
+                _engine = _create_engine(get_settings().postgres_url)
+    return _engine
+
+def _record_checkout(wait):
+    with _lock:
+        _pg_wait["checkouts"] += 1
+        _pg_wait["wait_total"] += wait
+        _pg_wait["wait_max"] = max(_pg_wait["wait_max"], wait)
+    for listener in checkout_listeners:
+        listener(wait)
+
+@contextmanager
+def connect():
+    """Соединение из пула; время ожидания выдачи попадает в метрики пула."""
+    uow = _sync_unit_of_work()
+    if uow is not None:
+        yield uow.conn
+        return
+    engine = get_engine()
+    started = time.perf_counter()
+    conn = engine.connect()
+    _record_checkout(time.perf_counter() - started)
+    try:
+        yield conn
+    finally:
+        conn.close()
+
+@contextmanager
+def begin():
+    """
+    Соединение с транзакцией: commit при успешном выходе, rollback при исключении.
+    Внутри unit_of_work() — её соединение и транзакция (фиксирует единица работы)
+    """
+    uow = _sync_unit_of_work()
+    if uow is not None:
+        yield uow.conn
+        return
+    try:
+        with connect() as conn:
+            with conn.begin():
+                yield conn
+    finally:
+        mark_write()
+
+
+# ===== Асинхронный движок (asyncpg) =====
+def _create_async_engine(url):
+    s = get_settings()
+    connect_args = {}
+    if s.statement_timeout_ms:
+        connect_args["server_settings"] = {"statement_timeout": str(s.statement_timeout_ms)}
+    return create_async_engine(
+        url.replace("postgresql://", "postgresql+asyncpg://", 1),
+        pool_size=s.pool_size,
+        max_overflow=s.max_overflow,
+        pool_timeout=s.pool_timeout,
+        pool_recycle=s.pool_recycle,
+        pool_pre_ping=s.pool_pre_ping,
+        connect_args=connect_args,
+    )
+
+def get_async_engine():
+    global _async_engine
+    if _async_engine is None:
+        with _lock:
+            if _async_engine is None:
+                _async_engine = _create_async_engine(get_settings().postgres_url)
+    return _async_engine
+
+
+# ===================================================
+# ===============  РЕПЛИКИ  =========================
+# ===================================================
+# Чтение без записи (connect_read) уходит на реплики из replica_urls, запись и всё,
+# что открыто через connect()/begin(), — на основной сервер.
+# Фоновый поток раз в replica_check_interval проверяет реплики и меряет отставание;
+# реплика вне строя или отстающая больше replica_max_lag_s из ротации выпадает,
+# а если живых реплик нет — читаем с основного сервера.
+# Read-your-writes: после записи (begin) контекст — поток или asyncio-задача —
+# replica_max_lag_s секунд читает с основного сервера и видит свои изменения.
+
+BALANCE_ROUND_ROBIN = "round_robin"
+BALANCE_LEAST_CONNECTIONS = "least_connections"
+
+# Отставание реплики в секундах; 0 — догнала основной сервер (или это не реплика вовсе)
+REPLICA_LAG_SQL = """
+    SELECT CASE
+        WHEN NOT pg_is_in_recovery() THEN 0
+        -- всё принятое уже применено (после перезапуска receive может быть и меньше replay)
+        WHEN pg_last_wal_replay_lsn() >= pg_last_wal_receive_lsn() THEN 0
+        ELSE COALESCE(EXTRACT(EPOCH FROM now() - pg_last_xact_replay_timestamp()), 0)
+    END
+"""
+
+_last_write = ContextVar("last_write", default=None)
+
+
+class _Replica:
+    def __init__(self, url):
+        self.url = url
+        self.engine = _create_engine(url)
+        self.async_engine = None
+        self.healthy = True       # до первой проверки считаем живой
+        self.lag = None
+        self.in_use = 0
+        self.errors = 0
+        self.checked_at = None
+
+    @property
+    def name(self):
+        return self.engine.url.render_as_string(hide_password=True)
+
+    def get_async_engine(self):
+        if self.async_engine is None:
+            with _lock:
+                if self.async_engine is None:
+                    self.async_engine = _create_async_engine(self.url)
+        return self.async_engine
+
+    def check(self, max_lag):
+        try:
+            with self.engine.connect() as conn:
+                lag = float(conn.execute(text(REPLICA_LAG_SQL)).scalar())
+        except exc.SQLAlchemyError:
+            self.mark_down()
+            return False
+        with _lock:
+            self.lag = lag
+            self.healthy = lag <= max_lag
+            self.checked_at = time.time()
+        return self.healthy
+
+    def mark_down(self):
+        with _lock:
+            self.healthy = False
+            self.errors += 1
+            self.checked_at = time.time()
+
+    def snapshot(self):
+        pool = self.engine.pool
+        return {"url": self.name, "healthy": self.healthy, "lag": self.lag, "in_use": self.in_use,
+                "errors": self.errors, "checked_at": self.checked_at, "checked_out": pool.checkedout()}
+
+
+_round_robin = itertools.count()
+
+def get_replicas():
+    global _replicas
+    if _replicas is None:
+        with _lock:
+            if _replicas is None:
+                s = get_settings()
+                if s.replica_balancing not in (BALANCE_ROUND_ROBIN, BALANCE_LEAST_CONNECTIONS):
+                    raise ValueError(f"Неизвестная балансировка реплик: {s.replica_balancing}")
+                urls = [u.strip() for u in s.replica_urls.split(",") if u.strip()]
+                _replicas = [_Replica(url) for url in urls]
+        if _replicas:
+            _start_health_checks()
+    return _replicas
+
+def check_replicas():
+    """Проверить все реплики сейчас; {url: жива ли}."""
+    max_lag = get_settings().replica_max_lag_s
+    return {replica.name: replica.check(max_lag) for replica in get_replicas()}
+
+def _health_loop(stop, replicas):
+    s = get_settings()
+    while not stop.wait(s.replica_check_interval):
+        for replica in replicas:
+            replica.check(s.replica_max_lag_s)
+
+def _start_health_checks():
+    global _health_thread
+    with _lock:
+        if _health_thread is not None:
+            return
+        _health_thread = threading.Thread(target=_health_loop, args=(_health_stop, _replicas),
+                                          name="replica-health", daemon=True)
+        _health_thread.start()
+
+def mark_write():
+    """Контекст только что писал: ближайшие чтения — с основного сервера."""
+    _last_write.set(time.monotonic())
+
+@contextmanager
+def session():
+    """Отдельная «сессия» read-your-writes, например на один HTTP-запрос в пуле потоков."""
+    token = _last_write.set(None)
+    try:
+        yield
+    finally:
+        _last_write.reset(token)
+
+def _choose_replicas():
+    """Реплики в порядке попытки; пусто — читать с основного сервера."""
+    replicas = get_replicas()
+    if not replicas:
+        return []
+    last_write = _last_write.get()
+    if last_write is not None and time.monotonic() - last_write < get_settings().replica_max_lag_s:
+        return []
+    healthy = [r for r in replicas if r.healthy]
+    if not healthy:
+        return []
+    if get_settings().replica_balancing == BALANCE_LEAST_CONNECTIONS:
+        return sorted(healthy, key=lambda r: r.in_use)
+    start = next(_round_robin) % len(healthy)
+    return healthy[start:] + healthy[:start]
+
+def _acquire(replica, delta):
+    with _lock:
+        replica.in_use += delta
+
+@contextmanager
+def connect_read():
+    """
+    Соединение только для чтения: реплика по правилам балансировки или основной сервер.
+    Недоступная реплика помечается нерабочей, и берётся следующая.
+    Внутри unit_of_work() — соединение единицы работы: она видит свои изменения
+    """
+    uow = _sync_unit_of_work()
+    if uow is not None:
+        yield uow.conn
+        return
+    for replica in _choose_replicas():
+        started = time.perf_counter()
+        try:
+            conn = replica.engine.connect()
+        except exc.OperationalError:
+            replica.mark_down()
+            continue
+        _record_checkout(time.perf_counter() - started)
+        _acquire(replica, 1)
+        try:
+            yield conn
+        finally:
+            _acquire(replica, -1)
+            conn.close()
+        return
+    with connect() as conn:
+        yield conn
+
+@asynccontextmanager
+async def connect_read_async():
+    uow = async_unit_of_work()
+    if uow is not None:
+        yield uow.conn
+        return
+    for replica in _choose_replicas():
+        try:
+            conn = await replica.get_async_engine().connect()
+        except (exc.OperationalError, OSError):
+            replica.mark_down()
+            continue
+        _acquire(replica, 1)
+        try:
+            yield conn
+        finally:
+            _acquire(replica, -1)
+            await conn.close()
+        return
+    async with get_async_engine().connect() as conn:
+        yield conn
+
+
+# ===================================================
+# ===============  ЕДИНИЦА РАБОТЫ  ==================
+# ===================================================
+# Несколько CRUD-вызовов на одном соединении и в одной транзакции:
+#
+#   with unit_of_work():
+#       supply_id = create_supply_order(1, 1)
+#       add_item_to_supply(supply_id, 1, 10)     # ошибка здесь откатит и заявку
+#
+# Внутри единицы работы connect()/begin()/connect_read() отдают её соединение,
+# а begin() не открывает новую транзакцию. Вложенный unit_of_work() — точка сохранения:
+# его ошибку можно поймать, и откатится только он.
+# Побочные эффекты, зарегистрированные через after_commit (журнал, инвалидация кэша,
+# лента заказов), выполняются один раз после фиксации; при откате — отбрасываются.
+# Без единицы работы after_commit выполняет их сразу, как раньше.
+
+class UnitOfWork:
+    def __init__(self, conn, is_async=False):
+        self.conn = conn
+        self.is_async = is_async
+        self.callbacks = []
+
+_unit_of_work = ContextVar("unit_of_work", default=None)
+
+def current_unit_of_work():
+    return _unit_of_work.get()
+
+def _sync_unit_of_work():
+    uow = _unit_of_work.get()
+    return uow if uow is not None and not uow.is_async else None
+
+def async_unit_of_work():
+    uow = _unit_of_work.get()
+    return uow if uow is not None and uow.is_async else None
+
+def after_commit(fn, *args, **kwargs):
+    """Выполнить fn после фиксации текущей единицы работы (или сразу, если её нет)."""
+    uow = _unit_of_work.get()
+    if uow is None:
+        return fn(*args, **kwargs)
+    uow.callbacks.append((fn, args, kwargs))
+
+async def after_commit_async(fn, *args, **kwargs):
+    """То же для асинхронного кода; fn может быть корутиной."""
+    uow = _unit_of_work.get()
+    if uow is not None:
+        uow.callbacks.append((fn, args, kwargs))
+        return
+    result = fn(*args, **kwargs)
+    if inspect.isawaitable(result):
+        await result
+
+def _run_callbacks(callbacks):
+    # данные уже зафиксированы: выполняем все, первую ошибку поднимаем в конце
+    error = None
+    for fn, args, kwargs in callbacks:
+        try:
+            fn(*args, **kwargs)
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
+
+@contextmanager
+def unit_of_work():
+    parent = _sync_unit_of_work()
+    if parent is not None:
+        uow = UnitOfWork(parent.conn)
+        token = _unit_of_work.set(uow)
+        try:
+            with parent.conn.begin_nested():
+                yield uow
+        finally:
+            _unit_of_work.reset(token)
+        # точка сохранения отпущена: её эффекты ждут фиксации внешней единицы
+        parent.callbacks.extend(uow.callbacks)
+        return
+
+    with connect() as conn:
+        uow = UnitOfWork(conn)
+        token = _unit_of_work.set(uow)
+        try:
+            with conn.begin():
+                yield uow
+        finally:
+            _unit_of_work.reset(token)
+            mark_write()
+    _run_callbacks(uow.callbacks)
+
+@asynccontextmanager
+async def unit_of_work_async():
+    parent = async_unit_of_work()
+    if parent is not None:
+        uow = UnitOfWork(parent.conn, is_async=True)
+        token = _unit_of_work.set(uow)
+        try:
+            async with parent.conn.begin_nested():
+                yield uow
+        finally:
+            _unit_of_work.reset(token)
+        parent.callbacks.extend(uow.callbacks)
+        return
+
+    async with get_async_engine().connect() as conn:
+        uow = UnitOfWork(conn, is_async=True)
+        token = _unit_of_work.set(uow)
+        try:
+            async with conn.begin():
+                yield uow
+        finally:
+            _unit_of_work.reset(token)
+            mark_write()
+    error = None
+    for fn, args, kwargs in uow.callbacks:
+        try:
+            result = fn(*args, **kwargs)
+            if inspect.isawaitable(result):
+                await result
+        except Exception as e:
+            error = error or e
+    if error is not None:
+        raise error
+
+
+# ===================================================
+# ===============  MONGODB  =========================
+# ===================================================
+
+class _MongoPoolStats(monitoring.ConnectionPoolListener):
+    def __init__(self):
+        self.checked_out = 0
+        self.checkouts = 0
+        self.failed = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self._started = threading.local()
+        self._lock = threading.Lock()
+
+    def connection_check_out_started(self, event):
+        self._started.at = time.perf_counter()
+
+    def connection_checked_out(self, event):
+        wait = time.perf_counter() - getattr(self._started, "at", time.perf_counter())
+        with self._lock:
+            self.checked_out += 1
+            self.checkouts += 1
+            self.wait_total += wait
+            self.wait_max = max(self.wait_max, wait)
+
+    def connection_check_out_failed(self, event):
+        with self._lock:
+            self.failed += 1
+
+    def connection_checked_in(self, event):
+        with self._lock:
+            self.checked_out -= 1
+
+    def pool_created(self, event): pass
+    def pool_ready(self, event): pass
+    def pool_cleared(self, event): pass
+    def pool_closed(self, event): pass
+    def connection_created(self, event): pass
+    def connection_ready(self, event): pass
+    def connection_closed(self, event): pass
+
+    def snapshot(self):
+        with self._lock:
+            return {"checked_out": self.checked_out, "checkouts": self.checkouts,
+                    "checkout_failed": self.failed, "wait_total": self.wait_total,
+                    "wait_max": self.wait_max}
+
+_mongo_pool = _MongoPoolStats()
+
+def get_mongo_client():
+    global _mongo_client
+    if _mongo_client is None:
+        with _lock:
+            if _mongo_client is None:
+                s = get_settings()
+                _mongo_client = MongoClient(
+                    s.mongo_url,
+                    maxPoolSize=s.mongo_max_pool_size,
+                    serverSelectionTimeoutMS=s.mongo_server_selection_timeout_ms,
+                    event_listeners=[_mongo_pool],
+                    connect=False,
+                )
+    return _mongo_client
+
+def get_mongo_db():
+    return get_mongo_client()[get_settings().mongo_db]
+
+def get_async_mongo_db():
+    global _async_mongo_client
+    if _async_mongo_client is None:
+        with _lock:
+            if _async_mongo_client is None:
+                s = get_settings()
+                _async_mongo_client = AsyncMongoClient(
+                    s.mongo_url,
+                    maxPoolSize=s.mongo_max_pool_size,
+                    serverSelectionTimeoutMS=s.mongo_server_selection_timeout_ms,
+                    connect=False,
+                )
+    return _async_mongo_client[get_settings().mongo_db]
+
+
+# ===================================================
+# ===============  МЕТРИКИ И ЖИЗНЕННЫЙ ЦИКЛ  ========
+# ===================================================
+
+def pool_stats():
+    stats = {"postgres": None, "mongo": _mongo_pool.snapshot()}
+    if _engine is not None:
+        pool = _engine.pool
+        with _lock:
+            wait = dict(_pg_wait)
+        stats["postgres"] = {
+            "size": pool.size(),
+            "checked_out": pool.checkedout(),
+            "checked_in": pool.checkedin(),
+            "overflow": pool.overflow(),
+            **wait,
+            "wait_avg": wait["wait_total"] / wait["checkouts"] if wait["checkouts"] else 0.0,
+        }
+    if _replicas:
+        stats["replicas"] = [replica.snapshot() for replica in _replicas]
+    return stats
+
+def reset():
+    """Закрыть пулы; следующее обращение создаст их заново по текущим настройкам."""
+    global _engine, _mongo_client, _async_engine, _async_mongo_client, _replicas, _health_thread, _health_stop
+    with _lock:
+        engine, client, replicas = _engine, _mongo_client, _replicas or []
+        _engine = _mongo_client = _replicas = None
+        # асинхронные пулы закрываются из event loop: см. dispose_async()
+        _async_engine = _async_mongo_client = None
+        _health_stop.set()
+        _health_thread, _health_stop = None, threading.Event()
+    if engine is not None:
+        engine.dispose()
+    for replica in replicas:
+        replica.engine.dispose()
+    if client is not None:
+        client.close()
+
+async def dispose_async():
+    global _async_engine, _async_mongo_client
+    with _lock:
+        engine, client = _async_engine, _async_mongo_client
+        _async_engine = _async_mongo_client = None
+        replica_engines = [r.async_engine for r in _replicas or [] if r.async_engine is not None]
+        for replica in _replicas or []:
+            replica.async_engine = None
+    if engine is not None:
+        await engine.dispose()
+    for replica_engine in replica_engines:
+        await replica_engine.dispose()
+    if client is not None:
+        await client.close()
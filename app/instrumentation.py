@@ -0,0 +1,460 @@
+import functools
+import importlib
+import inspect
+import json
+import logging
+import os
+import threading
+import time
+from collections import deque
+from contextvars import ContextVar
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from pymongo import monitoring
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+from app import db
+from app.settings import get_settings
+
+# Инструментирование CRUD-функций: латентность (гистограммы), число SQL-запросов,
+# строки, время выдачи соединения из пула, время SQL и команд MongoDB, время safe_log.
+#
+#   from app import instrumentation
+#   instrumentation.instrument()          # до "from app.crud_postgres import ..." в точке входа
+#   instrumentation.snapshot() / to_json() / to_prometheus() / write_prometheus(path) / serve(port)
+#
+# На вызов — пара perf_counter, ContextVar и одна короткая блокировка; на запрос — добавление
+# в список. Для медленных вызовов (metrics_slow_ms) сохраняются SQL и параметры.
+
+logger = logging.getLogger(__name__)
+
+# Границы корзин гистограммы, миллисекунды
+BUCKETS_MS = (0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+# Сколько запросов одного вызова помнить для журнала медленных операций
+MAX_CAPTURED_STATEMENTS = 50
+MAX_PARAM_REPR = 500
+
+DEFAULT_MODULES = ("app.crud_postgres", "app.crud_mongo", "app.crud_postgres_async", "app.crud_mongo_async")
+# Служебные функции, которые не являются операциями сами по себе
+EXCLUDED = {
+    "safe_log", "cached_select", "enable_cache_sync", "get_cache_stats", "paged_query", "stream_rows",
+    "fetch_all", "fetch_one", "connect", "connect_read", "begin", "ensure_indexes", "get_log_writer",
+    "flush_logs", "close_logs", "get_log_stats",
+}
+
+_current = ContextVar("instrumentation_call", default=None)
+_lock = threading.Lock()
+_functions = {}
+_slow_log = deque(maxlen=100)
+_background = {"mongo_commands": 0, "mongo_ms": 0.0}
+_installed = False
+_originals = []
+
+
+class _Call:
+    """Счётчики одного вызова CRUD-функции."""
+    __slots__ = ("statements", "rows", "sql_ms", "checkout_ms", "mongo_commands", "mongo_ms",
+                 "log_ms", "captured")
+
+    def __init__(self):
+        self.statements = 0
+        self.rows = 0
+        self.sql_ms = 0.0
+        self.checkout_ms = 0.0
+        self.mongo_commands = 0
+        self.mongo_ms = 0.0
+        self.log_ms = 0.0
+        self.captured = []
+
+    def add(self, other):
+        self.statements += other.statements
+        self.rows += other.rows
+        self.sql_ms += other.sql_ms
+        self.checkout_ms += other.checkout_ms
+        self.mongo_commands += other.mongo_commands
+        self.mongo_ms += other.mongo_ms
+        self.log_ms += other.log_ms
+
+
+class _FunctionStats:
+    __slots__ = ("calls", "errors", "total_ms", "max_ms", "buckets", "statements", "rows",
+                 "sql_ms", "checkout_ms", "mongo_commands", "mongo_ms", "log_ms")
+
+    def __init__(self):
+        self.calls = self.errors = self.statements = self.rows = self.mongo_commands = 0
+        self.total_ms = self.max_ms = self.sql_ms = self.checkout_ms = self.mongo_ms = self.log_ms = 0.0
+        self.buckets = [0] * (len(BUCKETS_MS) + 1)
+
+    def record(self, elapsed_ms, call, failed):
+        self.calls += 1
+        self.errors += failed
+        self.total_ms += elapsed_ms
+        self.max_ms = max(self.max_ms, elapsed_ms)
+        for i, bound in enumerate(BUCKETS_MS):
+            if elapsed_ms <= bound:
+                self.buckets[i] += 1
+                break
+        else:
+            self.buckets[-1] += 1
+        self.statements += call.statements
+        self.rows += call.rows
+        self.sql_ms += call.sql_ms
+        self.checkout_ms += call.checkout_ms
+        self.mongo_commands += call.mongo_commands
+        self.mongo_ms += call.mongo_ms
+        self.log_ms += call.log_ms
+
+    def quantile(self, q):
+        """Оценка квантиля по корзинам (верхняя граница корзины)."""
+        target = q * self.calls
+        seen = 0
+        for i, count in enumerate(self.buckets):
+            seen += count
+            if count and seen >= target:
+                return BUCKETS_MS[i] if i < len(BUCKETS_MS) else self.max_ms
+        return 0.0
+
+    def to_dict(self):
+        calls = self.calls or 1
+        return {
+            "calls": self.calls, "errors": self.errors,
+            "mean_ms": round(self.total_ms / calls, 3), "max_ms": round(self.max_ms, 3),
+            "p50_ms": self.quantile(0.50), "p95_ms": self.quantile(0.95), "p99_ms": self.quantile(0.99),
+            "statements": self.statements, "statements_per_call": round(self.statements / calls, 2),
+            "rows": self.rows,
+            "sql_ms": round(self.sql_ms, 3), "checkout_ms": round(self.checkout_ms, 3),
+            "mongo_commands": self.mongo_commands, "mongo_ms": round(self.mongo_ms, 3),
+            "log_ms": round(self.log_ms, 3),
+            "buckets": dict(zip([*map(str, BUCKETS_MS), "+Inf"], self.buckets)),
+        }
+
+
+# ===== Учёт вызова =====
+def _finish(name, call, parent, started, failed):
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    if parent is not None:
+        parent.add(call)
+    with _lock:
+        stats = _functions.get(name)
+        if stats is None:
+            stats = _functions[name] = _FunctionStats()
+        stats.record(elapsed_ms, call, failed)
+    slow_ms = get_settings().metrics_slow_ms
+    if slow_ms and elapsed_ms >= slow_ms:
+        entry = {
+            "function": name,
+            "at": time.time(),
+            "duration_ms": round(elapsed_ms, 3),
+            "statements": [{"sql": sql, "params": _short(params), "ms": round(ms, 3)}
+                           for sql, params, ms in call.captured],
+        }
+        with _lock:
+            _slow_log.append(entry)
+        logger.warning("Медленный вызов %s: %.1f мс, запросов: %d", name, elapsed_ms, call.statements)
+
+def _short(params):
+    text = repr(params)
+    return text if len(text) <= MAX_PARAM_REPR else text[:MAX_PARAM_REPR] + "..."
+
+def _wrap(name, fn):
+    if inspect.iscoroutinefunction(fn):
+        @functools.wraps(fn)
+        async def async_wrapper(*args, **kwargs):
+            call, parent = _Call(), _current.get()
+            token = _current.set(call)
+            started = time.perf_counter()
+            failed = True
+            try:
+                result = await fn(*args, **kwargs)
+                failed = False
+                return result
+            finally:
+                _current.reset(token)
+                _finish(name, call, parent, started, failed)
+        return async_wrapper
+
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        call, parent = _Call(), _current.get()
+        token = _current.set(call)
+        started = time.perf_counter()
+        failed = True
+        try:
+            result = fn(*args, **kwargs)
+            failed = False
+        finally:
+            _current.reset(token)
+            if failed:
+                _finish(name, call, parent, started, True)
+        if inspect.isgenerator(result):
+            # iter_*: считаем время внутри генератора, а не время обработки строк вызывающим
+            return _wrap_generator(name, result, call, parent, started)
+        if inspect.isasyncgen(result):
+            return _wrap_async_generator(name, result, call, parent, started)
+        _finish(name, call, parent, started, False)
+        return result
+    return wrapper
+
+def _wrap_generator(name, gen, call, parent, started):
+    active = time.perf_counter() - started
+    failed = True
+    try:
+        while True:
+            token = _current.set(call)
+            step = time.perf_counter()
+            try:
+                item = next(gen)
+            except StopIteration:
+                break
+            finally:
+                active += time.perf_counter() - step
+                _current.reset(token)
+            # серверный курсор не сообщает rowcount — считаем выданные строки
+            call.rows += 1
+            yield item
+        failed = False
+    finally:
+        gen.close()
+        _finish(name, call, parent, time.perf_counter() - active, failed)
+
+async def _wrap_async_generator(name, gen, call, parent, started):
+    active = time.perf_counter() - started
+    failed = True
+    try:
+        while True:
+            token = _current.set(call)
+            step = time.perf_counter()
+            try:
+                item = await gen.__anext__()
+            except StopAsyncIteration:
+                break
+            finally:
+                active += time.perf_counter() - step
+                _current.reset(token)
+            # серверный курсор не сообщает rowcount — считаем выданные строки
+            call.rows += 1
+            yield item
+        failed = False
+    finally:
+        await gen.aclose()
+        _finish(name, call, parent, time.perf_counter() - active, failed)
+
+def _timed_log(fn):
+    @functools.wraps(fn)
+    def wrapper(*args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        finally:
+            call = _current.get()
+            if call is not None:
+                call.log_ms += (time.perf_counter() - started) * 1000
+    return wrapper
+
+
+# ===== Хуки драйверов =====
+# Начало запроса хранится в контексте выполнения: он живёт ровно один запрос,
+# поэтому упавший запрос ничего не оставляет на соединении из пула
+def _before_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    if context is not None:
+        context._instr_start = time.perf_counter()
+
+def _record_statement(context, statement, parameters, rows):
+    started = getattr(context, "_instr_start", None)
+    call = _current.get()
+    if started is None or call is None:
+        # запрос начался до instrument() или вне вызова CRUD
+        return
+    context._instr_start = None
+    ms = (time.perf_counter() - started) * 1000
+    call.statements += 1
+    call.sql_ms += ms
+    if rows and rows > 0:
+        call.rows += rows
+    if len(call.captured) < MAX_CAPTURED_STATEMENTS:
+        call.captured.append((statement, parameters, ms))
+
+def _after_cursor_execute(conn, cursor, statement, parameters, context, executemany):
+    _record_statement(context, statement, parameters, cursor.rowcount)
+
+def _handle_error(exception_context):
+    _record_statement(exception_context.execution_context, exception_context.statement,
+                      exception_context.parameters, 0)
+
+def _on_checkout(wait):
+    call = _current.get()
+    if call is not None:
+        call.checkout_ms += wait * 1000
+
+
+class _MongoCommands(monitoring.CommandListener):
+    def started(self, event):
+        pass
+
+    def succeeded(self, event):
+        self._record(event)
+
+    def failed(self, event):
+        self._record(event)
+
+    def _record(self, event):
+        ms = event.duration_micros / 1000
+        call = _current.get()
+        if call is None:
+            # фоновая запись журнала (BatchWriter) идёт вне вызовов CRUD
+            with _lock:
+                _background["mongo_commands"] += 1
+                _background["mongo_ms"] += ms
+            return
+        call.mongo_commands += 1
+        call.mongo_ms += ms
+        if len(call.captured) < MAX_CAPTURED_STATEMENTS:
+            call.captured.append((f"mongo {event.command_name}", event.database_name, ms))
+
+
+# ===== Установка =====
+def instrument(modules=DEFAULT_MODULES):
+    """
+    Обернуть публичные функции модулей CRUD и подключить хуки SQLAlchemy и pymongo.
+    Повторный вызов ничего не делает. Возвращает число обёрнутых функций.
+    Клиенты MongoDB, созданные до вызова, команды не отчитывают — вызывайте при старте.
+    """
+    global _installed, _slow_log
+    with _lock:
+        if _installed:
+            return 0
+        _installed = True
+        _slow_log = deque(maxlen=get_settings().metrics_slow_log_size)
+    event.listen(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.listen(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.listen(Engine, "handle_error", _handle_error)
+    db.checkout_listeners.append(_on_checkout)
+    monitoring.register(_MongoCommands())
+
+    wrapped = 0
+    timed = {}   # id исходного safe_log -> обёртка: модули импортируют одну и ту же функцию
+    for module_name in modules:
+        module = importlib.import_module(module_name)
+        short = module_name.rsplit(".", 1)[-1]
+        for name, fn in list(vars(module).items()):
+            if name == "safe_log" and callable(fn):
+                if fn in timed.values():
+                    # модуль импортировал safe_log уже после замены в исходном модуле
+                    continue
+                _originals.append((module, name, fn))
+                setattr(module, name, timed.setdefault(id(fn), _timed_log(fn)))
+                continue
+            if (name.startswith("_") or name in EXCLUDED or not inspect.isfunction(fn)
+                    or fn.__module__ != module_name):
+                continue
+            _originals.append((module, name, fn))
+            setattr(module, name, _wrap(f"{short}.{name}", fn))
+            wrapped += 1
+    return wrapped
+
+def uninstrument():
+    """Вернуть исходные функции и отключить хуки (тесты, отладка)."""
+    global _installed
+    with _lock:
+        if not _installed:
+            return
+        _installed = False
+    while _originals:
+        module, name, fn = _originals.pop()
+        setattr(module, name, fn)
+    event.remove(Engine, "before_cursor_execute", _before_cursor_execute)
+    event.remove(Engine, "after_cursor_execute", _after_cursor_execute)
+    event.remove(Engine, "handle_error", _handle_error)
+    if _on_checkout in db.checkout_listeners:
+        db.checkout_listeners.remove(_on_checkout)
+    # слушатель pymongo снять нельзя: без активного вызова он учитывает только фон
+
+
+# ===== Экспорт =====
+def snapshot():
+    with _lock:
+        functions = {name: stats.to_dict() for name, stats in sorted(_functions.items())}
+        slow = list(_slow_log)
+        background = dict(_background)
+    return {"functions": functions, "slow": slow, "background": background, "pools": db.pool_stats()}
+
+def reset_metrics():
+    with _lock:
+        _functions.clear()
+        _slow_log.clear()
+        _background.update(mongo_commands=0, mongo_ms=0.0)
+
+def to_json(indent=None):
+    return json.dumps(snapshot(), ensure_ascii=False, indent=indent, default=str)
+
+def to_prometheus():
+    """Текстовый формат Prometheus: гистограммы латентности и счётчики по функциям."""
+    with _lock:
+        items = [(name, stats.to_dict(), list(stats.buckets), stats.total_ms)
+                 for name, stats in sorted(_functions.items())]
+        background = dict(_background)
+    lines = [
+        "# HELP cafe_crud_duration_seconds Латентность CRUD-функций",
+        "# TYPE cafe_crud_duration_seconds histogram",
+    ]
+    for name, data, buckets, total_ms in items:
+        cumulative = 0
+        for bound, count in zip([*BUCKETS_MS, None], buckets):
+            cumulative += count
+            le = "+Inf" if bound is None else repr(bound / 1000)
+            lines.append(f'cafe_crud_duration_seconds_bucket{{function="{name}",le="{le}"}} {cumulative}')
+        lines.append(f'cafe_crud_duration_seconds_sum{{function="{name}"}} {total_ms / 1000}')
+        lines.append(f'cafe_crud_duration_seconds_count{{function="{name}"}} {data["calls"]}')
+    counters = [
+        ("cafe_crud_errors_total", "errors", 1, "Вызовы, завершившиеся исключением"),
+        ("cafe_crud_statements_total", "statements", 1, "SQL-запросы, выполненные внутри вызовов"),
+        ("cafe_crud_rows_total", "rows", 1, "Строки, возвращённые или изменённые запросами"),
+        ("cafe_crud_sql_seconds_total", "sql_ms", 1000, "Время выполнения SQL"),
+        ("cafe_crud_checkout_seconds_total", "checkout_ms", 1000, "Ожидание соединения из пула"),
+        ("cafe_crud_mongo_commands_total", "mongo_commands", 1, "Команды MongoDB внутри вызовов"),
+        ("cafe_crud_mongo_seconds_total", "mongo_ms", 1000, "Время команд MongoDB"),
+        ("cafe_crud_log_seconds_total", "log_ms", 1000, "Время safe_log"),
+    ]
+    for metric, key, scale, help_text in counters:
+        lines += [f"# HELP {metric} {help_text}", f"# TYPE {metric} counter"]
+        lines += [f'{metric}{{function="{name}"}} {data[key] / scale}' for name, data, _, _ in items]
+    lines += [
+        "# HELP cafe_background_mongo_commands_total Команды MongoDB вне вызовов (фоновый журнал)",
+        "# TYPE cafe_background_mongo_commands_total counter",
+        f"cafe_background_mongo_commands_total {background['mongo_commands']}",
+    ]
+    return "\n".join(lines) + "\n"
+
+def write_prometheus(path):
+    """Записать метрики для node_exporter textfile collector (атомарно, через rename)."""
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        f.write(to_prometheus())
+    os.replace(tmp, path)
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path == "/metrics":
+            body, content_type = to_prometheus(), "text/plain; version=0.0.4"
+        elif self.path == "/snapshot.json":
+            body, content_type = to_json(indent=2), "application/json"
+        else:
+            self.send_error(404)
+            return
+        data = body.encode("utf-8")
+        self.send_response(200)
+        self.send_header("Content-Type", f"{content_type}; charset=utf-8")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def serve(port=9108, host="127.0.0.1"):
+    """HTTP-сервер метрик в фоновом потоке: /metrics и /snapshot.json. Возвращает сервер."""
+    server = ThreadingHTTPServer((host, port), _MetricsHandler)
+    threading.Thread(target=server.serve_forever, name="metrics-http", daemon=True).start()
+    return server
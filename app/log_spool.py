@@ -0,0 +1,449 @@
+import argparse
+import atexit
+import collections
+import json
+import os
+import threading
+import time
+import uuid
+
+import bson
+from bson import json_util
+from pymongo import UpdateOne, errors
+from pymongo import timeout as mongo_timeout
+
+from app.db import get_mongo_db
+from app.log_storage import LOGS
+from app.settings import get_settings
+
+# Журнал действий не должен зависеть от здоровья MongoDB: safe_log вызывается после
+# фиксации транзакции в Postgres, и медленная или лежащая MongoDB не должна ни тормозить,
+# ни ронять add_customer / create_order.
+#
+# Пачки журнала (фоновая очередь crud_mongo) пишутся так:
+#   1. в MongoDB, но не дольше log_mongo_timeout_ms на пачку (pymongo.timeout);
+#   2. при ошибке или превышении бюджета — в спул на диске log_spool_dir:
+#      сегменты JSON Lines только на дозапись, новый сегмент — после log_spool_segment_bytes;
+#   3. после log_breaker_failures неудач подряд автомат размыкается: следующие
+#      log_breaker_cooldown_s секунд MongoDB не трогаем, пишем сразу на диск;
+#      затем одна пробная пачка решает, замкнуть автомат или ждать дальше.
+# Когда MongoDB снова отвечает, фоновый replay переносит сегменты в logs пачками upsert
+# по log_id — повтор (или пачка, записанная, но не подтверждённая до таймаута) дублей не даёт.
+#
+#   python -m app.log_spool status
+#   python -m app.log_spool replay [--max-segments N]
+
+SEGMENT_SUFFIX = ".jsonl"
+OPEN_SUFFIX = ".open"       # сегмент, в который процесс ещё пишет
+REPLAY_BATCH = 1000
+DUPLICATE_KEY = 11000
+
+BREAKER_CLOSED = "closed"
+BREAKER_OPEN = "open"
+BREAKER_HALF_OPEN = "half_open"
+
+_spool = None
+_breaker = None
+_lock = threading.Lock()
+_replay_lock = threading.Lock()
+_replay_state = {"started": False, "pending": False, "thread": None,
+                 "runs": 0, "replayed": 0, "errors": 0, "last_error": None}
+# записи из event loop, не поместившиеся в очередь: на диск их пишет поток log-spool-overflow
+_overflow = collections.deque()
+_overflow_ready = threading.Event()
+_overflow_state = {"thread": None, "errors": 0, "last_error": None}
+
+
+def new_log_id():
+    return uuid.uuid4().hex
+
+
+# ===== Автомат =====
+class CircuitBreaker:
+    """Размыкается после failures неудач подряд; через cooldown секунд пропускает одну пробу."""
+
+    def __init__(self, failures=3, cooldown=30.0, clock=time.monotonic):
+        if failures < 1:
+            raise ValueError("failures должно быть положительным")
+        self.failures = failures
+        self.cooldown = cooldown
+        self._clock = clock
+        self._lock = threading.Lock()
+        self._state = BREAKER_CLOSED
+        self._failed = 0
+        self._opened_at = 0.0
+        self._stats = {"opened": 0, "rejected": 0}
+
+    def allow(self):
+        """Можно ли сейчас обращаться к MongoDB"""
+        with self._lock:
+            if self._state == BREAKER_CLOSED:
+                return True
+            if self._state == BREAKER_OPEN and self._clock() - self._opened_at >= self.cooldown:
+                self._state = BREAKER_HALF_OPEN
+                return True
+            self._stats["rejected"] += 1
+            return False
+
+    def record_success(self):
+        """Отметить удачу; True, если автомат был разомкнут (MongoDB вернулась)"""
+        with self._lock:
+            recovered = self._state != BREAKER_CLOSED
+            self._state = BREAKER_CLOSED
+            self._failed = 0
+            return recovered
+
+    def record_failure(self):
+        with self._lock:
+            self._failed += 1
+            if self._state == BREAKER_HALF_OPEN or self._failed >= self.failures:
+                if self._state != BREAKER_OPEN:
+                    self._stats["opened"] += 1
+                self._state = BREAKER_OPEN
+                self._opened_at = self._clock()
+
+    @property
+    def state(self):
+        with self._lock:
+            return self._state
+
+    def snapshot(self):
+        with self._lock:
+            return dict(self._stats, state=self._state, consecutive_failures=self._failed)
+
+
+# ===== Спул на диске =====
+def _encode(doc):
+    doc = {k: v for k, v in doc.items() if k != "_id"}
+    try:
+        # запись, которую не примет MongoDB, replay не перенёс бы никогда
+        bson.encode(doc)
+        return json_util.dumps(doc)
+    except (TypeError, bson.errors.BSONError):
+        # details с типом, который не сериализуется, сохраняем строкой, а не теряем запись
+        return json_util.dumps(dict(doc, details=str(doc.get("details"))))
+
+def _pid_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        return True
+    return True
+
+def _segment_pid(name):
+    try:
+        return int(name.split(".")[0].split("-")[1])
+    except (IndexError, ValueError):
+        return None
+
+
+class Spool:
+    """
+    Сегменты <время_нс>-<pid>.open -> .jsonl в каталоге directory. Каждый процесс пишет в свой
+    сегмент; закрытые (.jsonl) сегменты забирает replay. Пачка дописывается целиком и fsync-ается
+    """
+
+    def __init__(self, directory, segment_bytes=16 * 1024 * 1024):
+        if segment_bytes < 1:
+            raise ValueError("segment_bytes должно быть положительным")
+        self.directory = directory
+        self.segment_bytes = segment_bytes
+        self._lock = threading.Lock()
+        self._file = None
+        self._path = None
+        self._size = 0
+        self._stats = {"spooled": 0, "segments": 0}
+
+    def append(self, docs):
+        data = "".join(_encode(doc) + "\n" for doc in docs).encode("utf-8")
+        with self._lock:
+            if self._file is not None and self._size >= self.segment_bytes:
+                self._rotate()
+            if self._file is None:
+                self._open()
+            self._file.write(data)
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._size += len(data)
+            self._stats["spooled"] += len(docs)
+
+    def rotate(self):
+        """Закрыть текущий сегмент, чтобы его мог забрать replay"""
+        with self._lock:
+            self._rotate()
+
+    close = rotate
+
+    def segments(self):
+        """Закрытые сегменты от старых к новым; сегменты упавших процессов закрываются здесь же"""
+        if not os.path.isdir(self.directory):
+            return []
+        with self._lock:
+            current = self._path
+        for name in os.listdir(self.directory):
+            path = os.path.join(self.directory, name)
+            if not name.endswith(OPEN_SUFFIX) or path == current:
+                continue
+            pid = _segment_pid(name)
+            if pid is not None and pid != os.getpid() and not _pid_alive(pid):
+                try:
+                    os.replace(path, path[:-len(OPEN_SUFFIX)] + SEGMENT_SUFFIX)
+                except FileNotFoundError:
+                    pass  # забрал другой процесс
+        return sorted(os.path.join(self.directory, name) for name in os.listdir(self.directory)
+                      if name.endswith(SEGMENT_SUFFIX))
+
+    def stats(self):
+        with self._lock:
+            data = dict(self._stats)
+        pending = self.segments()
+        data["pending_segments"] = len(pending)
+        data["pending_bytes"] = sum(os.path.getsize(p) for p in pending if os.path.exists(p))
+        return data
+
+    # Вызываются под self._lock
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self._path = os.path.join(self.directory, f"{time.time_ns():020d}-{os.getpid()}{OPEN_SUFFIX}")
+        self._file = open(self._path, "ab")
+        self._size = 0
+        self._stats["segments"] += 1
+
+    def _rotate(self):
+        if self._file is None:
+            return
+        self._file.close()
+        os.replace(self._path, self._path[:-len(OPEN_SUFFIX)] + SEGMENT_SUFFIX)
+        self._file = self._path = None
+
+
+def read_segment(path):
+    """(записи, число испорченных строк); оборванная последняя строка после сбоя пропускается"""
+    docs, corrupt = [], 0
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if not line.strip():
+                continue
+            try:
+                docs.append(json_util.loads(line))
+            except ValueError:
+                corrupt += 1
+    return docs, corrupt
+
+
+# ===== Общие экземпляры =====
+def get_spool():
+    global _spool
+    if _spool is None:
+        with _lock:
+            if _spool is None:
+                s = get_settings()
+                _spool = Spool(s.log_spool_dir, s.log_spool_segment_bytes)
+                atexit.register(_spool.close)
+    return _spool
+
+def get_breaker():
+    global _breaker
+    if _breaker is None:
+        with _lock:
+            if _breaker is None:
+                s = get_settings()
+                _breaker = CircuitBreaker(s.log_breaker_failures, s.log_breaker_cooldown_s)
+    return _breaker
+
+
+# ===== Запись пачки =====
+def _insert(batch):
+    budget = get_settings().log_mongo_timeout_ms
+    with mongo_timeout(budget / 1000 if budget > 0 else None):
+        try:
+            get_mongo_db()[LOGS].insert_many(batch, ordered=False)
+        except errors.BulkWriteError as e:
+            # пачка уже записана (ответ не дошёл до таймаута) — дубли log_id не ошибка
+            details = e.details or {}
+            if details.get("writeConcernErrors") or any(
+                    err.get("code") != DUPLICATE_KEY for err in details.get("writeErrors", ())):
+                raise
+
+def _spool_batch(batch):
+    """В спул; следующая успешная пачка запустит replay, даже если автомат не размыкался"""
+    get_spool().append(batch)
+    with _lock:
+        _replay_state["pending"] = True
+
+def spool_overflow(docs):
+    """
+    Записи, которым не хватило места в очереди, когда ждать нельзя (асинхронный код).
+    Не блокирует: записи ложатся в буфер в памяти, в спул (блокировка, fsync) их пишет
+    поток log-spool-overflow; replay перенесёт их после следующей успешной пачки
+    """
+    for doc in docs:
+        doc.setdefault("log_id", new_log_id())
+    _overflow.extend(docs)
+    _overflow_ready.set()
+    thread = _overflow_state["thread"]
+    if thread is None or not thread.is_alive():
+        _start_overflow_thread()
+
+def _start_overflow_thread():
+    with _lock:
+        thread = _overflow_state["thread"]
+        if thread is not None and thread.is_alive():
+            return
+        thread = threading.Thread(target=_drain_overflow, name="log-spool-overflow", daemon=True)
+        _overflow_state["thread"] = thread
+    thread.start()
+
+def _flush_overflow():
+    batch = []
+    while _overflow:
+        try:
+            batch.append(_overflow.popleft())
+        except IndexError:
+            break
+    if batch:
+        _spool_batch(batch)
+    return len(batch)
+
+def _drain_overflow():
+    while True:
+        _overflow_ready.wait()
+        _overflow_ready.clear()
+        try:
+            _flush_overflow()
+        except Exception as e:
+            with _lock:
+                _overflow_state["errors"] += 1
+                _overflow_state["last_error"] = repr(e)
+
+def _close_overflow():
+    # atexit идёт в обратном порядке: сегмент спула уже закрыт, остаток буфера — в новый
+    if _flush_overflow():
+        get_spool().close()
+
+atexit.register(_close_overflow)
+
+def write_logs(batch):
+    """
+    write_batch очереди журнала: MongoDB в пределах бюджета, иначе — спул на диске.
+    Ошибка MongoDB наружу не выходит, запись не теряется
+    """
+    for doc in batch:
+        doc.setdefault("log_id", new_log_id())
+    breaker = get_breaker()
+    if breaker.allow():
+        try:
+            _insert(batch)
+        except bson.errors.BSONError:
+            # details, которые не кодируются в BSON: MongoDB здорова, пачку сохраняем в спул,
+            # где такие details становятся строкой
+            pass
+        except errors.PyMongoError:
+            breaker.record_failure()
+        else:
+            if breaker.record_success() or not _replay_state["started"] or _replay_state["pending"]:
+                start_replay()
+            return
+    _spool_batch(batch)
+
+
+# ===== Перенос спула в MongoDB =====
+def _replay_segment(path, batch_size):
+    docs, corrupt = read_segment(path)
+    upserted = 0
+    logs = get_mongo_db()[LOGS]
+    for start in range(0, len(docs), batch_size):
+        chunk = docs[start:start + batch_size]
+        requests = [UpdateOne({"log_id": doc["log_id"]},
+                              {"$setOnInsert": {k: v for k, v in doc.items() if k != "log_id"}}, upsert=True)
+                    for doc in chunk if doc.get("log_id")]
+        plain = [doc for doc in chunk if not doc.get("log_id")]
+        if requests:
+            upserted += logs.bulk_write(requests, ordered=False).upserted_count
+        if plain:
+            upserted += len(logs.insert_many(plain, ordered=False).inserted_ids)
+    return len(docs), upserted, corrupt
+
+def replay(max_segments=None, batch_size=REPLAY_BATCH):
+    """
+    Перенести закрытые сегменты спула в logs, начиная со старых; сегмент удаляется после
+    записи. При ошибке MongoDB останавливается — оставшееся заберёт следующий запуск
+    """
+    report = {"segments": 0, "entries": 0, "inserted": 0, "corrupt": 0}
+    if not _replay_lock.acquire(blocking=False):
+        report["skipped"] = True
+        return report
+    try:
+        spool = get_spool()
+        spool.rotate()
+        for path in spool.segments()[:max_segments]:
+            try:
+                entries, inserted, corrupt = _replay_segment(path, batch_size)
+            except FileNotFoundError:
+                continue  # сегмент уже перенёс другой процесс
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            report["segments"] += 1
+            report["entries"] += entries
+            report["inserted"] += inserted
+            report["corrupt"] += corrupt
+    finally:
+        _replay_lock.release()
+    with _lock:
+        _replay_state["runs"] += 1
+        _replay_state["replayed"] += report["entries"]
+    return report
+
+def _replay_in_background():
+    try:
+        replay()
+    except Exception as e:
+        with _lock:
+            # недонесённые сегменты заберёт проход после следующей успешной пачки
+            _replay_state["pending"] = True
+            _replay_state["errors"] += 1
+            _replay_state["last_error"] = repr(e)
+
+def start_replay():
+    """Запустить replay в фоновом потоке, если он ещё не идёт"""
+    with _lock:
+        _replay_state["started"] = True
+        thread = _replay_state["thread"]
+        if thread is not None and thread.is_alive():
+            return thread
+        # новый проход закроет текущий сегмент: в него попадёт всё, что уже в спуле
+        _replay_state["pending"] = False
+        thread = threading.Thread(target=_replay_in_background, name="log-spool-replay", daemon=True)
+        _replay_state["thread"] = thread
+    thread.start()
+    return thread
+
+def spool_stats():
+    with _lock:
+        replay_stats = {k: v for k, v in _replay_state.items() if k not in ("started", "thread")}
+        overflow = {"buffered": len(_overflow), "errors": _overflow_state["errors"],
+                    "last_error": _overflow_state["last_error"]}
+    return {"breaker": get_breaker().snapshot(), "spool": get_spool().stats(), "replay": replay_stats,
+            "overflow": overflow}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.log_spool", description="Спул журнала действий")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("status", help="состояние спула")
+    cmd = sub.add_parser("replay", help="перенести спул в MongoDB")
+    cmd.add_argument("--max-segments", type=int)
+    args = parser.parse_args()
+
+    if args.command == "status":
+        print(json.dumps(get_spool().stats(), ensure_ascii=False, indent=2))
+    else:
+        try:
+            result = replay(args.max_segments)
+        except errors.PyMongoError as e:
+            raise SystemExit(f"❌ MongoDB недоступна, спул сохранён: {e}")
+        print(json.dumps(result, ensure_ascii=False, indent=2))
@@ -0,0 +1,230 @@
+import argparse
+import gzip
+import json
+import os
+import sys
+import uuid
+from datetime import datetime, timedelta
+
+from pymongo import DESCENDING, errors
+
+from app.db import get_mongo_db
+from app.settings import get_settings
+
+# Хранение журнала действий по возрасту:
+#   logs          — «горячие» записи последних log_hot_days дней, как их пишет log_action;
+#   logs_archive  — time-series коллекция (timeField=timestamp, metaField=meta): MongoDB сама
+#                   складывает записи в бакеты по многу штук, индексы и место на диске меньше;
+#                   через log_archive_days записи удаляет TTL;
+#   log_archive_dir/logs-YYYY-MM-DD.jsonl.gz — постоянная копия каждого архивированного дня.
+#
+# compact() переносит целые дни старше горячего окна: файл -> logs_archive -> удаление из logs.
+# Прогресс хранится в log_storage_state, поэтому команда инкрементальна и переживает падение.
+
+LOGS = "logs"
+ARCHIVE = "logs_archive"
+STATE = "log_storage_state"
+STATE_ID = "compaction"
+READ_CHUNK = 5000
+
+
+def _day(moment):
+    return datetime(moment.year, moment.month, moment.day)
+
+def ensure_archive_collection():
+    """Создать logs_archive как time-series коллекцию (обычная create_index её бы не создала)."""
+    db = get_mongo_db()
+    if ARCHIVE in db.list_collection_names(filter={"name": ARCHIVE}):
+        return False
+    try:
+        db.create_collection(
+            ARCHIVE,
+            timeseries={"timeField": "timestamp", "metaField": "meta", "granularity": "minutes"},
+            expireAfterSeconds=get_settings().log_archive_days * 86400,
+        )
+    except errors.CollectionInvalid:
+        return False
+    return True
+
+
+# ===== Запросы =====
+def _archive_query(user_id, action, since, until):
+    query = {}
+    if user_id is not None:
+        query["meta.user_id"] = user_id
+    if action is not None:
+        query["meta.action"] = action
+    timestamp = {}
+    if since is not None:
+        timestamp["$gte"] = since
+    if until is not None:
+        timestamp["$lt"] = until
+    if timestamp:
+        query["timestamp"] = timestamp
+    return query
+
+def _hot_query(user_id, action, since, until):
+    query = {}
+    if user_id is not None:
+        query["user_id"] = user_id
+    if action is not None:
+        query["action"] = action
+    timestamp = {}
+    if since is not None:
+        timestamp["$gte"] = since
+    if until is not None:
+        timestamp["$lt"] = until
+    if timestamp:
+        query["timestamp"] = timestamp
+    return query
+
+def _from_archive(doc):
+    meta = doc.get("meta") or {}
+    return {"user_id": meta.get("user_id"), "action": meta.get("action"),
+            "details": doc.get("details"), "timestamp": doc["timestamp"]}
+
+def compacted_until():
+    """Граница архивации: записи раньше неё лежат только в logs_archive."""
+    state = get_mongo_db()[STATE].find_one({"_id": STATE_ID}) or {}
+    return state.get("compacted_until")
+
+def get_logs(user_id=None, action=None, since=None, until=None, limit=100):
+    """
+    Записи журнала от новых к старым по обоим уровням хранения.
+    Архив читается, только если диапазон заходит за границу архивации
+    """
+    db = get_mongo_db()
+    projection = {"_id": 0}
+    result = list(db[LOGS].find(_hot_query(user_id, action, since, until), projection)
+                  .sort("timestamp", DESCENDING).limit(limit))
+    boundary = compacted_until()
+    if boundary is not None and len(result) < limit and (since is None or since < boundary):
+        archive_until = boundary if until is None else min(until, boundary)
+        archived = (db[ARCHIVE].find(_archive_query(user_id, action, since, archive_until), projection)
+                    .sort("timestamp", DESCENDING).limit(limit - len(result)))
+        result.extend(_from_archive(doc) for doc in archived)
+        # в logs могут остаться записи старше границы, пришедшие задним числом
+        result.sort(key=lambda entry: entry["timestamp"], reverse=True)
+    return result
+
+def count_logs(user_id=None, action=None, since=None, until=None):
+    db = get_mongo_db()
+    return (db[LOGS].count_documents(_hot_query(user_id, action, since, until))
+            + db[ARCHIVE].count_documents(_archive_query(user_id, action, since, until)))
+
+
+# ===== Архивация =====
+def _archive_path(archive_dir, day):
+    """Файл дня; если день уже выгружался (записи пришли задним числом), — следующая часть."""
+    base = os.path.join(archive_dir, f"logs-{day:%Y-%m-%d}")
+    path, part = f"{base}.jsonl.gz", 1
+    while os.path.exists(path):
+        path, part = f"{base}.{part + 1}.jsonl.gz", part + 1
+    return path
+
+def _archive_doc(doc, run_id):
+    # run_id — метка запуска compact: повтор после сбоя удаляет только свои записи
+    return {"timestamp": doc["timestamp"],
+            "meta": {"user_id": doc.get("user_id"), "action": doc.get("action"), "run_id": run_id},
+            "details": doc.get("details")}
+
+def _chunks(cursor, size):
+    chunk = []
+    for doc in cursor:
+        chunk.append(doc)
+        if len(chunk) == size:
+            yield chunk
+            chunk = []
+    if chunk:
+        yield chunk
+
+def _compact_day(db, day, archive_dir, dry_run):
+    next_day = day + timedelta(days=1)
+    day_range = {"timestamp": {"$gte": day, "$lt": next_day}}
+    if dry_run:
+        return {"day": f"{day:%Y-%m-%d}", "entries": db[LOGS].count_documents(day_range)}
+    if db[LOGS].find_one(day_range, {"_id": 1}) is None:
+        return {"day": f"{day:%Y-%m-%d}", "entries": 0}
+
+    state = db[STATE].find_one({"_id": STATE_ID}) or {}
+    retry = state.get("in_progress") == day
+    if retry and state.get("in_progress_run"):
+        # прошлый запуск упал посреди дня: убираем то, что успел перенести он, и повторяем.
+        # Части дня из более ранних запусков (записи задним числом) остаются: их в logs уже нет
+        db[ARCHIVE].delete_many({"meta.run_id": state["in_progress_run"]})
+    # повтор пишет в файл упавшего запуска, а не поверх уже готовой части дня
+    path = (retry and state.get("in_progress_file")) or _archive_path(archive_dir, day)
+    run_id = uuid.uuid4().hex
+    db[STATE].update_one({"_id": STATE_ID},
+                         {"$set": {"in_progress": day, "in_progress_run": run_id, "in_progress_file": path}},
+                         upsert=True)
+
+    # день читается кусками по READ_CHUNK: в файл (атомарно, через .tmp и rename) и в logs_archive
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    tmp = f"{path}.tmp"
+    entries = 0
+    cursor = db[LOGS].find(day_range, {"_id": 0}).sort("timestamp", 1).batch_size(READ_CHUNK)
+    with gzip.open(tmp, "wt", encoding="utf-8") as f:
+        for chunk in _chunks(cursor, READ_CHUNK):
+            for doc in chunk:
+                f.write(json.dumps(doc, ensure_ascii=False, default=str))
+                f.write("\n")
+            db[ARCHIVE].insert_many([_archive_doc(d, run_id) for d in chunk], ordered=False)
+            entries += len(chunk)
+    os.replace(tmp, path)
+    # Сначала продвигаем границу, потом удаляем: get_logs не потеряет записи дня ни на миг
+    db[STATE].update_one({"_id": STATE_ID},
+                         {"$max": {"compacted_until": next_day},
+                          "$set": {"in_progress": None, "in_progress_run": None, "in_progress_file": None,
+                                   "updated_at": datetime.utcnow()}})
+    deleted = db[LOGS].delete_many(day_range).deleted_count
+    return {"day": f"{day:%Y-%m-%d}", "entries": entries, "deleted": deleted, "file": path}
+
+def compact(max_days=None, dry_run=False, now=None):
+    """
+    Перенести в архив целые дни старше log_hot_days, начиная с самого старого
+    неархивированного. max_days ограничивает работу одного запуска
+    """
+    s = get_settings()
+    db = get_mongo_db()
+    ensure_archive_collection()
+    horizon = _day(now or datetime.utcnow()) - timedelta(days=s.log_hot_days)
+    oldest = db[LOGS].find_one({"timestamp": {"$lt": horizon}}, sort=[("timestamp", 1)])
+    if oldest is None:
+        return []
+    # с самого раннего дня, где остались записи: в т.ч. пришедшие задним числом
+    day = _day(oldest["timestamp"])
+    done = []
+    while day < horizon and (max_days is None or len(done) < max_days):
+        report = _compact_day(db, day, s.log_archive_dir, dry_run)
+        if report["entries"]:
+            done.append(report)
+            print(f"{report['day']}: {report['entries']}", file=sys.stderr)
+        day += timedelta(days=1)
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Архивация и поиск по журналу действий")
+    sub = parser.add_subparsers(dest="command", required=True)
+    sub.add_parser("init", help="создать logs_archive и индексы")
+    cmd = sub.add_parser("compact", help="перенести дни старше горячего окна в архив")
+    cmd.add_argument("--max-days", type=int, help="не больше стольких дней за запуск")
+    cmd.add_argument("--dry-run", action="store_true")
+    cmd = sub.add_parser("query", help="вывести записи журнала (JSON Lines)")
+    cmd.add_argument("--user-id", type=int)
+    cmd.add_argument("--action")
+    cmd.add_argument("--since", type=datetime.fromisoformat)
+    cmd.add_argument("--until", type=datetime.fromisoformat)
+    cmd.add_argument("--limit", type=int, default=100)
+    args = parser.parse_args()
+
+    if args.command == "init":
+        from app.crud_mongo import ensure_indexes
+        ensure_indexes()
+        print("logs_archive готова")
+    elif args.command == "compact":
+        print(json.dumps(compact(args.max_days, args.dry_run), ensure_ascii=False, indent=2))
+    else:
+        for entry in get_logs(args.user_id, args.action, args.since, args.until, args.limit):
+            print(json.dumps(entry, ensure_ascii=False, default=str))
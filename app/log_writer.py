@@ -0,0 +1,179 @@
+import atexit
+import queue
+import random
+import threading
+import time
+from collections import deque
+
+# ===== Политики переполнения очереди =====
+OVERFLOW_BLOCK = "block"              # ждать, пока воркер освободит место
+OVERFLOW_DROP_OLDEST = "drop_oldest"  # вытеснять самые старые записи
+OVERFLOW_SAMPLE = "sample"            # при переполнении пропускать лишь долю записей
+
+OVERFLOW_POLICIES = (OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SAMPLE)
+
+
+class BatchWriter:
+    """
+    Фоновая запись документов пачками: ограниченная очередь в памяти,
+    которую поток-воркер сбрасывает в write_batch по размеру или по времени.
+    """
+
+    def __init__(self, write_batch, batch_size=100, flush_interval=0.5,
+                 max_queue=10000, overflow=OVERFLOW_BLOCK, sample_rate=0.1,
+                 name="batch-writer"):
+        if overflow not in OVERFLOW_POLICIES:
+            raise ValueError(f"Неизвестная политика переполнения: {overflow}")
+        if batch_size < 1 or max_queue < 1:
+            raise ValueError("batch_size и max_queue должны быть положительными")
+        self.write_batch = write_batch
+        self.batch_size = batch_size
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.sample_rate = sample_rate
+        self.name = name
+
+        self._queue = deque()
+        self._cond = threading.Condition()
+        self._thread = None
+        self._closed = False
+        self._in_flight = 0
+        self._flush_waiters = 0   # потоки в flush(): пока они есть, воркер не ждёт полной пачки
+        self._stats = {
+            "enqueued": 0,
+            "flushed": 0,
+            "dropped": 0,
+            "failed": 0,
+            "batches": 0,
+            "batch_latency_total": 0.0,
+            "batch_latency_max": 0.0,
+            "batch_latency_last": 0.0,
+        }
+
+    # ===== Публичный API =====
+    def enqueue(self, doc, block=True):
+        """
+        Поставить документ в очередь. block=False — не ждать места при политике block
+        (event loop): при полной очереди поднимается queue.Full, документ не ставится
+        """
+        with self._cond:
+            if self._closed:
+                raise RuntimeError(f"{self.name}: запись после close()")
+            self._ensure_started()
+            if len(self._queue) >= self.max_queue and not self._make_room(block):
+                self._stats["dropped"] += 1
+                return False
+            self._queue.append(doc)
+            self._stats["enqueued"] += 1
+            if len(self._queue) >= self.batch_size:
+                self._cond.notify_all()
+        return True
+
+    def flush(self, timeout=None):
+        """
+        Дождаться, пока всё поставленное в очередь будет записано.
+        Возвращает False, если не уложились в timeout.
+        """
+        deadline = None if timeout is None else time.monotonic() + timeout
+        with self._cond:
+            if self._thread is None:
+                return True
+            self._flush_waiters += 1
+            self._cond.notify_all()
+            try:
+                while self._queue or self._in_flight:
+                    remaining = None if deadline is None else deadline - time.monotonic()
+                    if remaining is not None and remaining <= 0:
+                        return False
+                    self._cond.wait(remaining)
+            finally:
+                self._flush_waiters -= 1
+        return True
+
+    def close(self, timeout=None):
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+            thread = self._thread
+        if thread is not None:
+            thread.join(timeout)
+
+    def stats(self):
+        with self._cond:
+            data = dict(self._stats)
+            data["queued"] = len(self._queue)
+        batches = data["batches"]
+        data["batch_latency_avg"] = data["batch_latency_total"] / batches if batches else 0.0
+        return data
+
+    # ===== Внутреннее =====
+    def _ensure_started(self):
+        if self._thread is None:
+            self._thread = threading.Thread(target=self._run, name=self.name, daemon=True)
+            self._thread.start()
+
+    def _make_room(self, block=True):
+        # Вызывается под self._cond, когда очередь заполнена
+        if self.overflow == OVERFLOW_BLOCK:
+            if not block:
+                raise queue.Full
+            while len(self._queue) >= self.max_queue and not self._closed:
+                self._cond.notify_all()
+                self._cond.wait()
+            return not self._closed
+        if self.overflow == OVERFLOW_SAMPLE and random.random() >= self.sample_rate:
+            return False
+        self._queue.popleft()
+        self._stats["dropped"] += 1
+        return True
+
+    def _take_batch(self):
+        batch = []
+        while self._queue and len(batch) < self.batch_size:
+            batch.append(self._queue.popleft())
+        return batch
+
+    def _run(self):
+        while True:
+            with self._cond:
+                deadline = time.monotonic() + self.flush_interval
+                while (len(self._queue) < self.batch_size and not self._closed
+                       and not self._flush_waiters):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        break
+                    self._cond.wait(remaining)
+                batch = self._take_batch()
+                if not batch:
+                    self._cond.notify_all()
+                    if self._closed:
+                        return
+                    continue
+                self._in_flight = len(batch)
+                # Освободилось место — будим заблокированных продюсеров
+                self._cond.notify_all()
+
+            started = time.perf_counter()
+            ok = True
+            try:
+                self.write_batch(batch)
+            except Exception:
+                ok = False
+            elapsed = time.perf_counter() - started
+
+            with self._cond:
+                self._in_flight = 0
+                self._stats["batches"] += 1
+                self._stats["batch_latency_total"] += elapsed
+                self._stats["batch_latency_last"] = elapsed
+                self._stats["batch_latency_max"] = max(self._stats["batch_latency_max"], elapsed)
+                self._stats["flushed" if ok else "failed"] += len(batch)
+                self._cond.notify_all()
+
+
+def register_shutdown(writer, timeout=5.0):
+    """Сбросить и остановить writer при завершении процесса."""
+    atexit.register(writer.close, timeout)
@@ -1,5 +1,6 @@
 from crud_postgres import *  # PostgreSQL функции для заказов, меню, сотрудников и т.д.
 from crud_mongo import *     # MongoDB функции для отзывов и логов
+from migrations import startup_check  # отчёт о недостающих индексах
 
 # ====== Действия клиента ======
 def customer_actions():
@@ -31,15 +32,10 @@ def customer_actions():
         print(f"- {branch['name']} ({branch['city']}) — {branch['address']}")
 
     print("\n🛒 Создание заказа...")
-    order_id = create_order(customer_id=1, branch_id=1, employee_id=1, total_amount=0)
-
-    # Добавление позиций в заказ
-    add_order_item(order_id=order_id, item_id=1, quantity=2)
-    add_order_item(order_id=order_id, item_id=2, quantity=1)
-    update_order_total(order_id)
-
-    # Получаем и выводим заказ с его позициями
-    print("✅ Заказ создан:", get_order(order_id))
+    # Заказ вместе с позициями и итогом — одной транзакцией
+    order = create_order_with_items(customer_id=1, branch_id=1, employee_id=1,
+                                    items=[(1, 2), (2, 1)])
+    print("✅ Заказ создан:", order)
 
     # Просмотр заказов клиента
     print("\n📦 Мои заказы:")
@@ -65,11 +61,12 @@ def employee_actions():
     update_order_status(order_id=7, status="completed")
     print("📦 Заказ обновлён:", get_order(7))
 
-    # Создание заявки на поставку
+    # Создание заявки на поставку: заявка и позиции — одна транзакция на одном соединении
     print("\n📦 Создание заявки на поставку...")
-    supply_id = create_supply_order(supplier_id=1, branch_id=1)
-    add_item_to_supply(supply_order_id=supply_id, item_id=1, quantity=10)
-    add_item_to_supply(supply_order_id=supply_id, item_id=2, quantity=5)
+    with unit_of_work():
+        supply_id = create_supply_order(supplier_id=1, branch_id=1)
+        add_item_to_supply(supply_order_id=supply_id, item_id=1, quantity=10)
+        add_item_to_supply(supply_order_id=supply_id, item_id=2, quantity=5)
     print("Заявка создана:", get_supply_order(supply_id))
 
     # Просмотр текущих поставок
@@ -116,13 +113,17 @@ def admin_actions():
     ######################################################################
 
 def print_all_relationships():
+    # Каждая связь загружается одним пакетным запросом, независимо от размера каталога
+
     # ===================================================
     # 1️⃣ Категории ↔ Пункты меню
     # ===================================================
     print("\n=== Категории ↔ Пункты меню ===")
-    for cat in get_menu_categories():
+    categories = get_menu_categories()
+    items_by_category = get_items_by_categories([c['category_id'] for c in categories])
+    for cat in categories:
         print(f"\nКатегория: {cat['name']} ({cat.get('description','')})")
-        items = get_items_by_category(cat['category_id'])
+        items = items_by_category[cat['category_id']]
         if items:
             for item in items:
                 print(f" - {item['name']} ({item['price']}₽): {item.get('description','')}")
@@ -133,9 +134,11 @@ def print_all_relationships():
     # 2️⃣ Поставщики ↔ Товары
     # ===================================================
     print("\n=== Поставщики ↔ Товары ===")
-    for sup in get_suppliers():
+    suppliers = get_suppliers()
+    items_by_supplier = get_items_by_suppliers([s['supplier_id'] for s in suppliers])
+    for sup in suppliers:
         print(f"\nПоставщик: {sup['name']} (тел: {sup.get('phone','')}, email: {sup.get('email','')})")
-        items = get_items_by_supplier(sup['supplier_id'])
+        items = items_by_supplier[sup['supplier_id']]
         if items:
             for item in items:
                 print(f" - {item['name']} ({item['price']}₽), цена поставки: {item['supply_price']}₽")
@@ -146,9 +149,11 @@ def print_all_relationships():
     # 3️⃣ Сотрудники ↔ Филиалы
     # ===================================================
     print("\n=== Сотрудники ↔ Филиалы ===")
-    for emp in get_employees():
+    employees = get_employees()
+    branches_by_employee = get_branches_by_employees([e['employee_id'] for e in employees])
+    for emp in employees:
         print(f"\nСотрудник: {emp['name']} ({emp['position']}), email: {emp.get('email','')}")
-        branches = get_branches_by_employee(emp['employee_id'])
+        branches = branches_by_employee[emp['employee_id']]
         if branches:
             for b in branches:
                 print(f" - Филиал: {b['name']} ({b['city']}), адрес: {b['address']}")
@@ -159,9 +164,11 @@ def print_all_relationships():
     # 4️⃣ Пункты меню ↔ Поставщики
     # ===================================================
     print("\n=== Пункты меню ↔ Поставщики ===")
-    for item in get_menu_items():
+    menu_items = get_menu_items()
+    suppliers_by_item = get_suppliers_by_items([i['item_id'] for i in menu_items])
+    for item in menu_items:
         print(f"\nПункт меню: {item['name']} ({item['price']}₽)")
-        suppliers = get_suppliers_by_item(item['item_id'])
+        suppliers = suppliers_by_item[item['item_id']]
         if suppliers:
             for s in suppliers:
                 print(f" - Поставщик: {s['name']} (тел: {s.get('phone','')}, email: {s.get('email','')})")
@@ -169,6 +176,7 @@ def print_all_relationships():
             print(" - Поставщики отсутствуют")
 # ====== Точка входа ======
 if __name__ == "__main__":
+    startup_check()
     customer_actions()
     employee_actions()
     admin_actions()
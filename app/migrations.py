@@ -0,0 +1,119 @@
+import argparse
+import json
+from pathlib import Path
+
+from sqlalchemy import text
+
+from app.crud_mongo import MONGO_INDEXES, ensure_indexes
+from app.db import begin, connect, get_mongo_db
+
+# Версионные миграции схемы: postgres/migrations/NNN_name.sql, применяются по порядку,
+# применённые версии записываются в schema_migrations. Контейнер postgres выполняет их при
+# инициализации сам и отмечает в postgres/schema_migrations.sql — новую миграцию дописать и туда
+MIGRATIONS_DIR = Path(__file__).resolve().parent.parent / "postgres" / "migrations"
+
+# Индексы, без которых частые запросы уходят в полный скан таблицы
+EXPECTED_PG_INDEXES = [
+    "inventory_branch_item_key",
+    "idx_order_customer_time",
+    "idx_order_branch_time",
+    "idx_orderitem_order",
+    "idx_orderitem_item",
+    "idx_payment_order",
+    "idx_supplyorderitem_supply_order",
+    "idx_employeebranch_branch",
+    "idx_suppliermenuitem_item",
+    "idx_menucategoryitem_item",
+    "idx_inventorymenuitem_item",
+    "idx_order_active",
+    "idx_customer_email_lower",
+    "idx_customer_name_prefix",
+    "idx_order_updated_at",
+    "idx_orderitem_updated_at",
+    "idx_payment_updated_at",
+]
+
+
+def _migration_files():
+    return sorted(MIGRATIONS_DIR.glob("[0-9][0-9][0-9]_*.sql"))
+
+def applied_migrations():
+    with begin() as conn:
+        conn.execute(text("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version VARCHAR(100) PRIMARY KEY,
+                applied_at TIMESTAMP DEFAULT NOW()
+            )
+        """))
+        return set(conn.execute(text("SELECT version FROM schema_migrations")).scalars())
+
+def apply_migrations(target=None, mongo=True):
+    """
+    Применить недостающие миграции (до target включительно); каждая — в своей транзакции.
+    mongo=False — не трогать индексы MongoDB
+    """
+    done = applied_migrations()
+    applied = []
+    for path in _migration_files():
+        version = path.stem
+        if target is not None and version > target:
+            break
+        if version in done:
+            continue
+        with begin() as conn:
+            # скрипт целиком через курсор драйвера: в нём несколько команд и plpgsql-блоки
+            conn.connection.dbapi_connection.cursor().execute(path.read_text(encoding="utf-8"))
+            conn.execute(text("INSERT INTO schema_migrations (version) VALUES (:v)"), {"v": version})
+        applied.append(version)
+    if mongo:
+        ensure_indexes()
+    return applied
+
+def check_indexes():
+    """
+    Отчёт о недостающих индексах в Postgres и MongoDB
+    """
+    with connect() as conn:
+        existing = set(conn.execute(text("""
+            SELECT indexname FROM pg_indexes WHERE schemaname = current_schema()
+        """)).scalars())
+    missing_pg = [name for name in EXPECTED_PG_INDEXES if name not in existing]
+
+    db = get_mongo_db()
+    missing_mongo = []
+    for collection, indexes in MONGO_INDEXES.items():
+        info = db[collection].index_information()
+        present = {tuple(index["key"]) for index in info.values()} | set(info)
+        for keys, options in indexes:
+            # текстовый индекс хранится под служебными ключами — сверяем его по имени
+            if options.get("name", tuple(keys)) not in present:
+                missing_mongo.append(f"{collection}: {keys}")
+    return {"postgres": missing_pg, "mongo": missing_mongo}
+
+def startup_check():
+    """Проверка при старте: печатает недостающие индексы, возвращает True, если всё на месте."""
+    try:
+        missing = check_indexes()
+    except Exception as e:
+        print(f"⚠️ Проверка индексов не выполнена: {e}")
+        return False
+    for store, names in missing.items():
+        for name in names:
+            print(f"⚠️ [{store}] нет индекса {name} — выполните python -m app.migrations apply")
+    return not any(missing.values())
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Миграции схемы и проверка индексов")
+    parser.add_argument("command", choices=["apply", "status", "check"])
+    parser.add_argument("--target", help="применить миграции до этой версии включительно")
+    parser.add_argument("--skip-mongo", action="store_true", help="не создавать индексы MongoDB")
+    args = parser.parse_args()
+    if args.command == "apply":
+        print("Применены:", apply_migrations(args.target, mongo=not args.skip_mongo) or "ничего нового")
+    elif args.command == "status":
+        done = applied_migrations()
+        for path in _migration_files():
+            print(f"[{'x' if path.stem in done else ' '}] {path.stem}")
+    else:
+        print(json.dumps(check_indexes(), ensure_ascii=False, indent=2))
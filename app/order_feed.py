@@ -0,0 +1,279 @@
+import asyncio
+import json
+import queue
+import threading
+from datetime import datetime
+from decimal import Decimal
+
+from pymongo import UpdateOne
+from sqlalchemy import text
+
+from app.db import connect, get_async_engine, get_engine, get_mongo_db
+from app.log_writer import OVERFLOW_BLOCK, BatchWriter, register_shutdown
+from app.pubsub import LocalBroker, PostgresBroker
+from app.settings import get_settings
+
+# Живая лента заказов для экранов кухни и баристы вместо опроса get_orders():
+#   for event in subscribe_orders(branch_id=1): ...
+#   async for event in asubscribe_orders(branch_id=1): ...
+#
+# Сначала приходит снимок активных заказов филиала (type="snapshot"), затем изменения:
+# created / status / deleted. Изменения рассылает crud_postgres после фиксации транзакции
+# через брокер (LISTEN/NOTIFY между процессами или LocalBroker в одном процессе).
+# Подписка оформляется до чтения снимка, поэтому изменения не теряются, но событие
+# о заказе из снимка может прийти повторно — события несут полное состояние, их можно
+# применять повторно.
+# Если брокер переподключался, события за это время потеряны: приходит {"type": "resync"}
+# и следом новый снимок (при snapshot=True). heartbeat несёт connected — жив ли брокер.
+#
+# Смены статусов дописываются в MongoDB order_history: документ на заказ (бакет),
+# переходы копятся в status_changes. Пишет фоновая очередь, пачками.
+
+CHANNEL = "order_events"
+HISTORY = "order_history"
+
+EVENT_SNAPSHOT = "snapshot"
+EVENT_CREATED = "created"
+EVENT_STATUS = "status"
+EVENT_DELETED = "deleted"
+EVENT_RESYNC = "resync"
+
+# Заказы в этих статусах в ленту больше не попадают (индекс idx_order_active)
+FINAL_STATUSES = ("completed", "cancelled")
+
+# NOTIFY принимает до 8000 байт: события уходят пачками меньше этого
+MAX_PAYLOAD_BYTES = 7000
+
+_broker = None
+_history_writer = None
+_lock = threading.Lock()
+_stats = {"published": 0, "publish_errors": 0}
+
+
+# ===== Брокер =====
+def get_broker():
+    global _broker
+    if _broker is None:
+        with _lock:
+            if _broker is None:
+                mode = get_settings().order_feed_broker
+                if mode == "postgres":
+                    _broker = PostgresBroker(get_engine())
+                elif mode == "local":
+                    _broker = LocalBroker()
+                else:
+                    raise ValueError(f"Неизвестный брокер ленты заказов: {mode}")
+    return _broker
+
+def set_broker(broker):
+    """Подменить брокер (например, LocalBroker в тестах); старый закрывается."""
+    global _broker
+    with _lock:
+        old, _broker = _broker, broker
+    if old is not None and old is not broker:
+        old.close()
+
+def get_feed_stats():
+    with _lock:
+        data = dict(_stats)
+    data["history"] = get_history_writer().stats()
+    return data
+
+
+# ===== События =====
+def order_event(event_type, order, previous_status=None):
+    """Событие по строке заказа; значения приводятся к JSON-совместимым"""
+    total = order.get("total_amount")
+    order_time = order.get("order_time")
+    return {
+        "type": event_type,
+        "order_id": order["order_id"],
+        "branch_id": order.get("branch_id"),
+        "customer_id": order.get("customer_id"),
+        "employee_id": order.get("employee_id"),
+        "status": order.get("status"),
+        "previous_status": previous_status,
+        "total_amount": float(total) if isinstance(total, Decimal) else total,
+        "order_time": order_time.isoformat() if isinstance(order_time, datetime) else order_time,
+        "at": datetime.utcnow().isoformat(),
+    }
+
+def _payloads(events):
+    batch, size = [], 0
+    for event in events:
+        event_size = len(json.dumps(event, default=str))
+        if batch and size + event_size > MAX_PAYLOAD_BYTES:
+            yield {"events": batch}
+            batch, size = [], 0
+        batch.append(event)
+        size += event_size
+    if batch:
+        yield {"events": batch}
+
+def publish_order_events(events):
+    """
+    Разослать события подписчикам и дописать переходы в order_history.
+    Вызывается после фиксации транзакции; ошибка рассылки не ломает саму запись
+    """
+    events = list(events)
+    if not events:
+        return
+    writer = get_history_writer()
+    for event in events:
+        writer.enqueue(event)
+    try:
+        broker = get_broker()
+        for payload in _payloads(events):
+            broker.publish(CHANNEL, payload)
+    except Exception:
+        with _lock:
+            _stats["publish_errors"] += len(events)
+        return
+    with _lock:
+        _stats["published"] += len(events)
+
+async def apublish_order_events(events):
+    # NOTIFY идёт через синхронный движок — в отдельном потоке, чтобы не держать event loop
+    await asyncio.to_thread(publish_order_events, events)
+
+
+# ===== Подписка =====
+def _matches(event, branch_id):
+    return branch_id is None or event.get("branch_id") == branch_id
+
+def _snapshot_query(branch_id):
+    query = ('SELECT * FROM "Order" WHERE status NOT IN '
+             f"({', '.join(repr(s) for s in FINAL_STATUSES)})")
+    if branch_id is not None:
+        query += " AND branch_id = :branch_id"
+    return query + " ORDER BY order_id"
+
+def active_orders(branch_id=None):
+    """Незавершённые заказы филиала (или всех филиалов) — снимок для ленты"""
+    with connect() as conn:
+        result = conn.execute(text(_snapshot_query(branch_id)), {"branch_id": branch_id})
+        return [dict(r._mapping) for r in result]
+
+async def aactive_orders(branch_id=None):
+    async with get_async_engine().connect() as conn:
+        result = await conn.execute(text(_snapshot_query(branch_id)), {"branch_id": branch_id})
+        return [dict(r._mapping) for r in result]
+
+def _heartbeat(broker):
+    return {"type": "heartbeat", "connected": broker.connected, "at": datetime.utcnow().isoformat()}
+
+def _resync_event():
+    return {"type": EVENT_RESYNC, "at": datetime.utcnow().isoformat()}
+
+def subscribe_orders(branch_id=None, snapshot=True, heartbeat=None):
+    """
+    Генератор событий ленты. heartbeat — раз в столько секунд тишины отдаётся
+    {"type": "heartbeat", "connected": ...}, чтобы потребитель мог проверить, не пора ли
+    остановиться. Подписка снимается при закрытии генератора (close() или выход из цикла for)
+    """
+    events = queue.Queue()
+
+    def on_message(payload):
+        for event in payload.get("events", ()):
+            if _matches(event, branch_id):
+                events.put(event)
+
+    broker = get_broker()
+    unsubscribe = broker.subscribe(CHANNEL, on_message, on_resync=lambda: events.put(_resync_event()))
+    try:
+        if snapshot:
+            for order in active_orders(branch_id):
+                yield order_event(EVENT_SNAPSHOT, order)
+        while True:
+            try:
+                event = events.get(timeout=heartbeat)
+            except queue.Empty:
+                yield _heartbeat(broker)
+                continue
+            yield event
+            if event["type"] == EVENT_RESYNC and snapshot:
+                for order in active_orders(branch_id):
+                    yield order_event(EVENT_SNAPSHOT, order)
+    finally:
+        unsubscribe()
+
+async def asubscribe_orders(branch_id=None, snapshot=True, heartbeat=None):
+    """Асинхронный двойник subscribe_orders: async for event in asubscribe_orders(...)"""
+    loop = asyncio.get_running_loop()
+    events = asyncio.Queue()
+
+    def on_message(payload):
+        # вызывается из потока брокера
+        for event in payload.get("events", ()):
+            if _matches(event, branch_id):
+                loop.call_soon_threadsafe(events.put_nowait, event)
+
+    def on_resync():
+        loop.call_soon_threadsafe(events.put_nowait, _resync_event())
+
+    broker = get_broker()
+    unsubscribe = broker.subscribe(CHANNEL, on_message, on_resync=on_resync)
+    try:
+        if snapshot:
+            for order in await aactive_orders(branch_id):
+                yield order_event(EVENT_SNAPSHOT, order)
+        while True:
+            try:
+                event = await asyncio.wait_for(events.get(), heartbeat)
+            except asyncio.TimeoutError:
+                yield _heartbeat(broker)
+                continue
+            yield event
+            if event["type"] == EVENT_RESYNC and snapshot:
+                for order in await aactive_orders(branch_id):
+                    yield order_event(EVENT_SNAPSHOT, order)
+    finally:
+        unsubscribe()
+
+
+# ===== История статусов (MongoDB) =====
+def _write_history(batch):
+    # Переходы пачки складываются по заказам: один upsert с $push $each на бакет заказа
+    changes = {}
+    for event in batch:
+        bucket = changes.setdefault(event["order_id"], {"branch_id": event.get("branch_id"), "items": []})
+        if event["type"] == EVENT_DELETED:
+            status, previous = EVENT_DELETED, event["status"]
+        else:
+            status, previous = event["status"], event.get("previous_status")
+        bucket["items"].append({"status": status, "previous_status": previous,
+                                "timestamp": datetime.fromisoformat(event["at"])})
+    now = datetime.utcnow()
+    get_mongo_db()[HISTORY].bulk_write([
+        UpdateOne({"order_id": order_id},
+                  {"$push": {"status_changes": {"$each": bucket["items"]}},
+                   "$set": {"branch_id": bucket["branch_id"], "updated_at": now}},
+                  upsert=True)
+        for order_id, bucket in changes.items()
+    ], ordered=False)
+
+def get_history_writer():
+    global _history_writer
+    if _history_writer is None:
+        with _lock:
+            if _history_writer is None:
+                s = get_settings()
+                _history_writer = BatchWriter(
+                    _write_history,
+                    batch_size=s.log_batch_size,
+                    flush_interval=s.log_flush_interval,
+                    max_queue=s.log_queue_size,
+                    # история заказов не прореживается: при переполнении ждём
+                    overflow=OVERFLOW_BLOCK,
+                    name="order-history-writer",
+                )
+                register_shutdown(_history_writer)
+    return _history_writer
+
+def flush_history(timeout=None):
+    return get_history_writer().flush(timeout)
+
+def get_order_history(order_id):
+    """Переходы статусов заказа от старых к новым"""
+    doc = get_mongo_db()[HISTORY].find_one({"order_id": order_id}, {"_id": 0})
+    return doc["status_changes"] if doc else []
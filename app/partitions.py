@@ -0,0 +1,209 @@
+import argparse
+import asyncio
+import gzip
+import json
+import logging
+import os
+import re
+import sys
+import threading
+import time
+from datetime import date, datetime
+
+from sqlalchemy import text
+
+from app.crud_mongo import flush_logs, log_action
+from app.db import get_engine
+from app.settings import get_settings
+
+# Секции заказов по месяцам (postgres/migrations/005_order_partitions.sql):
+#   python -m app.partitions ensure                      # секции на order_partitions_ahead месяцев вперёд
+#   python -m app.partitions list
+#   python -m app.partitions archive --before 2025-01-01 [--dry-run]
+#
+# Каждый месяц — три секции: order_pYYYY_MM, orderitem_pYYYY_MM, payment_pYYYY_MM.
+# Создание заказа раз в час на процесс проверяет, что секции впереди есть
+# (maybe_ensure_order_partitions); заказ месяца без секции ложится в секции по умолчанию
+# (*_pdefault, 007_order_default_partitions.sql), и ensure переносит его в секцию месяца.
+# В list секции по умолчанию показаны как месяц "default" — там должно быть пусто.
+#
+# archive выгружает месяц в order_archive_dir/YYYY_MM/{order,orderitem,payment}.csv.gz
+# и отсоединяет/удаляет секции — без DELETE, VACUUM и раздувания индексов.
+# Агрегаты продаж (BranchDailySales и т.д.) архивированных месяцев остаются как были.
+
+logger = logging.getLogger(__name__)
+
+# порядок важен: секции позиций и платежей ссылаются на секцию заказов
+TABLES = ("payment", "orderitem", "order")
+PARENTS = {"order": '"Order"', "orderitem": "OrderItem", "payment": "Payment"}
+ENSURE_INTERVAL_S = 3600
+
+_PARTITION_RE = re.compile(r"^order_p(\d{4})_(\d{2})$")
+_last_ensure = 0.0
+_ensure_lock = threading.Lock()
+
+
+def _month_start(value):
+    return date(value.year, value.month, 1)
+
+def _add_months(month, n):
+    index = month.year * 12 + month.month - 1 + n
+    return date(index // 12, index % 12 + 1, 1)
+
+def partition_name(table, month):
+    return f"{table}_p{month:%Y_%m}"
+
+
+# ===== Создание секций =====
+def ensure_order_partitions(months_ahead=None, since=None):
+    """
+    Создать недостающие секции с месяца since (по умолчанию текущего) на months_ahead вперёд.
+    Выполняется отдельной транзакцией, вне unit_of_work: DDL не должен ждать чужого commit.
+    Возвращает имена созданных таблиц
+    """
+    if months_ahead is None:
+        months_ahead = get_settings().order_partitions_ahead
+    today = date.today()
+    start = _month_start(since or today)
+    end = _add_months(_month_start(today), months_ahead)
+    with get_engine().begin() as conn:
+        created = conn.execute(text("SELECT ensure_order_partitions(:start, :end)"),
+                               {"start": start, "end": end}).scalars().all()
+    if created:
+        log_action(0, "ensure_order_partitions", {"created": created})
+    return created
+
+def maybe_ensure_order_partitions():
+    """Проверка секций не чаще раза в ENSURE_INTERVAL_S на процесс; ошибка не мешает вставке."""
+    global _last_ensure
+    now = time.monotonic()
+    if _last_ensure and now - _last_ensure < ENSURE_INTERVAL_S:
+        return
+    with _ensure_lock:
+        if _last_ensure and now - _last_ensure < ENSURE_INTERVAL_S:
+            return
+        _last_ensure = now
+        try:
+            ensure_order_partitions()
+        except Exception:
+            # секций с запасом хватит до следующей попытки; без прав на DDL — это задача cron
+            logger.warning("Не удалось создать секции заказов", exc_info=True)
+
+async def amaybe_ensure_order_partitions():
+    if _last_ensure and time.monotonic() - _last_ensure < ENSURE_INTERVAL_S:
+        return
+    await asyncio.to_thread(maybe_ensure_order_partitions)
+
+
+# ===== Список секций =====
+def list_order_partitions():
+    """Месяцы с секциями заказов: месяц, строки (по статистике) и размер трёх таблиц"""
+    with get_engine().connect() as conn:
+        result = conn.execute(text("""
+            SELECT c.relname, c.reltuples::bigint AS rows,
+                   pg_total_relation_size(c.oid) AS bytes
+            FROM pg_inherits i
+            JOIN pg_class c ON c.oid = i.inhrelid
+            WHERE i.inhparent IN ('"Order"'::regclass, 'orderitem'::regclass, 'payment'::regclass)
+        """))
+        months = {}
+        for r in result:
+            table, _, suffix = r.relname.rpartition("_p")
+            month = months.setdefault(suffix, {"month": suffix.replace("_", "-"), "bytes": 0})
+            month[f"{table}_rows"] = max(r.rows, 0)
+            month["bytes"] += r.bytes
+    return [months[k] for k in sorted(months)]
+
+def _partition_months(conn):
+    names = conn.execute(text("""
+        SELECT c.relname FROM pg_inherits i JOIN pg_class c ON c.oid = i.inhrelid
+        WHERE i.inhparent = '"Order"'::regclass
+    """)).scalars()
+    months = []
+    for name in names:
+        m = _PARTITION_RE.match(name)
+        if m:
+            months.append(date(int(m.group(1)), int(m.group(2)), 1))
+    return sorted(months)
+
+
+# ===== Архивация =====
+def _export_partition(conn, table, path):
+    """COPY секции в gzip CSV атомарно (через .tmp и rename); возвращает число строк."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.tmp"
+    cursor = conn.connection.dbapi_connection.cursor()
+    with gzip.open(tmp, "wb") as f:
+        cursor.copy_expert(f"COPY {table} TO STDOUT WITH (FORMAT csv, HEADER)", f)
+        rows = cursor.rowcount
+    with open(tmp, "rb") as f:
+        os.fsync(f.fileno())
+    os.replace(tmp, path)
+    return rows
+
+def _archive_month(conn, month, archive_dir):
+    names = {table: partition_name(table, month) for table in TABLES}
+    # запись в месяц на время выгрузки запрещена: в файле будет всё, что удалится
+    conn.execute(text(f"LOCK TABLE {', '.join(names[t] for t in reversed(TABLES))} IN SHARE MODE"))
+    report = {"month": f"{month:%Y-%m}", "files": []}
+    for table in TABLES:
+        path = os.path.join(archive_dir, f"{month:%Y_%m}", f"{table}.csv.gz")
+        report[f"{table}_rows"] = _export_partition(conn, names[table], path)
+        report["files"].append(path)
+    for table in TABLES:
+        conn.execute(text(f"ALTER TABLE {PARENTS[table]} DETACH PARTITION {names[table]}"))
+        conn.execute(text(f"DROP TABLE {names[table]}"))
+    return report
+
+def archive_orders(before, archive_dir=None, dry_run=False):
+    """
+    Выгрузить и удалить секции месяцев, целиком лежащих раньше before (не позже начала
+    текущего месяца). Каждый месяц — своя транзакция: файлы записываются до удаления секций,
+    при сбое месяц остаётся в базе и повторный запуск перезапишет его файлы
+    """
+    archive_dir = archive_dir or get_settings().order_archive_dir
+    if isinstance(before, datetime):
+        before = before.date()
+    current = _month_start(date.today())
+    if before > current:
+        raise ValueError(f"Архивировать можно только прошедшие месяцы: before не позже {current}")
+
+    with get_engine().connect() as conn:
+        months = [m for m in _partition_months(conn) if _add_months(m, 1) <= before]
+    if dry_run:
+        return [m for m in list_order_partitions() if m["month"] in {f"{x:%Y-%m}" for x in months}]
+
+    done = []
+    for month in months:
+        with get_engine().begin() as conn:
+            report = _archive_month(conn, month, archive_dir)
+        done.append(report)
+        print(f"{report['month']}: {report['order_rows']} заказов", file=sys.stderr)
+    if done:
+        log_action(0, "archive_orders", {"before": str(before), "months": [r["month"] for r in done]})
+    return done
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.partitions", description="Секции заказов по месяцам")
+    sub = parser.add_subparsers(dest="command", required=True)
+    cmd = sub.add_parser("ensure", help="создать секции на месяцы вперёд")
+    cmd.add_argument("--months-ahead", type=int)
+    sub.add_parser("list", help="секции по месяцам")
+    cmd = sub.add_parser("archive", help="выгрузить и удалить месяцы раньше --before")
+    cmd.add_argument("--before", type=date.fromisoformat, required=True)
+    cmd.add_argument("--archive-dir")
+    cmd.add_argument("--dry-run", action="store_true")
+    args = parser.parse_args()
+
+    if args.command == "ensure":
+        result = ensure_order_partitions(args.months_ahead)
+    elif args.command == "list":
+        result = list_order_partitions()
+    else:
+        try:
+            result = archive_orders(args.before, args.archive_dir, args.dry_run)
+        except ValueError as e:
+            raise SystemExit(f"❌ {e}")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    flush_logs(timeout=5)
@@ -0,0 +1,235 @@
+import asyncio
+import json
+import logging
+import os
+import select
+import threading
+import uuid
+import weakref
+
+from sqlalchemy import text
+
+logger = logging.getLogger(__name__)
+
+# Пауза перед повторным подключением LISTEN: удваивается до максимума, пока база недоступна
+RECONNECT_MIN_S = 1.0
+RECONNECT_MAX_S = 30.0
+
+class LocalBroker:
+    """
+    Брокер сообщений внутри процесса. Используется как замена LISTEN/NOTIFY
+    в тестах и при работе одного воркера.
+    """
+    # сообщения не теряются: внутри процесса доставка прямая
+    connected = True
+
+    def __init__(self):
+        self._subscribers = {}
+        self._resync = {}
+        self._lock = threading.Lock()
+
+    def subscribe(self, channel, callback, on_resync=None):
+        """
+        on_resync() — сообщения канала могли потеряться (брокер переподключался):
+        подписчику пора перечитать состояние заново
+        """
+        with self._lock:
+            self._subscribers.setdefault(channel, []).append(callback)
+            if on_resync is not None:
+                self._resync.setdefault(channel, []).append(on_resync)
+
+        def unsubscribe():
+            with self._lock:
+                callbacks = self._subscribers.get(channel, [])
+                if callback in callbacks:
+                    callbacks.remove(callback)
+                resync = self._resync.get(channel, [])
+                if on_resync in resync:
+                    resync.remove(on_resync)
+        return unsubscribe
+
+    def publish(self, channel, payload):
+        with self._lock:
+            callbacks = list(self._subscribers.get(channel, []))
+        for callback in callbacks:
+            callback(payload)
+
+    def resync(self, channel):
+        with self._lock:
+            callbacks = list(self._resync.get(channel, []))
+        for callback in callbacks:
+            callback()
+
+    def close(self):
+        with self._lock:
+            self._subscribers.clear()
+            self._resync.clear()
+
+
+class PostgresBroker(LocalBroker):
+    """
+    Брокер поверх Postgres LISTEN/NOTIFY: сообщения видят все процессы,
+    подключённые к той же базе. Полезная нагрузка — JSON (до 8000 байт).
+    Поток LISTEN переподключается сам; после переподключения (и после fork) подписчики
+    получают on_resync — уведомления, пришедшие без LISTEN, потеряны
+    """
+
+    def __init__(self, engine, poll_interval=1.0):
+        super().__init__()
+        self.engine = engine
+        self.poll_interval = poll_interval
+        self._channels = set()
+        self._pending_listen = []
+        self._thread = None
+        self._listener_pid = None
+        self._stopped = threading.Event()
+        self._origin = None
+        self._origin_pid = None
+        self._listened = False
+        self.connected = False
+        self.reconnects = 0
+        self.last_error = None
+        # в дочернем процессе потока LISTEN нет — поднимаем его заново
+        ref = weakref.WeakMethod(self._after_fork)
+        os.register_at_fork(after_in_child=lambda: ref() and ref()())
+
+    @property
+    def origin(self):
+        """
+        Метка брокера в сообщениях: свои же уведомления подписчики пропускают.
+        Пересоздаётся после fork — иначе воркеры, унаследовавшие брокер от родителя
+        (gunicorn --preload, multiprocessing), пропускали бы сообщения друг друга
+        """
+        pid = os.getpid()
+        if self._origin_pid != pid:
+            self._origin = f"{pid}-{uuid.uuid4().hex[:8]}"
+            self._origin_pid = pid
+        return self._origin
+
+    def subscribe(self, channel, callback, on_resync=None):
+        unsubscribe = super().subscribe(channel, callback, on_resync)
+        with self._lock:
+            if channel not in self._channels:
+                self._channels.add(channel)
+                self._pending_listen.append(channel)
+        self._ensure_listener()
+        return unsubscribe
+
+    def publish(self, channel, payload):
+        message = json.dumps({"origin": self.origin, "payload": payload}, default=str)
+        try:
+            loop = asyncio.get_running_loop()
+        except RuntimeError:
+            self._notify(channel, message)
+        else:
+            # на event loop (инвалидация кэша из async-кода) NOTIFY через синхронный движок
+            # уходит в пул потоков: цикл не ждёт соединения и базу
+            loop.run_in_executor(None, self._notify, channel, message).add_done_callback(self._notify_done)
+        # Свой процесс получает сообщение сразу, не дожидаясь круга через базу
+        super().publish(channel, payload)
+
+    def _notify(self, channel, message):
+        with self.engine.begin() as conn:
+            conn.execute(text("SELECT pg_notify(:channel, :message)"),
+                         {"channel": channel, "message": message})
+
+    @staticmethod
+    def _notify_done(future):
+        if not future.cancelled() and future.exception() is not None:
+            logger.warning("NOTIFY не отправлен", exc_info=future.exception())
+
+    def close(self):
+        self._stopped.set()
+        if self._thread is not None and self._listener_pid == os.getpid():
+            self._thread.join(self.poll_interval * 2)
+        super().close()
+
+    def _ensure_listener(self):
+        with self._lock:
+            if self._stopped.is_set() or not self._channels:
+                return
+            pid = os.getpid()
+            if self._thread is not None and self._listener_pid == pid:
+                return
+            # поток родителя после fork не существует: новый поток слушает все каналы
+            self._pending_listen = list(self._channels)
+            self._listener_pid = pid
+            self.connected = False
+            self._thread = threading.Thread(target=self._listen, name="pg-listen", daemon=True)
+            self._thread.start()
+
+    def _after_fork(self):
+        # блокировку мог держать поток родителя, которого здесь уже нет
+        self._lock = threading.Lock()
+        self._thread = None
+        self._ensure_listener()
+
+    def _listen(self):
+        delay = RECONNECT_MIN_S
+        while not self._stopped.is_set():
+            try:
+                self._listen_connection()
+            except Exception as e:
+                if self.connected:
+                    delay = RECONNECT_MIN_S
+                self.connected = False
+                self.last_error = repr(e)
+                logger.warning("LISTEN прерван, переподключение через %.1f с", delay, exc_info=True)
+                with self._lock:
+                    self._pending_listen = list(self._channels)
+                self._stopped.wait(delay)
+                delay = min(delay * 2, RECONNECT_MAX_S)
+
+    def _listen_connection(self):
+        raw = self.engine.raw_connection()
+        try:
+            pg_conn = raw.dbapi_connection
+            pg_conn.autocommit = True
+            cursor = pg_conn.cursor()
+            while not self._stopped.is_set():
+                with self._lock:
+                    pending, self._pending_listen = self._pending_listen, []
+                for channel in pending:
+                    cursor.execute(f'LISTEN "{channel}"')
+                if not self.connected:
+                    self._on_connected()
+                if select.select([pg_conn], [], [], self.poll_interval) == ([], [], []):
+                    continue
+                pg_conn.poll()
+                while pg_conn.notifies:
+                    self._dispatch(pg_conn.notifies.pop(0))
+        except Exception:
+            # соединение, скорее всего, оборвано: в пул его не возвращаем
+            raw.invalidate()
+            raise
+        finally:
+            raw.close()
+
+    def _on_connected(self):
+        self.connected = True
+        if not self._listened:
+            self._listened = True
+            return
+        self.reconnects += 1
+        logger.info("LISTEN восстановлен (переподключений: %d)", self.reconnects)
+        with self._lock:
+            channels = list(self._channels)
+        for channel in channels:
+            try:
+                self.resync(channel)
+            except Exception:
+                logger.exception("Ошибка пересинхронизации подписчика канала %s", channel)
+
+    def _dispatch(self, notify):
+        try:
+            message = json.loads(notify.payload)
+            payload = message["payload"]
+        except (ValueError, KeyError, TypeError):
+            logger.warning("Некорректное сообщение в канале %s: %.200s", notify.channel, notify.payload)
+            return
+        if message.get("origin") == self.origin:
+            return
+        try:
+            LocalBroker.publish(self, notify.channel, payload)
+        except Exception:
+            logger.exception("Ошибка подписчика канала %s", notify.channel)
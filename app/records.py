@@ -0,0 +1,211 @@
+import keyword
+import re
+import threading
+from datetime import date, datetime
+from decimal import Decimal
+
+# Форма результата для функций чтения (параметр shape=):
+#   "dict"    — список словарей, как раньше;
+#   "record"  — лёгкие объекты с __slots__ (класс на таблицу и набор колонок): поля
+#               доступны как r.price и как r["price"], в несколько раз меньше памяти, чем dict;
+#   "columns" — словарь {колонка: массив}: числовые колонки (quantity, id...) становятся
+#               массивами NumPy, даты — datetime64, остальное — списками.
+#               Для отчётов по миллионам строк: orders["quantity"].sum() без цикла в Python.
+#               Деньги (NUMERIC: price, total_amount) остаются Decimal — массив dtype=object,
+#               .sum() даёт точную сумму; float64 — явно: orders["total_amount"].astype(float).
+#
+# NumPy импортируется только при первом shape="columns".
+
+SHAPE_DICT = "dict"
+SHAPE_RECORD = "record"
+SHAPE_COLUMNS = "columns"
+SHAPES = (SHAPE_DICT, SHAPE_RECORD, SHAPE_COLUMNS)
+
+PARTITION_SIZE = 10000
+
+_classes = {}
+_lock = threading.Lock()
+
+
+def check_shape(shape):
+    if shape not in SHAPES:
+        raise ValueError(f"Неизвестная форма результата: {shape}. Доступны: {', '.join(SHAPES)}")
+    return shape
+
+
+# ===== Записи с __slots__ =====
+class Record:
+    """Базовый класс записей: доступ по атрибуту и по ключу, сравнение и преобразование в dict."""
+    __slots__ = ()
+
+    def __init__(self, *values):
+        for name, value in zip(self.__slots__, values):
+            setattr(self, name, value)
+
+    def __getitem__(self, key):
+        if key not in self.__slots__:
+            raise KeyError(key)
+        return getattr(self, key)
+
+    def get(self, key, default=None):
+        return getattr(self, key, default) if key in self.__slots__ else default
+
+    def keys(self):
+        return self.__slots__
+
+    def _asdict(self):
+        return {name: getattr(self, name) for name in self.__slots__}
+
+    def __eq__(self, other):
+        if isinstance(other, Record):
+            return self._asdict() == other._asdict()
+        if isinstance(other, dict):
+            return self._asdict() == other
+        return NotImplemented
+
+    __hash__ = None
+
+    def __repr__(self):
+        fields = ", ".join(f"{name}={getattr(self, name)!r}" for name in self.__slots__)
+        return f"{type(self).__name__}({fields})"
+
+    def __reduce__(self):
+        # классы создаются на лету: при распаковке класс находится (или создаётся) заново
+        values = tuple(getattr(self, name) for name in self.__slots__)
+        return _rebuild, (self._table, self._fields, values)
+
+
+def _identifier(name):
+    name = re.sub(r"\W", "_", name)
+    if not name or name[0].isdigit() or keyword.iskeyword(name):
+        name = f"_{name}"
+    return name
+
+def record_class(name, fields):
+    """Класс записи для таблицы name с колонками fields; создаётся один раз на набор колонок."""
+    fields = tuple(fields)
+    key = (name, fields)
+    cls = _classes.get(key)
+    if cls is None:
+        slots = tuple(_identifier(f) for f in fields)
+        if len(set(slots)) != len(slots):
+            raise ValueError(f"{name}: повторяющиеся колонки {list(fields)}")
+        with _lock:
+            cls = _classes.setdefault(key, type(_identifier(name) + "Record", (Record,),
+                                                {"__slots__": slots, "_table": name, "_fields": fields}))
+    return cls
+
+def _rebuild(name, fields, values):
+    return record_class(name, fields)(*values)
+
+
+# ===== Колонки =====
+def _numpy():
+    try:
+        import numpy
+    except ImportError:
+        raise RuntimeError("Для shape='columns' нужен пакет numpy (pip install numpy)") from None
+    return numpy
+
+def column_array(values):
+    """
+    Список значений одной колонки -> массив NumPy, если тип однородный и числовой/временной;
+    иначе — список как есть. None в числовой колонке — nan (массив становится float64).
+    Decimal не округляется до float: массив dtype=object, None остаётся None
+    """
+    np = _numpy()
+    kinds = {type(v) for v in values if v is not None}
+    has_null = any(v is None for v in values)
+    if not kinds:
+        return values
+    if kinds == {bool}:
+        return values if has_null else np.array(values, dtype=bool)
+    if kinds <= {int}:
+        if has_null:
+            return np.array([np.nan if v is None else v for v in values], dtype=np.float64)
+        return np.array(values, dtype=np.int64)
+    if kinds <= {int, float}:
+        return np.array([np.nan if v is None else float(v) for v in values], dtype=np.float64)
+    if kinds <= {int, Decimal}:
+        array = np.empty(len(values), dtype=object)
+        array[:] = values
+        return array
+    if kinds == {datetime} or kinds == {date}:
+        unit = "datetime64[us]" if kinds == {datetime} else "datetime64[D]"
+        return np.array([np.datetime64("NaT") if v is None else v for v in values], dtype=unit)
+    return values
+
+def to_columns(names, rows):
+    """Строки (кортежи) -> {колонка: массив}"""
+    columns = list(zip(*rows)) if rows else [() for _ in names]
+    return {name: column_array(list(values)) for name, values in zip(names, columns)}
+
+def concat_columns(chunks):
+    """
+    Порции одной колонки (результаты column_array) -> одна колонка того же вида, что дал бы
+    column_array по всем значениям сразу. Числовые порции склеиваются без Python-объектов
+    """
+    np = _numpy()
+    if not chunks:
+        return []
+    if all(isinstance(c, np.ndarray) for c in chunks):
+        return np.concatenate(chunks)
+    if not any(isinstance(c, np.ndarray) for c in chunks):
+        return [v for c in chunks for v in c]
+    # смешанные порции (например, одна целиком из NULL): тип определяется по всем значениям
+    values = []
+    for c in chunks:
+        if isinstance(c, np.ndarray) and c.dtype.kind == "f":
+            values.extend(None if np.isnan(v) else v for v in c.tolist())
+        else:
+            values.extend(c.tolist() if isinstance(c, np.ndarray) else c)
+    return column_array(values)
+
+
+# ===== Преобразование результата =====
+def shape_rows(result, shape=SHAPE_DICT, name="Row"):
+    """Прочитать результат SQLAlchemy целиком в выбранной форме"""
+    if shape == SHAPE_DICT:
+        return [dict(r._mapping) for r in result]
+    names = list(result.keys())
+    if shape == SHAPE_RECORD:
+        cls = record_class(name, names)
+        return [cls(*r) for r in result]
+    if shape == SHAPE_COLUMNS:
+        # порция за порцией в колонки: строки целиком в памяти не копятся
+        chunks = [to_columns(names, partition) for partition in result.partitions(PARTITION_SIZE)]
+        if not chunks:
+            return to_columns(names, [])
+        return {name: concat_columns([c[name] for c in chunks]) for name in names}
+    check_shape(shape)
+
+def shape_partition(names, rows, shape=SHAPE_DICT, name="Row"):
+    """Порция строк потока: dict/record — по одной, columns — одна порция колонками"""
+    if shape == SHAPE_COLUMNS:
+        yield to_columns(names, rows)
+    elif shape == SHAPE_RECORD:
+        cls = record_class(name, names)
+        for r in rows:
+            yield cls(*r)
+    else:
+        for r in rows:
+            yield dict(zip(names, r))
+
+def row_count(rows):
+    """Число строк результата в любой форме"""
+    if isinstance(rows, dict):
+        return len(next(iter(rows.values()), ()))
+    return len(rows)
+
+def shape_row(row, shape=SHAPE_DICT, name="Row"):
+    """Одна строка (или None) в форме dict/record; для columns — колонки по одному значению"""
+    if row is None:
+        return None
+    if shape == SHAPE_DICT:
+        return dict(row._mapping)
+    names = list(row._fields)
+    if shape == SHAPE_RECORD:
+        return record_class(name, names)(*row)
+    if shape == SHAPE_COLUMNS:
+        return to_columns(names, [tuple(row)])
+    check_shape(shape)
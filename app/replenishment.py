@@ -0,0 +1,268 @@
+import argparse
+import json
+from datetime import date, timedelta
+
+import numpy as np
+from sqlalchemy import text
+
+from app.crud_postgres import safe_log
+from app.db import begin, connect_read
+
+# Планировщик пополнения склада: заказы поставщикам по всем филиалам за один проход.
+#
+#   from app.replenishment import plan_replenishment, replenish
+#   plan = plan_replenishment()                 # только план, без записи
+#   plan = replenish(branch_ids=[1, 2])         # план + SupplyOrder / SupplyOrderItem
+#
+#   python -m app.replenishment plan --cover-days 10
+#   python -m app.replenishment apply
+#
+# Данные читаются несколькими запросами на все филиалы сразу, дальше — матрицы NumPy
+# филиал × пункт меню:
+#   запас      — сколько порций можно приготовить из остатков склада
+#                (min по ингредиентам Inventory.quantity / InventoryMenuItem.quantity_used);
+#   в пути     — порции в незакрытых заказах поставки (status = 'in_progress');
+#   расход     — порций в день за последние window_days дней (BranchDailyItemSales:
+#                агрегаты OrderItem без отменённых заказов, их держат триггеры);
+#   дней запаса — запас / расход.
+# Заказ нужен, когда запас + в пути не покрывает lead_days + safety_days дней расхода;
+# заказывается до уровня lead_days + safety_days + cover_days дней. Поставщик — самый дешёвый
+# по SupplierMenuItem.supply_price (при равной цене — с меньшим supplier_id).
+# Пункты без рецепта (запас не отслеживается) и без поставщика не планируются.
+
+DEFAULT_WINDOW_DAYS = 28
+DEFAULT_LEAD_DAYS = 2
+DEFAULT_SAFETY_DAYS = 1
+DEFAULT_COVER_DAYS = 7
+SUPPLY_STATUS = "in_progress"
+
+
+# ===== Загрузка =====
+def _branch_filter(column, branch_ids):
+    return f" AND {column} = ANY(:branch_ids)" if branch_ids is not None else ""
+
+def _load(conn, branch_ids, since, until):
+    params = {"branch_ids": list(branch_ids) if branch_ids is not None else None,
+              "since": since, "until": until, "status": SUPPLY_STATUS}
+    where = _branch_filter("branch_id", branch_ids)
+    branches = conn.execute(text(f"SELECT branch_id FROM CafeBranch WHERE TRUE{where} ORDER BY branch_id"),
+                            params).scalars().all()
+    items = conn.execute(text("SELECT item_id FROM MenuItem ORDER BY item_id")).scalars().all()
+    recipes = conn.execute(text(f"""
+        SELECT inv.branch_id, imi.item_id, COALESCE(inv.quantity, 0), imi.quantity_used
+        FROM InventoryMenuItem imi
+        JOIN Inventory inv ON inv.inventory_id = imi.inventory_id
+        WHERE imi.quantity_used > 0{_branch_filter("inv.branch_id", branch_ids)}
+    """), params).all()
+    sales = conn.execute(text(f"""
+        SELECT branch_id, item_id, SUM(quantity)
+        FROM BranchDailyItemSales
+        WHERE sales_date >= :since AND sales_date < :until{where}
+        GROUP BY branch_id, item_id
+    """), params).all()
+    on_order = conn.execute(text(f"""
+        SELECT so.branch_id, soi.item_id, SUM(soi.quantity)
+        FROM SupplyOrderItem soi
+        JOIN SupplyOrder so ON so.supply_order_id = soi.supply_order_id
+        WHERE so.status = :status{_branch_filter("so.branch_id", branch_ids)}
+        GROUP BY so.branch_id, soi.item_id
+    """), params).all()
+    prices = conn.execute(text(
+        "SELECT item_id, supplier_id, supply_price FROM SupplierMenuItem WHERE supply_price IS NOT NULL"
+    )).all()
+    return branches, items, recipes, sales, on_order, prices
+
+def _columns(rows, dtypes):
+    """Строки запроса -> массивы по колонкам"""
+    if not rows:
+        return [np.empty(0, dtype=dtype) for dtype in dtypes]
+    return [np.array(column, dtype=dtype) for column, dtype in zip(zip(*rows), dtypes)]
+
+def _positions(branches, items, branch_col, item_col):
+    """Индексы строк в матрице филиал × пункт меню; строки вне матрицы отбрасываются"""
+    known = np.isin(branch_col, branches) & np.isin(item_col, items)
+    return np.searchsorted(branches, branch_col[known]), np.searchsorted(items, item_col[known]), known
+
+
+# ===== Расчёт =====
+def _cheapest_suppliers(items, prices):
+    """(supplier_id, цена) на каждый пункт меню; -1 / nan — поставщика нет"""
+    item_col, supplier_col, price_col = _columns(prices, (np.int64, np.int64, np.float64))
+    supplier = np.full(len(items), -1, dtype=np.int64)
+    price = np.full(len(items), np.nan)
+    keep = np.isin(item_col, items)
+    item_col, supplier_col, price_col = item_col[keep], supplier_col[keep], price_col[keep]
+    # сортировка по пункту, затем по цене и id поставщика: первая строка пункта — самая дешёвая
+    order = np.lexsort((supplier_col, price_col, item_col))
+    item_col, supplier_col, price_col = item_col[order], supplier_col[order], price_col[order]
+    _, first = np.unique(item_col, return_index=True)
+    index = np.searchsorted(items, item_col[first])
+    supplier[index] = supplier_col[first]
+    price[index] = price_col[first]
+    return supplier, price
+
+def _compute(branches, items, recipes, sales, on_order, prices,
+             window_days, lead_days, safety_days, cover_days):
+    shape = (len(branches), len(items))
+
+    # запас в порциях: минимум по ингредиентам рецепта
+    r_branch, r_item, r_qty, r_used = _columns(recipes, (np.int64, np.int64, np.float64, np.float64))
+    bi, mi, known = _positions(branches, items, r_branch, r_item)
+    stock = np.full(shape, np.inf)
+    np.minimum.at(stock, (bi, mi), np.floor(np.maximum(r_qty[known], 0) / r_used[known]))
+    tracked = np.isfinite(stock)
+    stock[~tracked] = 0
+
+    s_branch, s_item, s_qty = _columns(sales, (np.int64, np.int64, np.float64))
+    bi, mi, known = _positions(branches, items, s_branch, s_item)
+    rate = np.zeros(shape)
+    rate[bi, mi] = s_qty[known] / window_days
+
+    o_branch, o_item, o_qty = _columns(on_order, (np.int64, np.int64, np.float64))
+    bi, mi, known = _positions(branches, items, o_branch, o_item)
+    pending = np.zeros(shape)
+    pending[bi, mi] = o_qty[known]
+
+    supplier, price = _cheapest_suppliers(items, prices)
+
+    position = stock + pending
+    days_of_cover = np.divide(stock, rate, out=np.full(shape, np.inf), where=rate > 0)
+    reorder_point = rate * (lead_days + safety_days)
+    target = rate * (lead_days + safety_days + cover_days)
+    quantity = np.ceil(target - position)
+    need = tracked & (rate > 0) & (position < reorder_point) & (quantity > 0)
+    no_supplier = need & (supplier < 0)[None, :]
+    need &= ~no_supplier
+
+    stats = {
+        "branches": len(branches),
+        "items": len(items),
+        "tracked": int(tracked.sum()),
+        "below_reorder_point": int((need | no_supplier).sum()),
+        "no_supplier": int(no_supplier.sum()),
+    }
+    return need, quantity, supplier, price, stock, pending, rate, days_of_cover, stats
+
+def _build_orders(branches, items, need, quantity, supplier, price, stock, pending, rate, days_of_cover):
+    """Строки плана, сгруппированные в заказы (филиал, поставщик)"""
+    bi, mi = np.nonzero(need)
+    order = np.lexsort((items[mi], supplier[mi], branches[bi]))
+    orders = {}
+    for b, m in zip(bi[order], mi[order]):
+        key = (int(branches[b]), int(supplier[m]))
+        entry = orders.setdefault(key, {"branch_id": key[0], "supplier_id": key[1], "items": [], "total_cost": 0.0})
+        qty = int(quantity[b, m])
+        entry["items"].append({
+            "item_id": int(items[m]),
+            "quantity": qty,
+            "supply_price": float(price[m]),
+            "on_hand": float(stock[b, m]),
+            "on_order": float(pending[b, m]),
+            "daily_usage": round(float(rate[b, m]), 3),
+            "days_of_cover": round(float(days_of_cover[b, m]), 2),
+        })
+        entry["total_cost"] += qty * float(price[m])
+    for entry in orders.values():
+        entry["total_cost"] = round(entry["total_cost"], 2)
+    return list(orders.values())
+
+def _plan(conn, branch_ids, window_days, lead_days, safety_days, cover_days, today):
+    if window_days < 1:
+        raise ValueError("window_days должно быть положительным")
+    if min(lead_days, safety_days, cover_days) < 0:
+        raise ValueError("lead_days, safety_days и cover_days не могут быть отрицательными")
+    today = today or date.today()
+    since = today - timedelta(days=window_days)
+    branches, items, recipes, sales, on_order, prices = _load(conn, branch_ids, since, today)
+    branches, items = np.array(branches, dtype=np.int64), np.array(items, dtype=np.int64)
+    need, quantity, supplier, price, stock, pending, rate, days_of_cover, stats = _compute(
+        branches, items, recipes, sales, on_order, prices, window_days, lead_days, safety_days, cover_days)
+    orders = _build_orders(branches, items, need, quantity, supplier, price, stock, pending, rate, days_of_cover)
+    return {
+        "date": today.isoformat(),
+        "window": {"since": since.isoformat(), "until": today.isoformat()},
+        "parameters": {"window_days": window_days, "lead_days": lead_days,
+                       "safety_days": safety_days, "cover_days": cover_days},
+        "stats": dict(stats, orders=len(orders), lines=sum(len(o["items"]) for o in orders)),
+        "total_cost": round(sum(o["total_cost"] for o in orders), 2),
+        "orders": orders,
+    }
+
+
+# ===== Запись =====
+def _write_orders(conn, orders):
+    if not orders:
+        return
+    created = conn.execute(
+        text("""
+            INSERT INTO SupplyOrder (supplier_id, branch_id, status)
+            SELECT u.supplier_id, u.branch_id, :status
+            FROM unnest(CAST(:supplier_ids AS INT[]), CAST(:branch_ids AS INT[])) AS u(supplier_id, branch_id)
+            RETURNING supply_order_id, supplier_id, branch_id
+        """),
+        {"supplier_ids": [o["supplier_id"] for o in orders],
+         "branch_ids": [o["branch_id"] for o in orders], "status": SUPPLY_STATUS}
+    ).all()
+    ids = {(r.branch_id, r.supplier_id): r.supply_order_id for r in created}
+    order_ids, item_ids, quantities = [], [], []
+    for entry in orders:
+        entry["supply_order_id"] = ids[(entry["branch_id"], entry["supplier_id"])]
+        for line in entry["items"]:
+            order_ids.append(entry["supply_order_id"])
+            item_ids.append(line["item_id"])
+            quantities.append(line["quantity"])
+    conn.execute(
+        text("""
+            INSERT INTO SupplyOrderItem (supply_order_id, item_id, quantity)
+            SELECT * FROM unnest(CAST(:order_ids AS INT[]), CAST(:item_ids AS INT[]), CAST(:quantities AS INT[]))
+        """),
+        {"order_ids": order_ids, "item_ids": item_ids, "quantities": quantities}
+    )
+
+
+# ===== Публичный API =====
+def plan_replenishment(branch_ids=None, window_days=DEFAULT_WINDOW_DAYS, lead_days=DEFAULT_LEAD_DAYS,
+                       safety_days=DEFAULT_SAFETY_DAYS, cover_days=DEFAULT_COVER_DAYS, today=None):
+    """План заказов поставки без записи; branch_ids=None — все филиалы"""
+    with connect_read() as conn:
+        plan = _plan(conn, branch_ids, window_days, lead_days, safety_days, cover_days, today)
+    safe_log(0, "plan_replenishment", plan["stats"])
+    return plan
+
+def replenish(branch_ids=None, window_days=DEFAULT_WINDOW_DAYS, lead_days=DEFAULT_LEAD_DAYS,
+              safety_days=DEFAULT_SAFETY_DAYS, cover_days=DEFAULT_COVER_DAYS, today=None, dry_run=False):
+    """
+    Построить план и записать его: SupplyOrder на пару (филиал, поставщик) и их позиции —
+    двумя INSERT в одной транзакции. dry_run=True — то же, что plan_replenishment.
+    Параллельные запуски выполняются по очереди (advisory lock), так что заказ в пути
+    второго запуска уже учитывает результат первого
+    """
+    if dry_run:
+        return plan_replenishment(branch_ids, window_days, lead_days, safety_days, cover_days, today)
+    with begin() as conn:
+        conn.execute(text("SELECT pg_advisory_xact_lock(hashtext('replenishment'))"))
+        plan = _plan(conn, branch_ids, window_days, lead_days, safety_days, cover_days, today)
+        _write_orders(conn, plan["orders"])
+    safe_log(0, "replenish", plan["stats"])
+    return plan
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(prog="python -m app.replenishment", description="Планирование поставок")
+    parser.add_argument("command", choices=["plan", "apply"], help="plan — только показать, apply — создать заказы")
+    parser.add_argument("--branch", type=int, action="append", dest="branch_ids", help="филиал (можно несколько)")
+    parser.add_argument("--window-days", type=int, default=DEFAULT_WINDOW_DAYS)
+    parser.add_argument("--lead-days", type=float, default=DEFAULT_LEAD_DAYS)
+    parser.add_argument("--safety-days", type=float, default=DEFAULT_SAFETY_DAYS)
+    parser.add_argument("--cover-days", type=float, default=DEFAULT_COVER_DAYS)
+    parser.add_argument("--date", type=date.fromisoformat, help="дата расчёта (по умолчанию сегодня)")
+    args = parser.parse_args()
+
+    try:
+        result = replenish(args.branch_ids, args.window_days, args.lead_days, args.safety_days,
+                           args.cover_days, args.date, dry_run=args.command == "plan")
+    except ValueError as e:
+        raise SystemExit(f"❌ {e}")
+    print(json.dumps(result, ensure_ascii=False, indent=2))
+    from app.crud_mongo import flush_logs
+    flush_logs(timeout=5)
@@ -0,0 +1,182 @@
+import argparse
+import json
+from datetime import datetime, timedelta
+
+from pymongo import UpdateOne
+
+from app.db import get_async_mongo_db, get_mongo_db
+
+# Предрасчитанная аналитика отзывов: дашборды читают маленькие документы-сводки
+# вместо сканирования коллекции reviews.
+#
+# review_summaries      — {_id: "branch:1" | "item:5", scope, ref_id, count, rating_sum, sentiment_sum,
+#                          rating_dist: {"1".."5": n}, sentiment_dist: {"1".."5": n}, updated_at}
+# review_summary_daily  — счётчики за день ({_id: "branch:1:2025-10-23", scope, ref_id, day, ...});
+#                          по ним считаются окна 7/30 дней, старые дни удаляет TTL-индекс
+#
+# add_review наращивает сводки через $inc; rebuild_summaries() пересобирает их
+# агрегацией с $merge (по расписанию или после ручной правки отзывов).
+
+SUMMARIES = "review_summaries"
+DAILY = "review_summary_daily"
+WINDOWS = (7, 30)
+DAILY_RETENTION_DAYS = max(WINDOWS) + 1
+
+SCOPE_BRANCH = "branch"
+SCOPE_ITEM = "item"
+SCOPE_FIELDS = {SCOPE_BRANCH: "branch_id", SCOPE_ITEM: "item_id"}
+
+
+def _day(moment):
+    return datetime(moment.year, moment.month, moment.day)
+
+def summary_updates(review):
+    """
+    Операции bulk_write, добавляющие один отзыв к его сводкам:
+    (для review_summaries, для review_summary_daily)
+    """
+    day = _day(review["created_at"])
+    counters = {"count": 1, "rating_sum": review["rating"], "sentiment_sum": review["sentiment"]}
+    summary_ops, daily_ops = [], []
+    for scope, field in SCOPE_FIELDS.items():
+        ref_id = review.get(field)
+        if ref_id is None:
+            continue
+        key = f"{scope}:{ref_id}"
+        summary_ops.append(UpdateOne(
+            {"_id": key},
+            {"$inc": {**counters, f"rating_dist.{review['rating']}": 1,
+                      f"sentiment_dist.{review['sentiment']}": 1},
+             "$set": {"scope": scope, "ref_id": ref_id, "updated_at": review["created_at"]}},
+            upsert=True,
+        ))
+        daily_ops.append(UpdateOne(
+            {"_id": f"{key}:{day:%Y-%m-%d}"},
+            {"$inc": counters, "$set": {"scope": scope, "ref_id": ref_id, "day": day}},
+            upsert=True,
+        ))
+    return summary_ops, daily_ops
+
+def record_review(review):
+    summary_ops, daily_ops = summary_updates(review)
+    db = get_mongo_db()
+    if summary_ops:
+        db[SUMMARIES].bulk_write(summary_ops, ordered=False)
+        db[DAILY].bulk_write(daily_ops, ordered=False)
+
+async def arecord_review(review):
+    summary_ops, daily_ops = summary_updates(review)
+    db = get_async_mongo_db()
+    if summary_ops:
+        await db[SUMMARIES].bulk_write(summary_ops, ordered=False)
+        await db[DAILY].bulk_write(daily_ops, ordered=False)
+
+
+# ===== Чтение =====
+def _format(summary, daily, today):
+    count = summary.get("count", 0)
+    result = {
+        "scope": summary["scope"],
+        "ref_id": summary["ref_id"],
+        "count": count,
+        "mean_rating": round(summary["rating_sum"] / count, 3) if count else None,
+        "mean_sentiment": round(summary["sentiment_sum"] / count, 3) if count else None,
+        "rating_distribution": {str(k): summary.get("rating_dist", {}).get(str(k), 0) for k in range(1, 6)},
+        "sentiment_distribution": {str(k): summary.get("sentiment_dist", {}).get(str(k), 0) for k in range(1, 6)},
+        "updated_at": summary.get("updated_at"),
+    }
+    for window in WINDOWS:
+        since = today - timedelta(days=window - 1)
+        days = [d for d in daily if d["day"] >= since]
+        n = sum(d["count"] for d in days)
+        result[f"last_{window}_days"] = {
+            "count": n,
+            "mean_rating": round(sum(d["rating_sum"] for d in days) / n, 3) if n else None,
+            "mean_sentiment": round(sum(d["sentiment_sum"] for d in days) / n, 3) if n else None,
+        }
+    return result
+
+def get_summaries(scope=SCOPE_BRANCH, ref_ids=None):
+    """Сводки по всем филиалам (или пунктам меню) — два запроса к маленьким коллекциям."""
+    if scope not in SCOPE_FIELDS:
+        raise ValueError(f"Неизвестная область сводки: {scope}")
+    db = get_mongo_db()
+    query = {"scope": scope}
+    if ref_ids is not None:
+        query["ref_id"] = {"$in": list(ref_ids)}
+    today = _day(datetime.utcnow())
+    daily_by_ref = {}
+    for d in db[DAILY].find({**query, "day": {"$gte": today - timedelta(days=max(WINDOWS) - 1)}}):
+        daily_by_ref.setdefault(d["ref_id"], []).append(d)
+    return [_format(s, daily_by_ref.get(s["ref_id"], []), today)
+            for s in db[SUMMARIES].find(query).sort("ref_id", 1)]
+
+def get_summary(branch_id=None, item_id=None):
+    """Сводка по одному филиалу или пункту меню; None, если отзывов нет."""
+    if (branch_id is None) == (item_id is None):
+        raise ValueError("Нужно указать ровно одно: branch_id или item_id")
+    scope, ref_id = (SCOPE_BRANCH, branch_id) if branch_id is not None else (SCOPE_ITEM, item_id)
+    found = get_summaries(scope, [ref_id])
+    return found[0] if found else None
+
+
+# ===== Полная пересборка =====
+def _scope_pipeline(scope, daily):
+    field = SCOPE_FIELDS[scope]
+    match = {field: {"$ne": None}}
+    group_id = {"ref_id": f"${field}"}
+    group = {"count": {"$sum": 1}, "rating_sum": {"$sum": "$rating"}, "sentiment_sum": {"$sum": "$sentiment"}}
+    if daily:
+        match["created_at"] = {"$gte": _day(datetime.utcnow()) - timedelta(days=DAILY_RETENTION_DAYS)}
+        group_id["day"] = {"$dateTrunc": {"date": "$created_at", "unit": "day"}}
+        project = {
+            "_id": {"$concat": [f"{scope}:", {"$toString": "$_id.ref_id"}, ":",
+                                {"$dateToString": {"date": "$_id.day", "format": "%Y-%m-%d"}}]},
+            "scope": scope, "ref_id": "$_id.ref_id", "day": "$_id.day",
+            "count": 1, "rating_sum": 1, "sentiment_sum": 1,
+        }
+    else:
+        # распределения — счётчиками по каждому значению, без накопления массивов в $group
+        for source in ("rating", "sentiment"):
+            for k in range(1, 6):
+                group[f"{source}_{k}"] = {"$sum": {"$cond": [{"$eq": [f"${source}", k]}, 1, 0]}}
+        group["updated_at"] = {"$max": "$created_at"}
+        project = {
+            "_id": {"$concat": [f"{scope}:", {"$toString": "$_id.ref_id"}]},
+            "scope": scope, "ref_id": "$_id.ref_id",
+            "count": 1, "rating_sum": 1, "sentiment_sum": 1, "updated_at": 1,
+            **{f"{source}_dist": {str(k): f"${source}_{k}" for k in range(1, 6)}
+               for source in ("rating", "sentiment")},
+        }
+    return [
+        {"$match": match},
+        {"$group": {"_id": group_id, **group}},
+        {"$project": project},
+        {"$merge": {"into": DAILY if daily else SUMMARIES,
+                    "on": "_id", "whenMatched": "replace", "whenNotMatched": "insert"}},
+    ]
+
+def rebuild_summaries():
+    """
+    Пересчитать все сводки по коллекции reviews ($group + $merge на стороне сервера).
+    Сводки без отзывов удаляются. Отзыв, добавленный во время пересборки, может
+    потеряться в сводке до следующего запуска — запускайте по расписанию в тихие часы
+    """
+    db = get_mongo_db()
+    for scope in SCOPE_FIELDS:
+        for daily in (False, True):
+            db.reviews.aggregate(_scope_pipeline(scope, daily))
+    live = [f"{scope}:{ref_id}" for scope, field in SCOPE_FIELDS.items()
+            for ref_id in db.reviews.distinct(field, {field: {"$ne": None}})]
+    removed = db[SUMMARIES].delete_many({"_id": {"$nin": live}}).deleted_count
+    return {"summaries": db[SUMMARIES].count_documents({}), "removed": removed}
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сводки по отзывам")
+    parser.add_argument("command", choices=["rebuild", "show"])
+    parser.add_argument("--scope", choices=list(SCOPE_FIELDS), default=SCOPE_BRANCH)
+    args = parser.parse_args()
+    if args.command == "rebuild":
+        print(json.dumps(rebuild_summaries(), ensure_ascii=False))
+    else:
+        print(json.dumps(get_summaries(args.scope), ensure_ascii=False, indent=2, default=str))
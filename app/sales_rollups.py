@@ -0,0 +1,112 @@
+import argparse
+import json
+
+from sqlalchemy import text
+
+from app.crud_postgres import safe_log
+from app.db import begin, connect
+
+# Агрегаты продаж поддерживаются триггерами (postgres/migrations/001_sales_rollups.sql);
+# здесь — чтение агрегатов и сверка их с базовыми таблицами.
+# Дни архивированных месяцев (app/partitions.py) есть только в агрегатах: сверка и
+# пересборка их не трогают.
+
+
+def _date_conditions(date_range, params):
+    conditions = []
+    if date_range:
+        date_from, date_to = date_range
+        if date_from is not None:
+            conditions.append("sales_date >= :date_from")
+            params["date_from"] = date_from
+        if date_to is not None:
+            conditions.append("sales_date <= :date_to")
+            params["date_to"] = date_to
+    return conditions
+
+def get_branch_sales(branch_id, date_range=None):
+    """
+    Выручка и число заказов филиала по дням; date_range — (с, по) включительно
+    """
+    params = {"branch_id": branch_id}
+    conditions = ["branch_id = :branch_id"] + _date_conditions(date_range, params)
+    with connect() as conn:
+        result = conn.execute(
+            text(f"""
+                SELECT sales_date, orders_count, revenue
+                FROM BranchDailySales
+                WHERE {" AND ".join(conditions)}
+                ORDER BY sales_date
+            """),
+            params
+        )
+        sales = [dict(r._mapping) for r in result]
+    safe_log(0, "get_branch_sales", {"branch_id": branch_id})
+    return sales
+
+def top_items(branch_id, n=10, date_range=None):
+    params = {"branch_id": branch_id, "n": n}
+    conditions = ["s.branch_id = :branch_id"] + _date_conditions(date_range, params)
+    with connect() as conn:
+        result = conn.execute(
+            text(f"""
+                SELECT s.item_id, mi.name, SUM(s.quantity) AS quantity, SUM(s.revenue) AS revenue
+                FROM BranchDailyItemSales s
+                LEFT JOIN MenuItem mi ON mi.item_id = s.item_id
+                WHERE {" AND ".join(conditions)}
+                GROUP BY s.item_id, mi.name
+                HAVING SUM(s.quantity) > 0
+                ORDER BY quantity DESC, revenue DESC
+                LIMIT :n
+            """),
+            params
+        )
+        items = [dict(r._mapping) for r in result]
+    safe_log(0, "top_items", {"branch_id": branch_id, "n": n})
+    return items
+
+def verify_sales_rollups():
+    """
+    Сравнить агрегаты с пересчётом по "Order"/OrderItem (с начала самой старой секции);
+    возвращает расхождения
+    """
+    with connect() as conn:
+        result = conn.execute(text("""
+            WITH expected AS (
+                SELECT o.branch_id, o.order_time::date AS sales_date,
+                       COUNT(DISTINCT o.order_id) AS orders_count,
+                       COALESCE(SUM(oi.quantity * oi.price), 0) AS revenue
+                FROM "Order" o
+                LEFT JOIN OrderItem oi ON oi.order_id = o.order_id AND oi.order_time = o.order_time
+                WHERE o.branch_id IS NOT NULL AND o.status IS DISTINCT FROM 'cancelled'
+                GROUP BY o.branch_id, o.order_time::date
+            )
+            SELECT COALESCE(e.branch_id, s.branch_id) AS branch_id,
+                   COALESCE(e.sales_date, s.sales_date) AS sales_date,
+                   e.orders_count AS expected_orders, s.orders_count AS rollup_orders,
+                   e.revenue AS expected_revenue, s.revenue AS rollup_revenue
+            FROM expected e
+            FULL JOIN (SELECT * FROM BranchDailySales WHERE sales_date >= order_partitions_start()) s
+                   ON s.branch_id = e.branch_id AND s.sales_date = e.sales_date
+            WHERE e.orders_count IS DISTINCT FROM NULLIF(s.orders_count, 0)
+               OR COALESCE(e.revenue, 0) <> COALESCE(s.revenue, 0)
+            ORDER BY 1, 2
+        """))
+        return [dict(r._mapping) for r in result]
+
+def rebuild_sales_rollups():
+    with begin() as conn:
+        fixed_totals = conn.execute(text("SELECT rebuild_sales_rollups()")).scalar()
+    safe_log(0, "rebuild_sales_rollups", {"fixed_totals": fixed_totals})
+    return fixed_totals
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Сверка агрегатов продаж")
+    parser.add_argument("command", choices=["verify", "rebuild"])
+    args = parser.parse_args()
+    if args.command == "verify":
+        mismatches = verify_sales_rollups()
+        print(json.dumps(mismatches, default=str, ensure_ascii=False, indent=2))
+    else:
+        print(f"Пересобрано, исправлено итогов заказов: {rebuild_sales_rollups()}")
@@ -0,0 +1,116 @@
+import json
+import os
+from dataclasses import dataclass, fields, replace
+
+
+@dataclass(frozen=True)
+class Settings:
+    # ===== PostgreSQL =====
+    postgres_user: str = "postgres"
+    postgres_password: str = "postgres"
+    postgres_host: str = "localhost"
+    postgres_port: int = 5432
+    postgres_db: str = "cafe_db"
+    database_url: str = ""            # если задан, перекрывает postgres_*
+    pool_size: int = 5
+    max_overflow: int = 10
+    pool_timeout: float = 30.0        # секунды ожидания свободного соединения
+    pool_recycle: int = 1800
+    pool_pre_ping: bool = True
+    statement_timeout_ms: int = 0     # 0 — без ограничения
+    replica_urls: str = ""            # реплики для чтения через запятую; пусто — всё на основной
+    replica_balancing: str = "round_robin"  # round_robin | least_connections
+    replica_max_lag_s: float = 5.0    # отстающая сильнее реплика выпадает; столько же длится read-your-writes
+    replica_check_interval: float = 2.0
+
+    # ===== MongoDB =====
+    mongo_url: str = "mongodb://localhost:27017/"
+    mongo_db: str = "cafe_mongo"
+    mongo_max_pool_size: int = 100
+    mongo_server_selection_timeout_ms: int = 5000
+
+    # ===== Журнал действий =====
+    log_batch_size: int = 200
+    log_flush_interval: float = 0.5
+    log_queue_size: int = 10000
+    log_overflow_policy: str = "block"
+    log_sample_rate: float = 0.1
+    log_hot_days: int = 7             # столько дней записи лежат в logs как есть
+    log_archive_days: int = 365       # срок хранения в logs_archive (TTL)
+    log_archive_dir: str = "log_archive"  # сюда выгружаются .jsonl.gz по дням
+    log_mongo_timeout_ms: int = 500   # бюджет на запись пачки в MongoDB; дольше — пачка уходит в спул
+    log_spool_dir: str = "log_spool"  # спул журнала на время недоступности MongoDB (app/log_spool.py)
+    log_spool_segment_bytes: int = 16 * 1024 * 1024
+    log_breaker_failures: int = 3     # неудач подряд, после которых MongoDB не трогаем
+    log_breaker_cooldown_s: float = 30.0
+
+    # ===== Лента заказов =====
+    order_feed_broker: str = "postgres"   # postgres — LISTEN/NOTIFY, local — в пределах процесса
+
+    # ===== Секции заказов =====
+    order_partitions_ahead: int = 3       # столько месяцев вперёд держать готовые секции
+    order_archive_dir: str = "order_archive"  # сюда выгружаются архивированные месяцы (app/partitions.py)
+
+    # ===== Выгрузка для аналитики =====
+    export_dir: str = "analytics_export"  # Parquet по месяцам и филиалам (app/analytics_export.py)
+    export_replica_wait_s: float = 30.0   # ждать реплику до границы выгрузки, потом читать с основного
+    export_review_lag_s: float = 60.0     # отзывы моложе этого выгружаются в следующий раз
+    export_tombstone_days: int = 30       # сколько хранить записи об удалениях в ExportTombstone
+
+    # ===== Метрики =====
+    metrics_slow_ms: float = 250.0    # порог медленного вызова; 0 — не собирать
+    metrics_slow_log_size: int = 100
+
+    @property
+    def postgres_url(self):
+        if self.database_url:
+            return self.database_url
+        return (f"postgresql://{self.postgres_user}:{self.postgres_password}"
+                f"@{self.postgres_host}:{self.postgres_port}/{self.postgres_db}")
+
+    @classmethod
+    def load(cls, environ=None):
+        """
+        Значения по умолчанию -> JSON-файл из CAFE_CONFIG -> переменные окружения.
+        Переменная окружения называется как поле в верхнем регистре (POOL_SIZE, MONGO_URL, ...)
+        """
+        environ = os.environ if environ is None else environ
+        values = {}
+        config_path = environ.get("CAFE_CONFIG")
+        if config_path:
+            with open(config_path, encoding="utf-8") as f:
+                values.update(json.load(f))
+        for f in fields(cls):
+            raw = environ.get(f.name.upper())
+            if raw is not None:
+                values[f.name] = raw
+        unknown = set(values) - {f.name for f in fields(cls)}
+        if unknown:
+            raise ValueError(f"Неизвестные параметры настроек: {sorted(unknown)}")
+        return cls(**{name: _cast(cls, name, value) for name, value in values.items()})
+
+
+def _cast(cls, name, value):
+    default = cls.__dataclass_fields__[name].default
+    if isinstance(default, bool):
+        if isinstance(value, str):
+            return value.strip().lower() in ("1", "true", "yes", "on")
+        return bool(value)
+    return type(default)(value)
+
+
+_settings = None
+
+def get_settings():
+    global _settings
+    if _settings is None:
+        _settings = Settings.load()
+    return _settings
+
+def configure(**overrides):
+    """Переопределить настройки в коде; уже созданные подключения будут пересозданы."""
+    global _settings
+    _settings = replace(get_settings(), **overrides)
+    from app import db
+    db.reset()
+    return _settings
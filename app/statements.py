@@ -0,0 +1,122 @@
+import threading
+
+from sqlalchemy import text
+
+# Построитель UPDATE-запросов для update_* функций.
+# Обновляемые колонки берутся из схемы (information_schema) — всё, кроме первичного ключа;
+# неизвестные поля отклоняются до обращения к базе. Запрос строится один раз на набор
+# колонок (порядок аргументов не важен) и дальше берётся из кэша, так что у SQLAlchemy
+# и Postgres один и тот же текст запроса вместо нового на каждую комбинацию kwargs.
+
+# таблица -> первичный ключ
+TABLES = {
+    "Customer": "customer_id",
+    "Employee": "employee_id",
+    "MenuItem": "item_id",
+}
+
+_columns = {}
+_statements = {}
+_lock = threading.Lock()
+
+
+def updatable_columns(conn, table):
+    """{колонка: тип Postgres} обновляемых колонок таблицы; читается из схемы один раз."""
+    columns = _columns.get(table)
+    if columns is None:
+        if table not in TABLES:
+            raise ValueError(f"Таблица {table} не поддерживает обновление через statements")
+        rows = conn.execute(
+            text("""
+                SELECT column_name, data_type FROM information_schema.columns
+                WHERE table_schema = current_schema() AND table_name = lower(:table)
+                ORDER BY ordinal_position
+            """),
+            {"table": table}
+        ).all()
+        if not rows:
+            raise ValueError(f"Таблица {table} не найдена в схеме")
+        columns = {name: data_type for name, data_type in rows if name != TABLES[table]}
+        with _lock:
+            _columns[table] = columns
+    return columns
+
+def validate(conn, table, values):
+    """Проверить поля обновления; вернуть отсортированный кортеж колонок."""
+    if not values:
+        raise ValueError(f"{table}: нет полей для обновления")
+    allowed = updatable_columns(conn, table)
+    unknown = sorted(set(values) - set(allowed))
+    if unknown:
+        raise ValueError(f"{table}: нельзя обновить поля {unknown}; допустимы {sorted(allowed)}")
+    return tuple(sorted(values))
+
+def _cached(key, build):
+    statement = _statements.get(key)
+    if statement is None:
+        statement = text(build())
+        with _lock:
+            _statements.setdefault(key, statement)
+    return statement
+
+def update_statement(table, columns):
+    """UPDATE одной строки по ключу с RETURNING *."""
+    key_column = TABLES[table]
+    return _cached((table, columns, False), lambda: (
+        f"UPDATE {table} SET {', '.join(f'{c} = :{c}' for c in columns)} "
+        f"WHERE {key_column} = :{key_column} RETURNING *"
+    ))
+
+def bulk_update_statement(conn, table, columns):
+    """
+    UPDATE многих строк одним запросом: значения приходят массивами и разворачиваются unnest.
+    (executemany не возвращает строки RETURNING, поэтому массивы, а не executemany)
+    """
+    key_column = TABLES[table]
+    types = updatable_columns(conn, table)
+    return _cached((table, columns, True), lambda: f"""
+        UPDATE {table} t SET {', '.join(f'{c} = v.{c}' for c in columns)}
+        FROM unnest(CAST(:{key_column} AS INT[]),
+                    {', '.join(f'CAST(:{c} AS {types[c]}[])' for c in columns)})
+             AS v({key_column}, {', '.join(columns)})
+        WHERE t.{key_column} = v.{key_column}
+        RETURNING t.*
+    """)
+
+
+# ===== Выполнение =====
+def update_row(conn, table, key, values):
+    """Обновить строку по ключу; вернуть обновлённую строку (dict) или None, если её нет."""
+    columns = validate(conn, table, values)
+    row = conn.execute(update_statement(table, columns), {**values, TABLES[table]: key}).fetchone()
+    return dict(row._mapping) if row else None
+
+def update_rows(conn, table, rows):
+    """
+    Обновить много строк: rows — список словарей с ключом таблицы и полями.
+    Строки с одинаковым набором полей уходят одним запросом. Возвращает обновлённые строки
+    """
+    key_column = TABLES[table]
+    groups, seen = {}, set()
+    for row in rows:
+        if key_column not in row:
+            raise ValueError(f"{table}: в строке обновления нет {key_column}")
+        if row[key_column] in seen:
+            raise ValueError(f"{table}: {key_column}={row[key_column]} встречается дважды")
+        seen.add(row[key_column])
+        values = {k: v for k, v in row.items() if k != key_column}
+        groups.setdefault(validate(conn, table, values), []).append(row)
+    updated = []
+    for columns, group in groups.items():
+        params = {key_column: [row[key_column] for row in group]}
+        for column in columns:
+            params[column] = [row[column] for row in group]
+        result = conn.execute(bulk_update_statement(conn, table, columns), params)
+        updated.extend(dict(r._mapping) for r in result)
+    return updated
+
+def reset():
+    """Забыть схему и запросы (после миграции, меняющей колонки)."""
+    with _lock:
+        _columns.clear()
+        _statements.clear()
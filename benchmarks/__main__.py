@@ -0,0 +1,93 @@
+import argparse
+import json
+
+from app.review_analytics import rebuild_summaries
+from app.settings import configure
+from benchmarks import datagen, workload
+
+# python -m benchmarks generate --orders 100000 --customers 10000
+# python -m benchmarks run --workers 8 --duration 60 --mix customer=70,employee=20,admin=10
+# Подключения берутся из настроек (DATABASE_URL, MONGO_URL, CAFE_CONFIG) — только тестовые базы!
+
+
+def _mix(value):
+    mix = {}
+    for part in value.split(","):
+        name, _, weight = part.partition("=")
+        mix[name.strip()] = float(weight or 1)
+    return mix
+
+def _use_mongomock():
+    """Подменить клиент MongoDB на mongomock (in-memory) — для прогона без сервера."""
+    try:
+        import mongomock
+    except ImportError:
+        raise SystemExit("Для --mongo mock нужен пакет mongomock (pip install mongomock)")
+    from app import db
+    db._mongo_client = mongomock.MongoClient()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks", description="Данные и нагрузочный тест кафе")
+    parser.add_argument("--mongo", choices=["server", "mock", "off"], default="server",
+                        help="server — MongoDB из настроек, mock — mongomock в памяти, off — без MongoDB")
+    parser.add_argument("--pool-size", type=int, help="размер пула Postgres на процесс")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    gen = sub.add_parser("generate", help="сгенерировать синтетический набор данных")
+    gen.add_argument("--branches", type=int, default=10)
+    gen.add_argument("--customers", type=int, default=10000)
+    gen.add_argument("--menu-items", type=int, default=50)
+    gen.add_argument("--suppliers", type=int, default=20)
+    gen.add_argument("--employees-per-branch", type=int, default=8)
+    gen.add_argument("--orders", type=int, default=100000)
+    gen.add_argument("--days", type=int, default=365, help="глубина истории заказов")
+    gen.add_argument("--reviews", type=int, default=20000)
+    gen.add_argument("--logs", type=int, default=100000)
+    gen.add_argument("--seed", type=int, default=42)
+
+    bench = sub.add_parser("run", help="прогнать смесь сценариев и вывести отчёт JSON")
+    bench.add_argument("--workers", type=int, default=4)
+    bench.add_argument("--mode", choices=["threads", "processes"], default="threads")
+    bench.add_argument("--duration", type=float, default=30.0, help="секунд на воркер (0 — без ограничения)")
+    bench.add_argument("--operations", type=int, help="сценариев на воркер")
+    bench.add_argument("--mix", type=_mix, default=workload.DEFAULT_MIX,
+                       help="веса сценариев: customer=70,employee=20,admin=10")
+    bench.add_argument("--seed", type=int, default=1)
+    bench.add_argument("--output", help="записать отчёт в файл")
+
+    args = parser.parse_args(argv)
+    if args.pool_size:
+        configure(pool_size=args.pool_size)
+    if args.mongo == "mock":
+        if args.command == "run" and args.mode == "processes":
+            raise SystemExit("--mongo mock работает только с --mode threads")
+        _use_mongomock()
+
+    if args.command == "generate":
+        report = {"postgres": datagen.generate_postgres(
+            branches=args.branches, customers=args.customers, menu_items=args.menu_items,
+            employees_per_branch=args.employees_per_branch, suppliers=args.suppliers,
+            orders=args.orders, days=args.days, seed=args.seed)}
+        if args.mongo != "off":
+            report["mongo"] = datagen.generate_mongo(reviews=args.reviews, logs=args.logs,
+                                                     days=args.days, seed=args.seed)
+        if args.mongo == "server":
+            # mongomock не поддерживает $merge
+            report["review_summaries"] = rebuild_summaries()
+    else:
+        if not args.duration and not args.operations:
+            parser.error("нужен --duration или --operations")
+        report = workload.run(workers=args.workers, duration=args.duration or None,
+                              operations=args.operations, mix=args.mix, mode=args.mode,
+                              with_mongo=args.mongo != "off", seed=args.seed)
+
+    output = json.dumps(report, ensure_ascii=False, indent=2)
+    if args.command == "run" and args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            f.write(output)
+    print(output)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,242 @@
+import csv
+import io
+import random
+import sys
+from datetime import datetime, timedelta
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from app.db import begin, get_mongo_db
+
+# Генератор синтетических данных кафе заданного масштаба.
+# Postgres заполняется через COPY (явные id, затем setval), MongoDB — через insert_many.
+# Триггеры агрегатов на время загрузки отключены: суммы заказов пишутся готовыми,
+# витрины продаж пересчитываются одним rebuild_sales_rollups() в конце.
+
+COPY_CHUNK_ROWS = 50000
+MONGO_CHUNK_DOCS = 5000
+
+CITIES = ["Amsterdam", "Utrecht", "Rotterdam", "Den Haag", "Eindhoven", "Groningen", "Leiden"]
+FIRST_NAMES = ["Sophie", "Lucas", "Emma", "Daan", "Julia", "Sem", "Anna", "Pieter", "Laura", "Tom",
+               "Mila", "Finn", "Tess", "Noah", "Sara", "Levi"]
+LAST_NAMES = ["de Vries", "Jansen", "Bakker", "Visser", "Smits", "Meijer", "de Boer", "Mulder",
+              "Vermeer", "van Dijk", "Bos", "Vos"]
+POSITIONS = ["Barista", "Barista", "Barista", "Cashier", "Cashier", "Manager"]
+CATEGORIES = [("Coffee", "Freshly brewed coffee drinks"), ("Tea", "Hot and iced teas"),
+              ("Desserts", "Homemade sweets and pastries"), ("Snacks", "Light bites and sandwiches")]
+DRINKS = ["Espresso", "Cappuccino", "Latte", "Flat White", "Americano", "Mocha", "Green Tea",
+          "Chai Latte", "Cheesecake", "Croissant", "Brownie", "Bagel", "Muffin", "Toastie"]
+INGREDIENTS = [("Молоко", "л"), ("Кофе в зёрнах", "кг"), ("Сахар", "кг"), ("Чай", "кг"),
+               ("Мука", "кг"), ("Сливки", "л"), ("Шоколад", "кг"), ("Сыр", "кг")]
+ORDER_STATUSES = ["completed"] * 8 + ["created", "cancelled"]
+PAYMENT_METHODS = ["card", "card", "cash", "online"]
+REVIEW_COMMENTS = ["Очень вкусно!", "Капучино отличный, обслуживание быстрое!",
+                   "Десерт вкусный, но кофе остыл.", "Долго ждали заказ.", "Уютно и чисто.",
+                   "Слишком шумно.", "Лучший латте в городе."]
+LOG_ACTIONS = ["add_customer", "create_order_with_items", "update_order_status",
+               "update_inventory", "create_supply_order", "add_employee"]
+
+
+def _copy(conn, table, columns, rows):
+    """COPY ... FROM STDIN пачками по COPY_CHUNK_ROWS строк; rows — итератор кортежей."""
+    cursor = conn.connection.dbapi_connection.cursor()
+    statement = f"COPY {table} ({', '.join(columns)}) FROM STDIN WITH (FORMAT csv)"
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    count = 0
+    for row in rows:
+        writer.writerow(["" if v is None else v for v in row])
+        count += 1
+        if count % COPY_CHUNK_ROWS == 0:
+            buffer.seek(0)
+            cursor.copy_expert(statement, buffer)
+            buffer.seek(0)
+            buffer.truncate()
+    if buffer.tell():
+        buffer.seek(0)
+        cursor.copy_expert(statement, buffer)
+    return count
+
+def _next_id(conn, table, column):
+    return conn.execute(text(f"SELECT COALESCE(MAX({column}), 0) + 1 FROM {table}")).scalar()
+
+def _sync_sequence(conn, table, column):
+    conn.execute(text(f"""
+        SELECT setval(pg_get_serial_sequence('{table}', '{column}'),
+                      (SELECT COALESCE(MAX({column}), 1) FROM {table}))
+    """))
+
+def _name(rnd):
+    return f"{rnd.choice(FIRST_NAMES)} {rnd.choice(LAST_NAMES)}"
+
+def _progress(message):
+    print(message, file=sys.stderr, flush=True)
+
+
+def generate_postgres(branches=10, customers=10000, menu_items=50, employees_per_branch=8,
+                      suppliers=20, orders=100000, max_lines=4, days=365, seed=42):
+    """
+    Заполнить Postgres: филиалы, сотрудники, клиенты, меню с категориями, поставщики,
+    склад с рецептами, заказы с позициями и платежами. Возвращает число строк по таблицам.
+    """
+    rnd = random.Random(seed)
+    now = datetime.now().replace(microsecond=0)
+    counts = {}
+    with begin() as conn:
+        conn.execute(text("SET LOCAL session_replication_role = replica"))
+        ids = {
+            "branch": _next_id(conn, "CafeBranch", "branch_id"),
+            "employee": _next_id(conn, "Employee", "employee_id"),
+            "customer": _next_id(conn, "Customer", "customer_id"),
+            "category": _next_id(conn, "MenuCategory", "category_id"),
+            "item": _next_id(conn, "MenuItem", "item_id"),
+            "supplier": _next_id(conn, "Supplier", "supplier_id"),
+            "inventory": _next_id(conn, "Inventory", "inventory_id"),
+            "order": _next_id(conn, '"Order"', "order_id"),
+        }
+
+        branch_ids = list(range(ids["branch"], ids["branch"] + branches))
+        counts["CafeBranch"] = _copy(
+            conn, "CafeBranch", ["branch_id", "name", "address", "city", "phone", "open_time", "close_time"],
+            ((b, f"Cafe #{b}", f"{rnd.randint(1, 300)} Main St", rnd.choice(CITIES),
+              f"+31-6{b:08d}", "07:00", "22:00") for b in branch_ids))
+
+        employee_ids = list(range(ids["employee"], ids["employee"] + branches * employees_per_branch))
+        counts["Employee"] = _copy(
+            conn, "Employee", ["employee_id", "name", "position", "hire_date", "salary", "email"],
+            ((e, _name(rnd), rnd.choice(POSITIONS), (now - timedelta(days=rnd.randint(30, 2000))).date(),
+              rnd.randint(2000, 4000), f"employee{e}@coffee.com") for e in employee_ids))
+        staff = {b: employee_ids[i * employees_per_branch:(i + 1) * employees_per_branch]
+                 for i, b in enumerate(branch_ids)}
+        counts["EmployeeBranch"] = _copy(
+            conn, "EmployeeBranch", ["employee_id", "branch_id"],
+            ((e, b) for b, emps in staff.items() for e in emps))
+
+        customer_ids = list(range(ids["customer"], ids["customer"] + customers))
+        counts["Customer"] = _copy(
+            conn, "Customer", ["customer_id", "name", "phone", "email", "loyalty_points"],
+            ((c, _name(rnd), f"+7{c:010d}", f"customer{c}@mail.com", rnd.randint(0, 500))
+             for c in customer_ids))
+
+        category_ids = list(range(ids["category"], ids["category"] + len(CATEGORIES)))
+        counts["MenuCategory"] = _copy(
+            conn, "MenuCategory", ["category_id", "name", "description"],
+            ((c, name, description) for c, (name, description) in zip(category_ids, CATEGORIES)))
+
+        item_ids = list(range(ids["item"], ids["item"] + menu_items))
+        prices = {i: Decimal(rnd.randint(150, 900)) / 100 for i in item_ids}
+        counts["MenuItem"] = _copy(
+            conn, "MenuItem", ["item_id", "name", "description", "price", "calories"],
+            ((i, f"{rnd.choice(DRINKS)} #{i}", "Сгенерировано для нагрузочного теста", prices[i],
+              rnd.randint(5, 600)) for i in item_ids))
+        counts["MenuCategoryItem"] = _copy(
+            conn, "MenuCategoryItem", ["category_id", "item_id"],
+            ((category_ids[n % len(category_ids)], i) for n, i in enumerate(item_ids)))
+
+        supplier_ids = list(range(ids["supplier"], ids["supplier"] + suppliers))
+        counts["Supplier"] = _copy(
+            conn, "Supplier", ["supplier_id", "name", "phone", "email", "address"],
+            ((s, f"Supplier #{s}", f"+31-20{s:07d}", f"supplier{s}@supply.com", rnd.choice(CITIES))
+             for s in supplier_ids))
+        counts["SupplierMenuItem"] = _copy(
+            conn, "SupplierMenuItem", ["supplier_id", "item_id", "supply_price"],
+            ((s, i, (prices[i] * Decimal(rnd.randint(30, 60)) / 100).quantize(Decimal("0.01")))
+             for i in item_ids for s in rnd.sample(supplier_ids, min(3, len(supplier_ids)))))
+
+        inventory = {}
+        next_inventory = ids["inventory"]
+        for b in branch_ids:
+            for name, unit in INGREDIENTS:
+                inventory[(b, name)] = (next_inventory, unit)
+                next_inventory += 1
+        counts["Inventory"] = _copy(
+            conn, "Inventory", ["inventory_id", "branch_id", "item_name", "quantity", "unit"],
+            ((inv_id, b, name, rnd.randint(50, 500), unit) for (b, name), (inv_id, unit) in inventory.items()))
+        recipes = {i: rnd.sample(INGREDIENTS, 2) for i in item_ids}
+        counts["InventoryMenuItem"] = _copy(
+            conn, "InventoryMenuItem", ["inventory_id", "item_id", "quantity_used"],
+            ((inventory[(b, name)][0], i, Decimal(rnd.randint(1, 30)) / 100)
+             for b in branch_ids for i, ingredients in recipes.items() for name, _ in ingredients))
+
+        # Заказы и позиции генерируются вместе: итог заказа известен до вставки
+        order_rows, line_rows, payment_rows = [], [], []
+        weights = [1.0 / (rank + 1) for rank in range(len(item_ids))]  # популярность по Ципфу
+        for order_id in range(ids["order"], ids["order"] + orders):
+            branch_id = rnd.choice(branch_ids)
+            order_time = now - timedelta(seconds=rnd.randint(0, days * 86400))
+            status = rnd.choice(ORDER_STATUSES)
+            total = Decimal("0.00")
+            for item_id in set(rnd.choices(item_ids, weights, k=rnd.randint(1, max_lines))):
+                quantity = rnd.randint(1, 3)
+                line_rows.append((order_id, order_time, item_id, quantity, prices[item_id]))
+                total += prices[item_id] * quantity
+            order_rows.append((order_id, rnd.choice(customer_ids), branch_id, rnd.choice(staff[branch_id]),
+                               order_time, status, total))
+            if status == "completed":
+                payment_rows.append((order_id, order_time, rnd.choice(PAYMENT_METHODS), total, order_time))
+        # секции по месяцам на весь период истории (migrations/005_order_partitions.sql)
+        conn.execute(text("SELECT ensure_order_partitions(:start, :end)"),
+                     {"start": (now - timedelta(days=days)).date(), "end": now.date()})
+        counts["Order"] = _copy(
+            conn, '"Order"',
+            ["order_id", "customer_id", "branch_id", "employee_id", "order_time", "status", "total_amount"],
+            order_rows)
+        counts["OrderItem"] = _copy(conn, "OrderItem", ["order_id", "order_time", "item_id", "quantity", "price"],
+                                    line_rows)
+        counts["Payment"] = _copy(conn, "Payment", ["order_id", "order_time", "method", "amount", "payment_time"],
+                                  payment_rows)
+        _progress(f"Postgres: {counts}")
+
+        for table, column in [("CafeBranch", "branch_id"), ("Employee", "employee_id"),
+                              ("Customer", "customer_id"), ("MenuCategory", "category_id"),
+                              ("MenuItem", "item_id"), ("Supplier", "supplier_id"),
+                              ("Inventory", "inventory_id"), ('"Order"', "order_id"),
+                              ("OrderItem", "order_item_id"), ("Payment", "payment_id")]:
+            _sync_sequence(conn, table, column)
+        conn.execute(text("SET LOCAL session_replication_role = origin"))
+        has_rollups = conn.execute(text("SELECT to_regproc('rebuild_sales_rollups') IS NOT NULL")).scalar()
+        if has_rollups:
+            conn.execute(text("SELECT rebuild_sales_rollups()"))
+    with begin() as conn:
+        conn.execute(text("ANALYZE"))
+    return counts
+
+
+def generate_mongo(reviews=20000, logs=100000, days=365, seed=42):
+    """
+    Отзывы и журнал действий в MongoDB, ссылающиеся на существующих клиентов и филиалы.
+    insert_many обходит инкрементальные сводки — после загрузки нужен rebuild_summaries()
+    """
+    rnd = random.Random(seed)
+    with begin() as conn:
+        customer_max = conn.execute(text("SELECT COALESCE(MAX(customer_id), 1) FROM Customer")).scalar()
+        branch_ids = conn.execute(text("SELECT branch_id FROM CafeBranch")).scalars().all() or [1]
+        item_ids = conn.execute(text("SELECT item_id FROM MenuItem")).scalars().all()
+    now = datetime.utcnow()
+    db = get_mongo_db()
+
+    def chunks(make, total):
+        for start in range(0, total, MONGO_CHUNK_DOCS):
+            yield [make() for _ in range(min(MONGO_CHUNK_DOCS, total - start))]
+
+    def review():
+        rating = rnd.choices([1, 2, 3, 4, 5], [1, 1, 2, 4, 6])[0]
+        return {"customer_id": rnd.randint(1, customer_max), "branch_id": rnd.choice(branch_ids),
+                "rating": rating, "comment": rnd.choice(REVIEW_COMMENTS),
+                "sentiment": max(1, min(5, rating + rnd.randint(-1, 1))),
+                "created_at": now - timedelta(seconds=rnd.randint(0, days * 86400)),
+                **({"item_id": rnd.choice(item_ids)} if item_ids and rnd.random() < 0.5 else {})}
+
+    def log():
+        return {"user_id": rnd.randint(0, customer_max), "action": rnd.choice(LOG_ACTIONS),
+                "details": {"generated": True},
+                "timestamp": now - timedelta(seconds=rnd.randint(0, days * 86400))}
+
+    counts = {"reviews": 0, "logs": 0}
+    for collection, make, total in [("reviews", review, reviews), ("logs", log, logs)]:
+        for docs in chunks(make, total):
+            db[collection].insert_many(docs, ordered=False)
+            counts[collection] += len(docs)
+    _progress(f"MongoDB: {counts}")
+    return counts
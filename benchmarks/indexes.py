@@ -0,0 +1,131 @@
+import argparse
+import json
+import time
+
+from sqlalchemy import text
+
+from app.db import begin
+from app.migrations import EXPECTED_PG_INDEXES
+
+# Сравнение времени частых запросов с индексами из 002_indexes.sql и без них.
+# ВНИМАНИЕ: генерирует данные в текущей базе — запускать только на тестовой (DATABASE_URL).
+# "До" измеряется внутри транзакции, где индексы удалены; транзакция откатывается.
+
+QUERIES = {
+    "get_orders_by_customer": (
+        'SELECT * FROM "Order" WHERE customer_id=:cid ORDER BY order_time DESC',
+        lambda i, n: {"cid": 1 + (i * 7919) % n["customers"]},
+    ),
+    "update_order_total (sum)": (
+        "SELECT SUM(quantity * price) FROM OrderItem WHERE order_id=:id",
+        lambda i, n: {"id": 1 + (i * 104729) % n["orders"]},
+    ),
+    "update_inventory (lookup)": (
+        "SELECT quantity FROM Inventory WHERE branch_id=:b AND item_name=:n",
+        lambda i, n: {"b": 1 + i % n["branches"], "n": f"bench-ingredient-{i % n['ingredients']}"},
+    ),
+    "get_supply_order (items)": (
+        "SELECT * FROM SupplyOrderItem WHERE supply_order_id=:id",
+        lambda i, n: {"id": 1 + (i * 31) % n["supply_orders"]},
+    ),
+    "get_suppliers_by_item": (
+        "SELECT s.* FROM Supplier s JOIN SupplierMenuItem smi ON s.supplier_id = smi.supplier_id "
+        "WHERE smi.item_id=:iid",
+        lambda i, n: {"iid": 1 + i % n["menu_items"]},
+    ),
+    "employees_by_branch": (
+        "SELECT employee_id FROM EmployeeBranch WHERE branch_id=:b",
+        lambda i, n: {"b": 1 + i % n["branches"]},
+    ),
+}
+
+
+def generate(conn, customers, orders, branches=50, menu_items=200, suppliers=100,
+             employees=500, ingredients=50, supply_orders=20000):
+    """Синтетические данные через generate_series (триггеры агрегатов отключены на время вставки)."""
+    conn.execute(text("SET LOCAL session_replication_role = replica"))
+    p = {"customers": customers, "orders": orders, "branches": branches, "menu_items": menu_items,
+         "suppliers": suppliers, "employees": employees, "ingredients": ingredients,
+         "supply_orders": supply_orders}
+    statements = [
+        "INSERT INTO CafeBranch (name, address, city) "
+        "SELECT 'bench-branch-' || g, 'Street ' || g, 'City' FROM generate_series(1, :branches) g",
+        "INSERT INTO MenuItem (name, price, calories) "
+        "SELECT 'bench-item-' || g, round((1 + random() * 9)::numeric, 2), 100 FROM generate_series(1, :menu_items) g",
+        "INSERT INTO Supplier (name) SELECT 'bench-supplier-' || g FROM generate_series(1, :suppliers) g",
+        "INSERT INTO Employee (name, position) SELECT 'bench-emp-' || g, 'Barista' FROM generate_series(1, :employees) g",
+        "INSERT INTO Customer (name, phone, email) "
+        "SELECT 'bench-customer-' || g, 'bench-' || g, 'c' || g || '@bench' FROM generate_series(1, :customers) g",
+        "INSERT INTO EmployeeBranch (employee_id, branch_id) "
+        "SELECT e.employee_id, 1 + e.employee_id % :branches FROM Employee e ON CONFLICT DO NOTHING",
+        "INSERT INTO SupplierMenuItem (supplier_id, item_id, supply_price) "
+        "SELECT s.supplier_id, mi.item_id, mi.price / 2 FROM Supplier s "
+        "JOIN MenuItem mi ON mi.item_id % :suppliers = s.supplier_id % :suppliers ON CONFLICT DO NOTHING",
+        "INSERT INTO Inventory (branch_id, item_name, quantity, unit) "
+        "SELECT b.branch_id, 'bench-ingredient-' || g, 1000, 'kg' "
+        "FROM CafeBranch b CROSS JOIN generate_series(0, :ingredients - 1) g",
+        "SELECT ensure_order_partitions((NOW() - interval '731 days')::date, NOW()::date)",
+        'INSERT INTO "Order" (customer_id, branch_id, employee_id, order_time, status, total_amount) '
+        "SELECT 1 + (random() * (:customers - 1))::int, 1 + g % :branches, NULL, "
+        "NOW() - random() * interval '730 days', 'completed', 0 FROM generate_series(1, :orders) g",
+        "INSERT INTO OrderItem (order_id, order_time, item_id, quantity, price) "
+        'SELECT o.order_id, o.order_time, 1 + (o.order_id * k) % :menu_items, 1 + k, 3.00 '
+        'FROM "Order" o CROSS JOIN generate_series(1, 3) k',
+        "INSERT INTO SupplyOrder (supplier_id, branch_id) "
+        "SELECT 1 + g % :suppliers, 1 + g % :branches FROM generate_series(1, :supply_orders) g",
+        "INSERT INTO SupplyOrderItem (supply_order_id, item_id, quantity) "
+        "SELECT so.supply_order_id, 1 + (so.supply_order_id * k) % :menu_items, 10 "
+        "FROM SupplyOrder so CROSS JOIN generate_series(1, 4) k",
+    ]
+    for statement in statements:
+        conn.execute(text(statement), p)
+    conn.execute(text("SET LOCAL session_replication_role = origin"))
+    conn.execute(text("SELECT rebuild_sales_rollups()"))
+    conn.execute(text("ANALYZE"))
+    return p
+
+def _count(conn, table):
+    return conn.execute(text(f"SELECT MAX({table[1]}) FROM {table[0]}")).scalar() or 1
+
+def measure(conn, repeats):
+    sizes = {
+        "customers": _count(conn, ("Customer", "customer_id")),
+        "orders": _count(conn, ('"Order"', "order_id")),
+        "branches": _count(conn, ("CafeBranch", "branch_id")),
+        "menu_items": _count(conn, ("MenuItem", "item_id")),
+        "supply_orders": _count(conn, ("SupplyOrder", "supply_order_id")),
+        "ingredients": 50,
+    }
+    timings = {}
+    for name, (sql, params) in QUERIES.items():
+        statement = text(sql)
+        started = time.perf_counter()
+        for i in range(repeats):
+            conn.execute(statement, params(i, sizes)).fetchall()
+        timings[name] = (time.perf_counter() - started) / repeats * 1000
+    return timings
+
+def run(repeats=50, generate_rows=None):
+    if generate_rows:
+        with begin() as conn:
+            generate(conn, customers=generate_rows // 4, orders=generate_rows)
+    with begin() as conn:
+        after = measure(conn, repeats)
+    with begin() as conn:
+        conn.execute(text("ALTER TABLE Inventory DROP CONSTRAINT IF EXISTS inventory_branch_item_key"))
+        for name in EXPECTED_PG_INDEXES:
+            conn.execute(text(f"DROP INDEX IF EXISTS {name}"))
+        before = measure(conn, repeats)
+        conn.rollback()
+    return {name: {"before_ms": round(before[name], 3), "after_ms": round(after[name], 3),
+                   "speedup": round(before[name] / after[name], 1) if after[name] else None}
+            for name in QUERIES}
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк индексов: до/после 002_indexes.sql")
+    parser.add_argument("--generate", type=int, default=0, metavar="ORDERS",
+                        help="сначала сгенерировать столько заказов (и ORDERS/4 клиентов)")
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeats, args.generate), ensure_ascii=False, indent=2))
@@ -0,0 +1,175 @@
+import argparse
+import json
+import time
+from datetime import date, datetime, timedelta
+
+from sqlalchemy import text
+
+from app.db import begin, get_engine
+
+# Секционированные заказы (005_order_partitions.sql) против той же истории в обычных таблицах.
+# ВНИМАНИЕ: --generate дописывает заказы в текущую базу — запускать только на тестовой (DATABASE_URL).
+# Обычные копии (bench_flat_order, bench_flat_orderitem) создаются на время прогона и удаляются;
+# удаление старого месяца (DELETE против DETACH + DROP) измеряется в откатываемой транзакции.
+
+FLAT_ORDER = "bench_flat_order"
+FLAT_ITEM = "bench_flat_orderitem"
+
+# Границы дат — параметрами, как их передают get_orders(since=...) и get_orders_by_customer:
+# psycopg2 подставляет значения в текст запроса, и лишние секции отсекаются ещё при планировании
+QUERIES = {
+    "branch_last_7_days": (
+        "SELECT COUNT(*), SUM(total_amount) FROM {order} WHERE branch_id = :b AND order_time >= :since",
+        lambda i, n: {"b": n["branch_ids"][i % len(n["branch_ids"])], "since": n["now"] - timedelta(days=7)},
+    ),
+    "customer_last_90_days": (
+        "SELECT * FROM {order} WHERE customer_id = :cid AND order_time >= :since ORDER BY order_time DESC",
+        lambda i, n: {"cid": 1 + (i * 7919) % n["customers"], "since": n["now"] - timedelta(days=90)},
+    ),
+    "month_revenue": (
+        "SELECT SUM(oi.quantity * oi.price) FROM {order} o "
+        "JOIN {item} oi ON oi.order_id = o.order_id AND oi.order_time = o.order_time "
+        "WHERE o.order_time >= :since AND o.order_time < :until "
+        # диапазон переносится через соединение только явно: иначе позиции читаются из всех секций
+        "AND oi.order_time >= :since AND oi.order_time < :until",
+        lambda i, n: {"since": n["last_month"], "until": n["this_month"]},
+    ),
+}
+
+
+def generate(conn, orders, years):
+    """
+    Заказы за years лет через generate_series по существующим клиентам, филиалам и меню
+    (триггеры агрегатов отключены на время вставки)
+    """
+    conn.execute(text("SET LOCAL session_replication_role = replica"))
+    p = {"orders": orders, "days": years * 365}
+    for statement in [
+        "SELECT ensure_order_partitions((NOW() - make_interval(days => :days))::date, NOW()::date)",
+        'INSERT INTO "Order" (customer_id, branch_id, order_time, status, total_amount) '
+        "SELECT c.ids[1 + g % cardinality(c.ids)], b.ids[1 + (g * 7) % cardinality(b.ids)], "
+        "NOW() - random() * make_interval(days => :days), 'completed', 0 "
+        "FROM generate_series(1, :orders) g, "
+        "(SELECT array_agg(customer_id) AS ids FROM Customer) c, "
+        "(SELECT array_agg(branch_id) AS ids FROM CafeBranch) b",
+        "INSERT INTO OrderItem (order_id, order_time, item_id, quantity, price) "
+        "SELECT o.order_id, o.order_time, m.ids[1 + (o.order_id * k) % cardinality(m.ids)], 1 + k, 3.00 "
+        'FROM "Order" o CROSS JOIN generate_series(1, 3) k, '
+        "(SELECT array_agg(item_id) AS ids FROM MenuItem) m "
+        "WHERE o.order_id > (SELECT COALESCE(MAX(order_id), 0) FROM OrderItem)",
+    ]:
+        conn.execute(text(statement), p)
+    conn.execute(text("SET LOCAL session_replication_role = origin"))
+    conn.execute(text("SELECT rebuild_sales_rollups()"))
+
+def _create_flat(conn):
+    conn.execute(text(f'CREATE TABLE {FLAT_ORDER} AS SELECT * FROM "Order"'))
+    conn.execute(text(f"CREATE TABLE {FLAT_ITEM} AS SELECT * FROM OrderItem"))
+    for statement in [
+        f"ALTER TABLE {FLAT_ORDER} ADD PRIMARY KEY (order_id)",
+        f"ALTER TABLE {FLAT_ITEM} ADD PRIMARY KEY (order_item_id)",
+        f"CREATE INDEX ON {FLAT_ORDER} (customer_id, order_time DESC)",
+        f"CREATE INDEX ON {FLAT_ORDER} (branch_id, order_time)",
+        f"CREATE INDEX ON {FLAT_ORDER} (order_time)",
+        f"CREATE INDEX ON {FLAT_ITEM} (order_id, order_time)",
+        f"CREATE INDEX ON {FLAT_ITEM} (item_id)",
+        f"ANALYZE {FLAT_ORDER}",
+        f"ANALYZE {FLAT_ITEM}",
+    ]:
+        conn.execute(text(statement))
+
+def _sizes(conn):
+    row = conn.execute(text("""
+        SELECT MAX(customer_id) AS customers, COUNT(*) AS orders, MIN(order_time)::date AS first_day
+        FROM "Order"
+    """)).one()
+    sizes = dict(row._mapping)
+    sizes["branch_ids"] = conn.execute(text("SELECT branch_id FROM CafeBranch ORDER BY 1")).scalars().all()
+    sizes["now"] = datetime.now()
+    sizes["this_month"] = datetime(sizes["now"].year, sizes["now"].month, 1)
+    sizes["last_month"] = (sizes["this_month"] - timedelta(days=1)).replace(day=1)
+    return sizes
+
+def measure(conn, tables, sizes, repeats):
+    timings = {}
+    for name, (sql, params) in QUERIES.items():
+        statement = text(sql.format(**tables))
+        conn.execute(statement, params(0, sizes)).fetchall()  # прогрев кэша
+        started = time.perf_counter()
+        for i in range(repeats):
+            conn.execute(statement, params(i, sizes)).fetchall()
+        timings[name] = (time.perf_counter() - started) / repeats * 1000
+    return timings
+
+def _vacuum(tables):
+    engine = get_engine().execution_options(isolation_level="AUTOCOMMIT")
+    with engine.connect() as conn:
+        started = time.perf_counter()
+        for table in tables:
+            conn.execute(text(f"VACUUM (ANALYZE) {table}"))
+        return (time.perf_counter() - started) * 1000
+
+def _drop_month(month):
+    """Удаление месяца: DELETE из обычных таблиц и DETACH + DROP секций (откат)."""
+    month_end = date(month.year + month.month // 12, month.month % 12 + 1, 1)
+    suffix = f"{month:%Y_%m}"
+    timings = {}
+    with begin() as conn:
+        started = time.perf_counter()
+        bounds = {"start": month, "end": month_end}
+        conn.execute(text(f"DELETE FROM {FLAT_ITEM} WHERE order_time >= :start AND order_time < :end"), bounds)
+        deleted = conn.execute(text(f"DELETE FROM {FLAT_ORDER} WHERE order_time >= :start AND order_time < :end"),
+                               bounds).rowcount
+        timings["flat_delete_ms"] = (time.perf_counter() - started) * 1000
+        conn.rollback()
+    with begin() as conn:
+        started = time.perf_counter()
+        for parent, table in [("Payment", "payment"), ("OrderItem", "orderitem"), ('"Order"', "order")]:
+            conn.execute(text(f"ALTER TABLE {parent} DETACH PARTITION {table}_p{suffix}"))
+            conn.execute(text(f"DROP TABLE {table}_p{suffix}"))
+        timings["partition_drop_ms"] = (time.perf_counter() - started) * 1000
+        conn.rollback()
+    return dict(timings, month=f"{month:%Y-%m}", orders=deleted)
+
+def run(repeats=50, generate_orders=0, years=3):
+    if generate_orders:
+        with begin() as conn:
+            generate(conn, generate_orders, years)
+    with begin() as conn:
+        _create_flat(conn)
+    try:
+        with begin() as conn:
+            sizes = _sizes(conn)
+            partitioned = measure(conn, {"order": '"Order"', "item": "OrderItem"}, sizes, repeats)
+            flat = measure(conn, {"order": FLAT_ORDER, "item": FLAT_ITEM}, sizes, repeats)
+            partitions = conn.execute(text(
+                """SELECT COUNT(*) FROM pg_inherits WHERE inhparent = '"Order"'::regclass""")).scalar()
+        report = {
+            "orders": sizes["orders"], "partitions": partitions,
+            "queries": {name: {"flat_ms": round(flat[name], 3), "partitioned_ms": round(partitioned[name], 3),
+                               "speedup": round(flat[name] / partitioned[name], 1) if partitioned[name] else None}
+                        for name in QUERIES},
+            # в рабочей базе обычно меняется только текущий месяц: VACUUM его секций против всей таблицы
+            "vacuum": {"flat_ms": round(_vacuum([FLAT_ORDER, FLAT_ITEM]), 1),
+                       "current_month_ms": round(_vacuum([f"order_p{date.today():%Y_%m}",
+                                                          f"orderitem_p{date.today():%Y_%m}"]), 1)},
+        }
+        if sizes["first_day"] is not None:
+            # первый полный месяц: самый старый обычно неполный
+            month = (sizes["first_day"].replace(day=1) + timedelta(days=32)).replace(day=1)
+            report["drop_oldest_month"] = {k: round(v, 1) if isinstance(v, float) else v
+                                           for k, v in _drop_month(month).items()}
+        return report
+    finally:
+        with begin() as conn:
+            conn.execute(text(f"DROP TABLE IF EXISTS {FLAT_ITEM}, {FLAT_ORDER}"))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарк секций заказов: обычные таблицы против секций по месяцам")
+    parser.add_argument("--generate", type=int, default=0, metavar="ORDERS",
+                        help="сначала дописать столько заказов (по 3 позиции) за --years лет")
+    parser.add_argument("--years", type=int, default=3)
+    parser.add_argument("--repeats", type=int, default=50)
+    args = parser.parse_args()
+    print(json.dumps(run(args.repeats, args.generate, args.years), ensure_ascii=False, indent=2))
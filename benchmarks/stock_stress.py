@@ -0,0 +1,115 @@
+import argparse
+import json
+import random
+import threading
+import time
+from collections import Counter
+from decimal import Decimal
+
+from sqlalchemy import text
+
+from app import crud_postgres as pg
+from app.db import begin, connect
+
+# Стресс-тест списания ингредиентов: много параллельных заказов в одном филиале
+# с пересекающимися рецептами. Проверяет, что нет взаимоблокировок, остатки не уходят
+# в минус и итог по складу совпадает с суммой рецептов подтверждённых заказов.
+# Создаёт отдельный филиал и пункты меню — запускать на тестовой базе.
+
+INGREDIENTS = [("stress-milk", "л"), ("stress-coffee", "кг"), ("stress-sugar", "кг"), ("stress-cream", "л")]
+
+
+def setup(stock, items=6, seed=7):
+    """Филиал со складом по stock единиц каждого ингредиента и пункты меню с рецептами."""
+    rnd = random.Random(seed)
+    with begin() as conn:
+        branch_id = conn.execute(text("""
+            INSERT INTO CafeBranch (name, address, city) VALUES ('Stress test', '-', '-')
+            RETURNING branch_id
+        """)).scalar()
+        inventory_ids = [conn.execute(text("""
+            INSERT INTO Inventory (branch_id, item_name, quantity, unit) VALUES (:b, :n, :q, :u)
+            RETURNING inventory_id
+        """), {"b": branch_id, "n": name, "q": stock, "u": unit}).scalar() for name, unit in INGREDIENTS]
+        item_ids = []
+        for n in range(items):
+            item_id = conn.execute(text("""
+                INSERT INTO MenuItem (name, price, calories) VALUES (:n, 3.00, 100) RETURNING item_id
+            """), {"n": f"Stress item {n}"}).scalar()
+            item_ids.append(item_id)
+            # разные рецепты задевают разные подмножества строк склада в разном порядке
+            for inventory_id in rnd.sample(inventory_ids, rnd.randint(2, len(inventory_ids))):
+                conn.execute(text("""
+                    INSERT INTO InventoryMenuItem (inventory_id, item_id, quantity_used) VALUES (:i, :m, :q)
+                """), {"i": inventory_id, "m": item_id, "q": Decimal(rnd.randint(1, 5)) / 10})
+        customer_id = conn.execute(text("SELECT MIN(customer_id) FROM Customer")).scalar()
+    return branch_id, inventory_ids, item_ids, customer_id
+
+def run(threads=16, orders_per_thread=50, stock=500, on_shortage="flag", seed=7):
+    branch_id, inventory_ids, item_ids, customer_id = setup(stock, seed=seed)
+    outcomes = Counter()
+    errors = []
+    lock = threading.Lock()
+
+    def worker(n):
+        rnd = random.Random(seed * 1000 + n)
+        for _ in range(orders_per_thread):
+            items = [(i, rnd.randint(1, 3)) for i in rnd.sample(item_ids, rnd.randint(1, 3))]
+            try:
+                order = pg.create_order_with_items(customer_id, branch_id, None, items,
+                                                   deduct_stock=True, on_shortage=on_shortage)
+                result = order["status"]
+            except pg.StockShortage:
+                result = "rejected"
+            except Exception as e:
+                result = "error"
+                with lock:
+                    errors.append(repr(e))
+            with lock:
+                outcomes[result] += 1
+
+    started = time.perf_counter()
+    pool = [threading.Thread(target=worker, args=(n,)) for n in range(threads)]
+    for t in pool:
+        t.start()
+    for t in pool:
+        t.join()
+    elapsed = time.perf_counter() - started
+
+    with connect() as conn:
+        final = dict(conn.execute(text("""
+            SELECT inventory_id, quantity FROM Inventory WHERE inventory_id = ANY(:ids)
+        """), {"ids": inventory_ids}).all())
+        consumed = dict(conn.execute(text("""
+            SELECT imi.inventory_id, COALESCE(SUM(oi.quantity * imi.quantity_used), 0)
+            FROM "Order" o
+            JOIN OrderItem oi ON oi.order_id = o.order_id AND oi.order_time = o.order_time
+            JOIN InventoryMenuItem imi ON imi.item_id = oi.item_id
+            WHERE o.branch_id = :b AND o.status = :confirmed AND imi.inventory_id = ANY(:ids)
+            GROUP BY imi.inventory_id
+        """), {"b": branch_id, "confirmed": pg.STATUS_CONFIRMED, "ids": inventory_ids}).all())
+    mismatches = {i: {"expected": str(stock - consumed.get(i, 0)), "actual": str(final[i])}
+                  for i in inventory_ids if final[i] != stock - consumed.get(i, 0)}
+    return {
+        "branch_id": branch_id,
+        "orders": threads * orders_per_thread,
+        "elapsed_s": round(elapsed, 3),
+        "orders_per_s": round(threads * orders_per_thread / elapsed, 2),
+        "outcomes": dict(outcomes),
+        "errors": errors[:10],
+        "negative_stock": [i for i in inventory_ids if final[i] < 0],
+        "mismatches": mismatches,
+        "ok": not errors and not mismatches and all(final[i] >= 0 for i in inventory_ids),
+    }
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Параллельные заказы со списанием ингредиентов")
+    parser.add_argument("--threads", type=int, default=16)
+    parser.add_argument("--orders", type=int, default=50, help="заказов на поток")
+    parser.add_argument("--stock", type=int, default=500, help="начальный остаток каждого ингредиента")
+    parser.add_argument("--on-shortage", choices=[pg.SHORTAGE_REJECT, pg.SHORTAGE_FLAG], default=pg.SHORTAGE_FLAG)
+    args = parser.parse_args()
+    report = run(args.threads, args.orders, args.stock, args.on_shortage)
+    print(json.dumps(report, ensure_ascii=False, indent=2))
+    raise SystemExit(0 if report["ok"] else 1)
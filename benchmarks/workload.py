@@ -0,0 +1,175 @@
+import random
+import time
+import uuid
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+from sqlalchemy import text
+
+from app import crud_mongo, crud_postgres as pg
+from app.db import connect
+
+# Нагрузочный сценарий: взвешенная смесь действий клиента, сотрудника и администратора
+# (те же операции, что в main.py), выполняемая из нескольких потоков или процессов.
+# Латентность меряется отдельно для каждой вызванной CRUD-функции.
+
+DEFAULT_MIX = {"customer": 70, "employee": 20, "admin": 10}
+
+
+class Recorder:
+    """Латентности вызовов по имени функции (секунды) и счётчик ошибок."""
+
+    def __init__(self):
+        self.latencies = defaultdict(list)
+        self.errors = defaultdict(int)
+
+    def call(self, fn, *args, **kwargs):
+        started = time.perf_counter()
+        try:
+            return fn(*args, **kwargs)
+        except Exception:
+            self.errors[fn.__name__] += 1
+            raise
+        finally:
+            self.latencies[fn.__name__].append(time.perf_counter() - started)
+
+    def merge(self, other):
+        for name, values in other.latencies.items():
+            self.latencies[name].extend(values)
+        for name, count in other.errors.items():
+            self.errors[name] += count
+
+
+def load_context():
+    """Диапазоны id и справочники, из которых сценарии выбирают случайные значения."""
+    with connect() as conn:
+        def ids(query):
+            return conn.execute(text(query)).scalars().all()
+        return {
+            "customers": ids("SELECT customer_id FROM Customer"),
+            "branches": ids("SELECT branch_id FROM CafeBranch"),
+            "items": ids("SELECT item_id FROM MenuItem WHERE is_available"),
+            "suppliers": ids("SELECT supplier_id FROM Supplier"),
+            "employees": ids("SELECT employee_id FROM Employee WHERE is_active"),
+            "orders": ids('SELECT order_id FROM "Order" ORDER BY order_id DESC LIMIT 10000'),
+            "inventory": [tuple(r) for r in conn.execute(text("SELECT branch_id, item_name FROM Inventory"))],
+        }
+
+
+# ===== Сценарии =====
+def customer_session(rec, ctx, rnd, with_mongo):
+    rec.call(pg.get_menu_items)
+    rec.call(pg.get_branches)
+    customer_id = rnd.choice(ctx["customers"])
+    branch_id = rnd.choice(ctx["branches"])
+    if rnd.random() < 0.1:
+        new_id = rec.call(pg.add_customer, "Load Test", f"+0{uuid.uuid4().int % 10 ** 15:015d}", "load@test.com")
+        rec.call(pg.update_customer, customer_id=new_id, email="load_new@test.com")
+        rec.call(pg.delete_customer, customer_id=new_id)
+    items = [(item_id, rnd.randint(1, 3)) for item_id in rnd.sample(ctx["items"], min(rnd.randint(1, 3), len(ctx["items"])))]
+    order = rec.call(pg.create_order_with_items, customer_id, branch_id, rnd.choice(ctx["employees"]), items)
+    ctx["orders"].append(order["order_id"])
+    rec.call(pg.get_orders_by_customer, customer_id)
+    if with_mongo:
+        if rnd.random() < 0.3:
+            rec.call(crud_mongo.add_review, customer_id, branch_id, rnd.randint(1, 5), "Нагрузочный отзыв",
+                     rnd.randint(1, 5), item_id=items[0][0])
+        rec.call(crud_mongo.get_reviews, branch_id, limit=20)
+
+def employee_session(rec, ctx, rnd, with_mongo):
+    rec.call(pg.get_customers, after_id=rnd.choice(ctx["customers"]), limit=50)
+    order_id = rnd.choice(ctx["orders"])
+    rec.call(pg.update_order_status, order_id, rnd.choice(["paid", "completed"]))
+    rec.call(pg.get_order, order_id)
+    branch_id = rnd.choice(ctx["branches"])
+    if ctx["suppliers"]:
+        supply_id = rec.call(pg.create_supply_order, rnd.choice(ctx["suppliers"]), branch_id)
+        for item_id in rnd.sample(ctx["items"], min(2, len(ctx["items"]))):
+            rec.call(pg.add_item_to_supply, supply_id, item_id, rnd.randint(5, 20))
+        rec.call(pg.get_supply_order, supply_id)
+    rec.call(pg.get_supply_orders, branch_id=branch_id, limit=50)
+    if ctx["inventory"]:
+        inv_branch, item_name = rnd.choice(ctx["inventory"])
+        rec.call(pg.update_inventory, inv_branch, item_name, rnd.choice([-1, 1]))
+    rec.call(pg.get_inventory, branch_id=branch_id, limit=100)
+
+def admin_session(rec, ctx, rnd, with_mongo):
+    emp_id = rec.call(pg.add_employee, "Load Test", "Barista", "2025-10-23", 1200, "load@coffee.com")
+    rec.call(pg.get_employees, limit=100)
+    rec.call(pg.update_employee, employee_id=emp_id, salary=35000, position="Старший бариста")
+    rec.call(pg.remove_employee, employee_id=emp_id)
+    rec.call(pg.get_orders, branch_id=rnd.choice(ctx["branches"]), limit=100)
+    if with_mongo:
+        rec.call(crud_mongo.log_action, 0, "load_test", {"employee_id": emp_id})
+
+SESSIONS = {"customer": customer_session, "employee": employee_session, "admin": admin_session}
+
+
+# ===== Запуск =====
+def _worker(worker_id, duration, operations, mix, with_mongo, seed):
+    rnd = random.Random(seed + worker_id)
+    ctx = load_context()
+    rec = Recorder()
+    names, weights = zip(*mix.items())
+    deadline = time.perf_counter() + duration if duration else None
+    done = failed = 0
+    while (deadline is None or time.perf_counter() < deadline) and (operations is None or done < operations):
+        try:
+            SESSIONS[rnd.choices(names, weights)[0]](rec, ctx, rnd, with_mongo)
+        except Exception:
+            failed += 1
+        done += 1
+    if with_mongo:
+        crud_mongo.flush_logs(timeout=10)
+    return rec, done, failed
+
+def _process_worker(args):
+    return _worker(*args)
+
+def percentile(sorted_values, q):
+    if not sorted_values:
+        return None
+    index = min(len(sorted_values) - 1, max(0, round(q / 100 * len(sorted_values)) - 1))
+    return sorted_values[index]
+
+def run(workers=4, duration=30.0, operations=None, mix=None, mode="threads", with_mongo=True, seed=1):
+    """
+    Прогнать смесь сценариев; duration — секунд на воркер, operations — сценариев на воркер.
+    Возвращает отчёт: общая пропускная способность и p50/p95/p99 (мс) по каждой функции
+    """
+    mix = {name: weight for name, weight in (mix or DEFAULT_MIX).items() if weight > 0}
+    unknown = set(mix) - set(SESSIONS)
+    if unknown:
+        raise ValueError(f"Неизвестные сценарии: {sorted(unknown)}")
+    if mode not in ("threads", "processes"):
+        raise ValueError("mode должен быть threads или processes")
+    pool_class = ThreadPoolExecutor if mode == "threads" else ProcessPoolExecutor
+    args = [(i, duration, operations, mix, with_mongo, seed) for i in range(workers)]
+    started = time.perf_counter()
+    with pool_class(max_workers=workers) as pool:
+        results = list(pool.map(_process_worker, args))
+    elapsed = time.perf_counter() - started
+
+    total = Recorder()
+    sessions = failed_sessions = 0
+    for rec, done, failed in results:
+        total.merge(rec)
+        sessions += done
+        failed_sessions += failed
+    calls = sum(len(v) for v in total.latencies.values())
+    functions = {}
+    for name, values in sorted(total.latencies.items()):
+        values.sort()
+        functions[name] = {
+            "calls": len(values),
+            "errors": total.errors.get(name, 0),
+            "throughput": round(len(values) / elapsed, 2),
+            "mean_ms": round(sum(values) / len(values) * 1000, 3),
+            **{f"p{q}_ms": round(percentile(values, q) * 1000, 3) for q in (50, 95, 99)},
+        }
+    return {
+        "mode": mode, "workers": workers, "mix": mix, "elapsed_s": round(elapsed, 3),
+        "sessions": sessions, "failed_sessions": failed_sessions,
+        "sessions_per_s": round(sessions / elapsed, 2), "calls_per_s": round(calls / elapsed, 2),
+        "functions": functions,
+    }
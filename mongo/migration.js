@@ -19,13 +19,38 @@ db.feedback.insertMany([
   }
 ]);
 
+// Бакет истории: один документ на заказ, переходы дописывает app/order_feed.py
 db.order_history.insertOne({
   order_id: 1,
+  branch_id: 1,
   status_changes: [
-    { status: "created", timestamp: new Date(Date.now() - 600000) },
-    { status: "paid", timestamp: new Date(Date.now() - 500000) },
-    { status: "completed", timestamp: new Date() }
-  ]
+    { status: "created", previous_status: null, timestamp: new Date(Date.now() - 600000) },
+    { status: "paid", previous_status: "created", timestamp: new Date(Date.now() - 500000) },
+    { status: "completed", previous_status: "paid", timestamp: new Date() }
+  ],
+  updated_at: new Date()
 });
 
+// Индексы (те же, что создаёт crud_mongo.ensure_indexes)
+db.reviews.createIndex({ branch_id: 1, created_at: -1 });
+db.reviews.createIndex({ item_id: 1, created_at: -1 }, { sparse: true });
+db.reviews.createIndex({ created_at: -1 });
+db.reviews.createIndex({ comment: "text" }, { name: "comment_text", default_language: "russian" });
+db.review_summary_daily.createIndex({ day: 1 }, { expireAfterSeconds: 31 * 86400 });
+db.review_summary_daily.createIndex({ scope: 1, ref_id: 1, day: 1 });
+db.logs.createIndex({ timestamp: -1 });
+db.logs.createIndex({ user_id: 1, timestamp: -1 });
+db.logs.createIndex({ action: 1, timestamp: -1 });
+db.logs.createIndex({ log_id: 1 }, { unique: true, sparse: true });
+
+// Архив журнала: time-series коллекция, записи старше года удаляет TTL
+db.createCollection("logs_archive", {
+  timeseries: { timeField: "timestamp", metaField: "meta", granularity: "minutes" },
+  expireAfterSeconds: 365 * 86400
+});
+db.logs_archive.createIndex({ "meta.user_id": 1, timestamp: -1 });
+db.logs_archive.createIndex({ "meta.action": 1, timestamp: -1 });
+db.order_history.createIndex({ order_id: 1 }, { unique: true });
+db.order_history.createIndex({ branch_id: 1, updated_at: -1 });
+
 print("MongoDB initialized successfully!");
@@ -0,0 +1,216 @@
+-- ==============================
+--  Инкрементальные агрегаты продаж
+-- ==============================
+-- Итог заказа ("Order".total_amount) и продажи филиалов по дням поддерживаются
+-- триггерами как дельты: вставка/удаление/изменение позиций, удаление заказа,
+-- смена статуса. Отменённые заказы (status = 'cancelled') в продажи не входят.
+-- Сверка с базовыми таблицами: SELECT rebuild_sales_rollups();
+-- (или python -m app.sales_rollups rebuild)
+
+-- Продажи филиала за день
+CREATE TABLE IF NOT EXISTS BranchDailySales (
+    branch_id INT REFERENCES CafeBranch(branch_id) ON DELETE CASCADE,
+    sales_date DATE,
+    orders_count INT NOT NULL DEFAULT 0,
+    revenue NUMERIC(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (branch_id, sales_date)
+);
+
+-- Продажи пункта меню в филиале за день
+-- (без FK на MenuItem: удаление пункта меню не должно ломать применение дельт)
+CREATE TABLE IF NOT EXISTS BranchDailyItemSales (
+    branch_id INT REFERENCES CafeBranch(branch_id) ON DELETE CASCADE,
+    sales_date DATE,
+    item_id INT,
+    quantity INT NOT NULL DEFAULT 0,
+    revenue NUMERIC(14,2) NOT NULL DEFAULT 0,
+    PRIMARY KEY (branch_id, sales_date, item_id)
+);
+
+-- ===== Применение дельт по позициям заказов =====
+-- Строки агрегатов обновляются в порядке ключа, чтобы параллельные заказы не ловили deadlock
+CREATE OR REPLACE FUNCTION rollup_apply_item_deltas(
+    p_order_ids INT[], p_item_ids INT[], p_quantities INT[], p_amounts NUMERIC[]
+) RETURNS void AS $$
+BEGIN
+    UPDATE "Order" o
+    SET total_amount = o.total_amount + d.amount
+    FROM (
+        SELECT order_id, SUM(amount) AS amount
+        FROM unnest(p_order_ids, p_amounts) AS u(order_id, amount)
+        GROUP BY order_id
+    ) d
+    WHERE o.order_id = d.order_id AND d.amount <> 0;
+
+    INSERT INTO BranchDailySales AS s (branch_id, sales_date, orders_count, revenue)
+    SELECT o.branch_id, o.order_time::date, 0, COALESCE(SUM(u.amount), 0)
+    FROM unnest(p_order_ids, p_amounts) AS u(order_id, amount)
+    JOIN "Order" o ON o.order_id = u.order_id
+    WHERE o.branch_id IS NOT NULL AND o.status IS DISTINCT FROM 'cancelled'
+    GROUP BY o.branch_id, o.order_time::date
+    ORDER BY 1, 2
+    ON CONFLICT (branch_id, sales_date)
+    DO UPDATE SET revenue = s.revenue + EXCLUDED.revenue;
+
+    INSERT INTO BranchDailyItemSales AS s (branch_id, sales_date, item_id, quantity, revenue)
+    SELECT o.branch_id, o.order_time::date, u.item_id,
+           COALESCE(SUM(u.quantity), 0), COALESCE(SUM(u.amount), 0)
+    FROM unnest(p_order_ids, p_item_ids, p_quantities, p_amounts)
+         AS u(order_id, item_id, quantity, amount)
+    JOIN "Order" o ON o.order_id = u.order_id
+    WHERE o.branch_id IS NOT NULL AND o.status IS DISTINCT FROM 'cancelled'
+      AND u.item_id IS NOT NULL
+    GROUP BY o.branch_id, o.order_time::date, u.item_id
+    ORDER BY 1, 2, 3
+    ON CONFLICT (branch_id, sales_date, item_id)
+    DO UPDATE SET quantity = s.quantity + EXCLUDED.quantity,
+                  revenue = s.revenue + EXCLUDED.revenue;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Statement-level триггер: многострочная вставка позиций даёт одно применение дельт
+CREATE OR REPLACE FUNCTION trg_orderitem_rollup() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM rollup_apply_item_deltas(array_agg(order_id), array_agg(item_id),
+                                         array_agg(quantity), array_agg(quantity * price))
+        FROM new_items;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM rollup_apply_item_deltas(array_agg(order_id), array_agg(item_id),
+                                         array_agg(-quantity), array_agg(-(quantity * price)))
+        FROM old_items;
+    ELSE
+        PERFORM rollup_apply_item_deltas(array_agg(order_id), array_agg(item_id),
+                                         array_agg(quantity), array_agg(amount))
+        FROM (
+            SELECT order_id, item_id, quantity, quantity * price AS amount FROM new_items
+            UNION ALL
+            SELECT order_id, item_id, -quantity, -(quantity * price) FROM old_items
+        ) d;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+-- ===== Заказ целиком: создание, удаление, отмена =====
+CREATE OR REPLACE FUNCTION rollup_apply_order(p_order_id INT, p_sign INT) RETURNS void AS $$
+BEGIN
+    INSERT INTO BranchDailySales AS s (branch_id, sales_date, orders_count, revenue)
+    SELECT o.branch_id, o.order_time::date, p_sign,
+           p_sign * COALESCE((SELECT SUM(quantity * price) FROM OrderItem WHERE order_id = o.order_id), 0)
+    FROM "Order" o
+    WHERE o.order_id = p_order_id AND o.branch_id IS NOT NULL
+    ON CONFLICT (branch_id, sales_date)
+    DO UPDATE SET orders_count = s.orders_count + EXCLUDED.orders_count,
+                  revenue = s.revenue + EXCLUDED.revenue;
+
+    INSERT INTO BranchDailyItemSales AS s (branch_id, sales_date, item_id, quantity, revenue)
+    SELECT o.branch_id, o.order_time::date, oi.item_id,
+           p_sign * SUM(oi.quantity), p_sign * COALESCE(SUM(oi.quantity * oi.price), 0)
+    FROM "Order" o
+    JOIN OrderItem oi ON oi.order_id = o.order_id
+    WHERE o.order_id = p_order_id AND o.branch_id IS NOT NULL AND oi.item_id IS NOT NULL
+    GROUP BY o.branch_id, o.order_time::date, oi.item_id
+    ORDER BY 1, 2, 3
+    ON CONFLICT (branch_id, sales_date, item_id)
+    DO UPDATE SET quantity = s.quantity + EXCLUDED.quantity,
+                  revenue = s.revenue + EXCLUDED.revenue;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_order_rollup() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.status IS DISTINCT FROM 'cancelled' THEN
+            PERFORM rollup_apply_order(NEW.order_id, 1);
+        END IF;
+        RETURN NULL;
+    ELSIF TG_OP = 'DELETE' THEN
+        -- BEFORE DELETE: позиции ещё на месте; каскадное удаление позиций
+        -- заказ уже не найдёт, поэтому дельты не применятся повторно
+        IF OLD.status IS DISTINCT FROM 'cancelled' THEN
+            PERFORM rollup_apply_order(OLD.order_id, -1);
+        END IF;
+        RETURN OLD;
+    END IF;
+    -- смена статуса
+    IF NEW.status = 'cancelled' AND OLD.status IS DISTINCT FROM 'cancelled' THEN
+        PERFORM rollup_apply_order(NEW.order_id, -1);
+    ELSIF OLD.status = 'cancelled' AND NEW.status IS DISTINCT FROM 'cancelled' THEN
+        PERFORM rollup_apply_order(NEW.order_id, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS orderitem_rollup_ins ON OrderItem;
+DROP TRIGGER IF EXISTS orderitem_rollup_del ON OrderItem;
+DROP TRIGGER IF EXISTS orderitem_rollup_upd ON OrderItem;
+DROP TRIGGER IF EXISTS order_rollup_ins ON "Order";
+DROP TRIGGER IF EXISTS order_rollup_del ON "Order";
+DROP TRIGGER IF EXISTS order_rollup_status ON "Order";
+
+CREATE TRIGGER orderitem_rollup_ins AFTER INSERT ON OrderItem
+    REFERENCING NEW TABLE AS new_items
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_orderitem_rollup();
+CREATE TRIGGER orderitem_rollup_del AFTER DELETE ON OrderItem
+    REFERENCING OLD TABLE AS old_items
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_orderitem_rollup();
+CREATE TRIGGER orderitem_rollup_upd AFTER UPDATE ON OrderItem
+    REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_orderitem_rollup();
+
+CREATE TRIGGER order_rollup_ins AFTER INSERT ON "Order"
+    FOR EACH ROW EXECUTE FUNCTION trg_order_rollup();
+CREATE TRIGGER order_rollup_del BEFORE DELETE ON "Order"
+    FOR EACH ROW EXECUTE FUNCTION trg_order_rollup();
+CREATE TRIGGER order_rollup_status AFTER UPDATE OF status ON "Order"
+    FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status)
+    EXECUTE FUNCTION trg_order_rollup();
+
+-- ===== Полная пересборка (сверка с базовыми таблицами) =====
+-- Возвращает число заказов, у которых был исправлен total_amount
+CREATE OR REPLACE FUNCTION rebuild_sales_rollups() RETURNS INT AS $$
+DECLARE
+    fixed_totals INT;
+BEGIN
+    -- на время пересборки запрещаем запись в заказы, чтобы не потерять дельты
+    LOCK TABLE "Order", OrderItem IN SHARE MODE;
+
+    UPDATE "Order" o
+    SET total_amount = t.total
+    FROM (
+        SELECT o2.order_id, COALESCE(SUM(oi.quantity * oi.price), 0) AS total
+        FROM "Order" o2
+        LEFT JOIN OrderItem oi ON oi.order_id = o2.order_id
+        GROUP BY o2.order_id
+    ) t
+    WHERE o.order_id = t.order_id AND o.total_amount IS DISTINCT FROM t.total;
+    GET DIAGNOSTICS fixed_totals = ROW_COUNT;
+
+    DELETE FROM BranchDailySales;
+    DELETE FROM BranchDailyItemSales;
+
+    INSERT INTO BranchDailySales (branch_id, sales_date, orders_count, revenue)
+    SELECT o.branch_id, o.order_time::date, COUNT(DISTINCT o.order_id),
+           COALESCE(SUM(oi.quantity * oi.price), 0)
+    FROM "Order" o
+    LEFT JOIN OrderItem oi ON oi.order_id = o.order_id
+    WHERE o.branch_id IS NOT NULL AND o.status IS DISTINCT FROM 'cancelled'
+    GROUP BY o.branch_id, o.order_time::date;
+
+    INSERT INTO BranchDailyItemSales (branch_id, sales_date, item_id, quantity, revenue)
+    SELECT o.branch_id, o.order_time::date, oi.item_id,
+           SUM(oi.quantity), COALESCE(SUM(oi.quantity * oi.price), 0)
+    FROM "Order" o
+    JOIN OrderItem oi ON oi.order_id = o.order_id
+    WHERE o.branch_id IS NOT NULL AND o.status IS DISTINCT FROM 'cancelled'
+      AND oi.item_id IS NOT NULL
+    GROUP BY o.branch_id, o.order_time::date, oi.item_id;
+
+    RETURN fixed_totals;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Начальное заполнение по уже существующим данным
+SELECT rebuild_sales_rollups();
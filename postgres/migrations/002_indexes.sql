@@ -0,0 +1,62 @@
+-- ==============================
+--  Вторичные индексы и уникальность склада
+-- ==============================
+
+-- ===== Inventory: одна строка на (филиал, позиция) =====
+-- Существующие дубли сливаем в строку с наименьшим inventory_id
+-- (pg_temp. — чтобы DROP не задел постоянную таблицу с тем же именем)
+DROP TABLE IF EXISTS pg_temp.inventory_dups;
+CREATE TEMP TABLE pg_temp.inventory_dups AS
+SELECT inventory_id,
+       MIN(inventory_id) OVER (PARTITION BY branch_id, item_name) AS keep_id
+FROM Inventory;
+DELETE FROM pg_temp.inventory_dups WHERE inventory_id = keep_id;
+
+UPDATE Inventory i
+SET quantity = i.quantity + s.extra, last_updated = NOW()
+FROM (
+    SELECT d.keep_id, SUM(inv.quantity) AS extra
+    FROM pg_temp.inventory_dups d
+    JOIN Inventory inv ON inv.inventory_id = d.inventory_id
+    GROUP BY d.keep_id
+) s
+WHERE i.inventory_id = s.keep_id;
+
+INSERT INTO InventoryMenuItem (inventory_id, item_id, quantity_used)
+SELECT d.keep_id, imi.item_id, imi.quantity_used
+FROM pg_temp.inventory_dups d
+JOIN InventoryMenuItem imi ON imi.inventory_id = d.inventory_id
+ON CONFLICT DO NOTHING;
+
+DELETE FROM Inventory WHERE inventory_id IN (SELECT inventory_id FROM pg_temp.inventory_dups);
+DROP TABLE pg_temp.inventory_dups;
+
+DO $$
+BEGIN
+    IF NOT EXISTS (SELECT 1 FROM pg_constraint WHERE conname = 'inventory_branch_item_key') THEN
+        ALTER TABLE Inventory ADD CONSTRAINT inventory_branch_item_key UNIQUE (branch_id, item_name);
+    END IF;
+END
+$$;
+
+-- ===== Заказы =====
+-- get_orders_by_customer: WHERE customer_id ORDER BY order_time DESC
+CREATE INDEX IF NOT EXISTS idx_order_customer_time ON "Order" (customer_id, order_time DESC);
+-- заказы филиала за период
+CREATE INDEX IF NOT EXISTS idx_order_branch_time ON "Order" (branch_id, order_time);
+-- update_order_total, триггеры агрегатов, каскадное удаление
+CREATE INDEX IF NOT EXISTS idx_orderitem_order ON OrderItem (order_id);
+-- ON DELETE SET NULL при удалении пункта меню
+CREATE INDEX IF NOT EXISTS idx_orderitem_item ON OrderItem (item_id);
+CREATE INDEX IF NOT EXISTS idx_payment_order ON Payment (order_id);
+
+-- ===== Поставки =====
+CREATE INDEX IF NOT EXISTS idx_supplyorderitem_supply_order ON SupplyOrderItem (supply_order_id);
+
+-- ===== Обратная сторона M:N (первичный ключ покрывает только первую колонку) =====
+CREATE INDEX IF NOT EXISTS idx_employeebranch_branch ON EmployeeBranch (branch_id);
+CREATE INDEX IF NOT EXISTS idx_suppliermenuitem_item ON SupplierMenuItem (item_id);
+CREATE INDEX IF NOT EXISTS idx_menucategoryitem_item ON MenuCategoryItem (item_id);
+CREATE INDEX IF NOT EXISTS idx_inventorymenuitem_item ON InventoryMenuItem (item_id);
+
+ANALYZE;
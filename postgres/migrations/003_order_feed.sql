@@ -0,0 +1,8 @@
+-- ==============================
+--  Лента заказов: снимок активных заказов филиала
+-- ==============================
+
+-- app/order_feed.py: WHERE status NOT IN ('completed', 'cancelled') AND branch_id = ...
+-- Частичный индекс содержит только незавершённые заказы и не растёт с историей
+CREATE INDEX IF NOT EXISTS idx_order_active ON "Order" (branch_id, order_id)
+    WHERE status NOT IN ('completed', 'cancelled');
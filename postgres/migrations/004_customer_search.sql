@@ -0,0 +1,55 @@
+-- ==============================
+--  Поиск клиентов: телефон, email, имя
+-- ==============================
+
+-- ===== Телефоны в одном формате =====
+-- Те же правила, что у normalize_phone в app/crud_postgres.py:
+-- только цифры; ведущий + (или 00) сохраняется как +
+CREATE OR REPLACE FUNCTION normalize_phone(raw TEXT) RETURNS TEXT
+LANGUAGE sql IMMUTABLE AS $$
+    SELECT CASE
+        WHEN btrim(raw) LIKE '+%' THEN '+' || regexp_replace(raw, '\D', '', 'g')
+        WHEN btrim(raw) LIKE '00%' THEN '+' || substr(regexp_replace(raw, '\D', '', 'g'), 3)
+        ELSE regexp_replace(raw, '\D', '', 'g')
+    END
+$$;
+
+-- Если после нормализации номера совпадают, приводится только строка с наименьшим id,
+-- остальные остаются как есть (их нужно разобрать вручную)
+UPDATE Customer c
+SET phone = n.normalized
+FROM (
+    SELECT customer_id, normalize_phone(phone) AS normalized,
+           ROW_NUMBER() OVER (PARTITION BY normalize_phone(phone) ORDER BY customer_id) AS rn
+    FROM Customer
+    WHERE phone IS NOT NULL
+) n
+WHERE c.customer_id = n.customer_id
+  AND n.rn = 1
+  AND n.normalized <> ''
+  AND c.phone <> n.normalized
+  AND NOT EXISTS (SELECT 1 FROM Customer x WHERE x.phone = n.normalized AND x.customer_id <> c.customer_id);
+
+-- ===== Индексы =====
+-- find_customer_by_phone — по UNIQUE (phone), отдельный индекс не нужен
+-- find_customer_by_email: WHERE lower(email) = ... ORDER BY customer_id LIMIT 1
+CREATE INDEX IF NOT EXISTS idx_customer_email_lower ON Customer (lower(email), customer_id);
+-- search_customers(mode="prefix"): lower(name) COLLATE "C" LIKE 'ив%' ORDER BY ... LIMIT
+-- (побайтовое сравнение позволяет искать префикс и сортировать по одному индексу)
+CREATE INDEX IF NOT EXISTS idx_customer_name_prefix ON Customer ((lower(name) COLLATE "C"), customer_id);
+
+-- search_customers(mode="fuzzy"): триграммы, ближайшие по name <-> запрос (GiST)
+-- pg_trgm есть в стандартной сборке Postgres; без него поиск работает, но без индекса
+DO $$
+BEGIN
+    IF EXISTS (SELECT 1 FROM pg_available_extensions WHERE name = 'pg_trgm') THEN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS idx_customer_name_trgm ON Customer USING gist (name gist_trgm_ops);
+    ELSE
+        RAISE NOTICE 'pg_trgm недоступен: нечёткий поиск клиентов будет без индекса';
+    END IF;
+END
+$$;
+
+-- статистика по выражениям новых индексов
+ANALYZE Customer;
@@ -0,0 +1,334 @@
+-- ==============================
+--  Секционирование заказов по месяцам
+-- ==============================
+-- "Order", OrderItem и Payment секционируются по диапазону order_time, по секции на месяц:
+-- order_pYYYY_MM, orderitem_pYYYY_MM, payment_pYYYY_MM. Позиции и платежи лежат в секции
+-- месяца своего заказа (у них появилась колонка order_time), поэтому запрос с фильтром по
+-- order_time читает только нужные месяцы, VACUUM идёт по секциям, а старый месяц
+-- отсоединяется и удаляется целиком (python -m app.partitions archive).
+--
+-- Первичные ключи включают order_time: (order_id, order_time) и т.д.; id по-прежнему
+-- выдают те же последовательности. Вставка в OrderItem / Payment должна передавать
+-- order_time заказа — внешний ключ (order_id, order_time) это проверяет.
+-- Секции на будущие месяцы создаёт ensure_order_partitions(): миграция — на 3 месяца вперёд,
+-- дальше приложение (app/partitions.py) раз в час и команда python -m app.partitions ensure.
+
+-- ===== Секции месяца =====
+CREATE OR REPLACE FUNCTION ensure_order_partitions(p_from DATE, p_to DATE) RETURNS SETOF TEXT AS $$
+DECLARE
+    v_month DATE := date_trunc('month', p_from)::date;
+    v_next DATE;
+    v_parent TEXT;
+    v_table TEXT;
+BEGIN
+    -- параллельные вызовы из нескольких процессов создают секции по очереди
+    PERFORM pg_advisory_xact_lock(hashtext('ensure_order_partitions'));
+    WHILE v_month <= p_to LOOP
+        v_next := (v_month + INTERVAL '1 month')::date;
+        -- родитель первым: внешние ключи позиций и платежей ссылаются на секцию заказов
+        FOREACH v_parent IN ARRAY ARRAY['Order', 'orderitem', 'payment'] LOOP
+            v_table := lower(v_parent) || '_p' || to_char(v_month, 'YYYY_MM');
+            IF to_regclass(v_table) IS NULL THEN
+                EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                               v_table, v_parent, v_month, v_next);
+                RETURN NEXT v_table;
+            END IF;
+        END LOOP;
+        v_month := v_next;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
+
+-- Начало самой старой подключённой секции заказов; раньше этой даты история только в агрегатах
+CREATE OR REPLACE FUNCTION order_partitions_start() RETURNS DATE AS $$
+    SELECT min(to_date(substring(c.relname FROM '^order_p(\d{4}_\d{2})$'), 'YYYY_MM'))
+    FROM pg_inherits i
+    JOIN pg_class c ON c.oid = i.inhrelid
+    WHERE i.inhparent = '"Order"'::regclass;
+$$ LANGUAGE sql STABLE;
+
+-- ===== Перенос таблиц =====
+-- Повторный запуск (схема уже секционирована, например после docker initdb) таблицы не трогает;
+-- функции, индексы и триггеры ниже пересоздаются без изменений
+DO $$
+BEGIN
+    IF (SELECT relkind FROM pg_class WHERE oid = '"Order"'::regclass) = 'p' THEN
+        RAISE NOTICE '"Order" уже секционирована, перенос пропущен';
+        RETURN;
+    END IF;
+
+    ALTER TABLE Payment RENAME TO payment_old;
+    ALTER TABLE OrderItem RENAME TO orderitem_old;
+    ALTER TABLE "Order" RENAME TO order_old;
+    ALTER TABLE payment_old RENAME CONSTRAINT payment_pkey TO payment_old_pkey;
+    ALTER TABLE orderitem_old RENAME CONSTRAINT orderitem_pkey TO orderitem_old_pkey;
+    ALTER TABLE order_old RENAME CONSTRAINT "Order_pkey" TO order_old_pkey;
+    DROP INDEX IF EXISTS idx_order_customer_time, idx_order_branch_time, idx_order_active,
+                         idx_orderitem_order, idx_orderitem_item, idx_payment_order;
+
+    CREATE TABLE "Order" (
+        order_id INT NOT NULL DEFAULT nextval('"Order_order_id_seq"'),
+        customer_id INT REFERENCES Customer(customer_id) ON DELETE SET NULL,
+        branch_id INT REFERENCES CafeBranch(branch_id) ON DELETE SET NULL,
+        employee_id INT REFERENCES Employee(employee_id) ON DELETE SET NULL,
+        order_time TIMESTAMP NOT NULL DEFAULT NOW(),
+        status VARCHAR(30) DEFAULT 'created',
+        total_amount NUMERIC(10,2) DEFAULT 0,
+        PRIMARY KEY (order_id, order_time)
+    ) PARTITION BY RANGE (order_time);
+
+    CREATE TABLE OrderItem (
+        order_item_id INT NOT NULL DEFAULT nextval('orderitem_order_item_id_seq'),
+        order_id INT NOT NULL,
+        order_time TIMESTAMP NOT NULL,
+        item_id INT REFERENCES MenuItem(item_id) ON DELETE SET NULL,
+        quantity INT CHECK (quantity > 0),
+        price NUMERIC(10,2),
+        PRIMARY KEY (order_item_id, order_time),
+        FOREIGN KEY (order_id, order_time) REFERENCES "Order" (order_id, order_time) ON DELETE CASCADE
+    ) PARTITION BY RANGE (order_time);
+
+    CREATE TABLE Payment (
+        payment_id INT NOT NULL DEFAULT nextval('payment_payment_id_seq'),
+        order_id INT NOT NULL,
+        order_time TIMESTAMP NOT NULL,
+        method VARCHAR(30),
+        amount NUMERIC(10,2),
+        payment_time TIMESTAMP DEFAULT NOW(),
+        status VARCHAR(30) DEFAULT 'success',
+        PRIMARY KEY (payment_id, order_time),
+        FOREIGN KEY (order_id, order_time) REFERENCES "Order" (order_id, order_time) ON DELETE CASCADE
+    ) PARTITION BY RANGE (order_time);
+
+    ALTER SEQUENCE "Order_order_id_seq" OWNED BY "Order".order_id;
+    ALTER SEQUENCE orderitem_order_item_id_seq OWNED BY OrderItem.order_item_id;
+    ALTER SEQUENCE payment_payment_id_seq OWNED BY Payment.payment_id;
+
+    -- заказ без времени получает время миграции (раньше NULL допускался, теперь это ключ секции)
+    UPDATE order_old SET order_time = NOW() WHERE order_time IS NULL;
+
+    PERFORM ensure_order_partitions(COALESCE((SELECT min(order_time) FROM order_old), NOW())::date,
+                                    (NOW() + INTERVAL '3 months')::date);
+    -- секции только вперёд от NOW() могут не покрыть заказы "из будущего" — создаём и для них
+    PERFORM ensure_order_partitions(NOW()::date, COALESCE((SELECT max(order_time) FROM order_old), NOW())::date);
+
+    INSERT INTO "Order" (order_id, customer_id, branch_id, employee_id, order_time, status, total_amount)
+    SELECT order_id, customer_id, branch_id, employee_id, order_time, status, total_amount FROM order_old;
+
+    -- позиции и платежи без заказа (order_id IS NULL) ни к какой секции не относятся и не переносятся
+    INSERT INTO OrderItem (order_item_id, order_id, order_time, item_id, quantity, price)
+    SELECT oi.order_item_id, oi.order_id, o.order_time, oi.item_id, oi.quantity, oi.price
+    FROM orderitem_old oi
+    JOIN order_old o ON o.order_id = oi.order_id;
+
+    INSERT INTO Payment (payment_id, order_id, order_time, method, amount, payment_time, status)
+    SELECT p.payment_id, p.order_id, o.order_time, p.method, p.amount, p.payment_time, p.status
+    FROM payment_old p
+    JOIN order_old o ON o.order_id = p.order_id;
+
+    DROP TABLE payment_old, orderitem_old, order_old;
+END;
+$$;
+
+-- ===== Индексы (создаются на каждой секции) =====
+CREATE INDEX IF NOT EXISTS idx_order_customer_time ON "Order" (customer_id, order_time DESC);
+CREATE INDEX IF NOT EXISTS idx_order_branch_time ON "Order" (branch_id, order_time);
+CREATE INDEX IF NOT EXISTS idx_order_active ON "Order" (branch_id, order_id)
+    WHERE status NOT IN ('completed', 'cancelled');
+-- внешний ключ и каскадное удаление ищут позиции по (order_id, order_time)
+CREATE INDEX IF NOT EXISTS idx_orderitem_order ON OrderItem (order_id, order_time);
+CREATE INDEX IF NOT EXISTS idx_orderitem_item ON OrderItem (item_id);
+CREATE INDEX IF NOT EXISTS idx_payment_order ON Payment (order_id, order_time);
+
+-- ===== Агрегаты продаж: те же триггеры, поиск заказа с учётом секции =====
+DROP FUNCTION IF EXISTS rollup_apply_item_deltas(INT[], INT[], INT[], NUMERIC[]);
+
+CREATE OR REPLACE FUNCTION rollup_apply_item_deltas(
+    p_order_ids INT[], p_order_times TIMESTAMP[], p_item_ids INT[], p_quantities INT[], p_amounts NUMERIC[]
+) RETURNS void AS $$
+BEGIN
+    UPDATE "Order" o
+    SET total_amount = o.total_amount + d.amount
+    FROM (
+        SELECT order_id, order_time, SUM(amount) AS amount
+        FROM unnest(p_order_ids, p_order_times, p_amounts) AS u(order_id, order_time, amount)
+        GROUP BY order_id, order_time
+    ) d
+    WHERE o.order_id = d.order_id AND o.order_time = d.order_time AND d.amount <> 0;
+
+    INSERT INTO BranchDailySales AS s (branch_id, sales_date, orders_count, revenue)
+    SELECT o.branch_id, o.order_time::date, 0, COALESCE(SUM(u.amount), 0)
+    FROM unnest(p_order_ids, p_order_times, p_amounts) AS u(order_id, order_time, amount)
+    JOIN "Order" o ON o.order_id = u.order_id AND o.order_time = u.order_time
+    WHERE o.branch_id IS NOT NULL AND o.status IS DISTINCT FROM 'cancelled'
+    GROUP BY o.branch_id, o.order_time::date
+    ORDER BY 1, 2
+    ON CONFLICT (branch_id, sales_date)
+    DO UPDATE SET revenue = s.revenue + EXCLUDED.revenue;
+
+    INSERT INTO BranchDailyItemSales AS s (branch_id, sales_date, item_id, quantity, revenue)
+    SELECT o.branch_id, o.order_time::date, u.item_id,
+           COALESCE(SUM(u.quantity), 0), COALESCE(SUM(u.amount), 0)
+    FROM unnest(p_order_ids, p_order_times, p_item_ids, p_quantities, p_amounts)
+         AS u(order_id, order_time, item_id, quantity, amount)
+    JOIN "Order" o ON o.order_id = u.order_id AND o.order_time = u.order_time
+    WHERE o.branch_id IS NOT NULL AND o.status IS DISTINCT FROM 'cancelled'
+      AND u.item_id IS NOT NULL
+    GROUP BY o.branch_id, o.order_time::date, u.item_id
+    ORDER BY 1, 2, 3
+    ON CONFLICT (branch_id, sales_date, item_id)
+    DO UPDATE SET quantity = s.quantity + EXCLUDED.quantity,
+                  revenue = s.revenue + EXCLUDED.revenue;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_orderitem_rollup() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        PERFORM rollup_apply_item_deltas(array_agg(order_id), array_agg(order_time), array_agg(item_id),
+                                         array_agg(quantity), array_agg(quantity * price))
+        FROM new_items;
+    ELSIF TG_OP = 'DELETE' THEN
+        PERFORM rollup_apply_item_deltas(array_agg(order_id), array_agg(order_time), array_agg(item_id),
+                                         array_agg(-quantity), array_agg(-(quantity * price)))
+        FROM old_items;
+    ELSE
+        PERFORM rollup_apply_item_deltas(array_agg(order_id), array_agg(order_time), array_agg(item_id),
+                                         array_agg(quantity), array_agg(amount))
+        FROM (
+            SELECT order_id, order_time, item_id, quantity, quantity * price AS amount FROM new_items
+            UNION ALL
+            SELECT order_id, order_time, item_id, -quantity, -(quantity * price) FROM old_items
+        ) d;
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP FUNCTION IF EXISTS rollup_apply_order(INT, INT);
+
+CREATE OR REPLACE FUNCTION rollup_apply_order(p_order_id INT, p_order_time TIMESTAMP, p_sign INT)
+RETURNS void AS $$
+BEGIN
+    INSERT INTO BranchDailySales AS s (branch_id, sales_date, orders_count, revenue)
+    SELECT o.branch_id, o.order_time::date, p_sign,
+           p_sign * COALESCE((SELECT SUM(quantity * price) FROM OrderItem
+                              WHERE order_id = o.order_id AND order_time = p_order_time), 0)
+    FROM "Order" o
+    WHERE o.order_id = p_order_id AND o.order_time = p_order_time AND o.branch_id IS NOT NULL
+    ON CONFLICT (branch_id, sales_date)
+    DO UPDATE SET orders_count = s.orders_count + EXCLUDED.orders_count,
+                  revenue = s.revenue + EXCLUDED.revenue;
+
+    INSERT INTO BranchDailyItemSales AS s (branch_id, sales_date, item_id, quantity, revenue)
+    SELECT o.branch_id, o.order_time::date, oi.item_id,
+           p_sign * SUM(oi.quantity), p_sign * COALESCE(SUM(oi.quantity * oi.price), 0)
+    FROM "Order" o
+    JOIN OrderItem oi ON oi.order_id = o.order_id AND oi.order_time = p_order_time
+    WHERE o.order_id = p_order_id AND o.order_time = p_order_time
+      AND o.branch_id IS NOT NULL AND oi.item_id IS NOT NULL
+    GROUP BY o.branch_id, o.order_time::date, oi.item_id
+    ORDER BY 1, 2, 3
+    ON CONFLICT (branch_id, sales_date, item_id)
+    DO UPDATE SET quantity = s.quantity + EXCLUDED.quantity,
+                  revenue = s.revenue + EXCLUDED.revenue;
+END;
+$$ LANGUAGE plpgsql;
+
+CREATE OR REPLACE FUNCTION trg_order_rollup() RETURNS trigger AS $$
+BEGIN
+    IF TG_OP = 'INSERT' THEN
+        IF NEW.status IS DISTINCT FROM 'cancelled' THEN
+            PERFORM rollup_apply_order(NEW.order_id, NEW.order_time, 1);
+        END IF;
+        RETURN NULL;
+    ELSIF TG_OP = 'DELETE' THEN
+        -- BEFORE DELETE: позиции ещё на месте; каскадное удаление позиций
+        -- заказ уже не найдёт, поэтому дельты не применятся повторно
+        IF OLD.status IS DISTINCT FROM 'cancelled' THEN
+            PERFORM rollup_apply_order(OLD.order_id, OLD.order_time, -1);
+        END IF;
+        RETURN OLD;
+    END IF;
+    -- смена статуса
+    IF NEW.status = 'cancelled' AND OLD.status IS DISTINCT FROM 'cancelled' THEN
+        PERFORM rollup_apply_order(NEW.order_id, NEW.order_time, -1);
+    ELSIF OLD.status = 'cancelled' AND NEW.status IS DISTINCT FROM 'cancelled' THEN
+        PERFORM rollup_apply_order(NEW.order_id, NEW.order_time, 1);
+    END IF;
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS orderitem_rollup_ins ON OrderItem;
+DROP TRIGGER IF EXISTS orderitem_rollup_del ON OrderItem;
+DROP TRIGGER IF EXISTS orderitem_rollup_upd ON OrderItem;
+DROP TRIGGER IF EXISTS order_rollup_ins ON "Order";
+DROP TRIGGER IF EXISTS order_rollup_del ON "Order";
+DROP TRIGGER IF EXISTS order_rollup_status ON "Order";
+
+CREATE TRIGGER orderitem_rollup_ins AFTER INSERT ON OrderItem
+    REFERENCING NEW TABLE AS new_items
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_orderitem_rollup();
+CREATE TRIGGER orderitem_rollup_del AFTER DELETE ON OrderItem
+    REFERENCING OLD TABLE AS old_items
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_orderitem_rollup();
+CREATE TRIGGER orderitem_rollup_upd AFTER UPDATE ON OrderItem
+    REFERENCING OLD TABLE AS old_items NEW TABLE AS new_items
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_orderitem_rollup();
+
+CREATE TRIGGER order_rollup_ins AFTER INSERT ON "Order"
+    FOR EACH ROW EXECUTE FUNCTION trg_order_rollup();
+CREATE TRIGGER order_rollup_del BEFORE DELETE ON "Order"
+    FOR EACH ROW EXECUTE FUNCTION trg_order_rollup();
+CREATE TRIGGER order_rollup_status AFTER UPDATE OF status ON "Order"
+    FOR EACH ROW WHEN (OLD.status IS DISTINCT FROM NEW.status)
+    EXECUTE FUNCTION trg_order_rollup();
+
+-- ===== Пересборка агрегатов: только по месяцам, которые ещё в секциях =====
+-- Агрегаты архивированных месяцев (app/partitions.py archive) — единственная их история
+CREATE OR REPLACE FUNCTION rebuild_sales_rollups() RETURNS INT AS $$
+DECLARE
+    fixed_totals INT;
+    v_from DATE := COALESCE(order_partitions_start(), 'infinity'::date);
+BEGIN
+    -- на время пересборки запрещаем запись в заказы, чтобы не потерять дельты
+    LOCK TABLE "Order", OrderItem IN SHARE MODE;
+
+    UPDATE "Order" o
+    SET total_amount = t.total
+    FROM (
+        SELECT o2.order_id, o2.order_time, COALESCE(SUM(oi.quantity * oi.price), 0) AS total
+        FROM "Order" o2
+        LEFT JOIN OrderItem oi ON oi.order_id = o2.order_id AND oi.order_time = o2.order_time
+        GROUP BY o2.order_id, o2.order_time
+    ) t
+    WHERE o.order_id = t.order_id AND o.order_time = t.order_time
+      AND o.total_amount IS DISTINCT FROM t.total;
+    GET DIAGNOSTICS fixed_totals = ROW_COUNT;
+
+    DELETE FROM BranchDailySales WHERE sales_date >= v_from;
+    DELETE FROM BranchDailyItemSales WHERE sales_date >= v_from;
+
+    INSERT INTO BranchDailySales (branch_id, sales_date, orders_count, revenue)
+    SELECT o.branch_id, o.order_time::date, COUNT(DISTINCT o.order_id),
+           COALESCE(SUM(oi.quantity * oi.price), 0)
+    FROM "Order" o
+    LEFT JOIN OrderItem oi ON oi.order_id = o.order_id AND oi.order_time = o.order_time
+    WHERE o.branch_id IS NOT NULL AND o.status IS DISTINCT FROM 'cancelled'
+    GROUP BY o.branch_id, o.order_time::date;
+
+    INSERT INTO BranchDailyItemSales (branch_id, sales_date, item_id, quantity, revenue)
+    SELECT o.branch_id, o.order_time::date, oi.item_id,
+           SUM(oi.quantity), COALESCE(SUM(oi.quantity * oi.price), 0)
+    FROM "Order" o
+    JOIN OrderItem oi ON oi.order_id = o.order_id AND oi.order_time = o.order_time
+    WHERE o.branch_id IS NOT NULL AND o.status IS DISTINCT FROM 'cancelled'
+      AND oi.item_id IS NOT NULL
+    GROUP BY o.branch_id, o.order_time::date, oi.item_id;
+
+    RETURN fixed_totals;
+END;
+$$ LANGUAGE plpgsql;
+
+ANALYZE "Order", OrderItem, Payment;
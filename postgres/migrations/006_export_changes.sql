@@ -0,0 +1,67 @@
+-- ==============================
+--  Отслеживание изменений для выгрузки в аналитику
+-- ==============================
+-- app/analytics_export.py забирает из "Order", OrderItem и Payment только строки, изменённые
+-- после прошлой выгрузки (updated_at), и удаления (ExportTombstone).
+-- updated_at = NOW(), то есть время начала транзакции: строка, ещё не зафиксированная
+-- к моменту выгрузки, всегда новее начала самой старой открытой транзакции — по нему
+-- выгрузка и ставит верхнюю границу.
+
+ALTER TABLE "Order" ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT NOW();
+ALTER TABLE OrderItem ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT NOW();
+ALTER TABLE Payment ADD COLUMN IF NOT EXISTS updated_at TIMESTAMP NOT NULL DEFAULT NOW();
+
+CREATE OR REPLACE FUNCTION trg_set_updated_at() RETURNS trigger AS $$
+BEGIN
+    NEW.updated_at := NOW();
+    RETURN NEW;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS order_updated_at ON "Order";
+DROP TRIGGER IF EXISTS orderitem_updated_at ON OrderItem;
+DROP TRIGGER IF EXISTS payment_updated_at ON Payment;
+CREATE TRIGGER order_updated_at BEFORE UPDATE ON "Order"
+    FOR EACH ROW EXECUTE FUNCTION trg_set_updated_at();
+CREATE TRIGGER orderitem_updated_at BEFORE UPDATE ON OrderItem
+    FOR EACH ROW EXECUTE FUNCTION trg_set_updated_at();
+CREATE TRIGGER payment_updated_at BEFORE UPDATE ON Payment
+    FOR EACH ROW EXECUTE FUNCTION trg_set_updated_at();
+
+CREATE INDEX IF NOT EXISTS idx_order_updated_at ON "Order" (updated_at);
+CREATE INDEX IF NOT EXISTS idx_orderitem_updated_at ON OrderItem (updated_at);
+CREATE INDEX IF NOT EXISTS idx_payment_updated_at ON Payment (updated_at);
+
+-- ===== Удаления =====
+-- dataset — имя набора выгрузки (orders, order_items, payments), row_id — его ключ.
+-- Архивация месяцев (DETACH + DROP секций) сюда не попадает: история в аналитике остаётся.
+-- Старые записи удаляет сама выгрузка (export_tombstone_days)
+CREATE TABLE IF NOT EXISTS ExportTombstone (
+    dataset VARCHAR(30) NOT NULL,
+    row_id INT NOT NULL,
+    order_time TIMESTAMP NOT NULL,
+    deleted_at TIMESTAMP NOT NULL DEFAULT NOW()
+);
+CREATE INDEX IF NOT EXISTS idx_exporttombstone_deleted ON ExportTombstone (deleted_at);
+
+-- TG_ARGV: имя набора и колонка ключа
+CREATE OR REPLACE FUNCTION trg_export_tombstone() RETURNS trigger AS $$
+BEGIN
+    EXECUTE format('INSERT INTO ExportTombstone (dataset, row_id, order_time)
+                    SELECT %L, %I, order_time FROM old_rows', TG_ARGV[0], TG_ARGV[1]);
+    RETURN NULL;
+END;
+$$ LANGUAGE plpgsql;
+
+DROP TRIGGER IF EXISTS order_export_tombstone ON "Order";
+DROP TRIGGER IF EXISTS orderitem_export_tombstone ON OrderItem;
+DROP TRIGGER IF EXISTS payment_export_tombstone ON Payment;
+CREATE TRIGGER order_export_tombstone AFTER DELETE ON "Order"
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_export_tombstone('orders', 'order_id');
+CREATE TRIGGER orderitem_export_tombstone AFTER DELETE ON OrderItem
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_export_tombstone('order_items', 'order_item_id');
+CREATE TRIGGER payment_export_tombstone AFTER DELETE ON Payment
+    REFERENCING OLD TABLE AS old_rows
+    FOR EACH STATEMENT EXECUTE FUNCTION trg_export_tombstone('payments', 'payment_id');
@@ -0,0 +1,80 @@
+-- ==============================
+--  Секции по умолчанию для заказов
+-- ==============================
+-- Без секции на месяц вставка заказа падала ("no partition of relation found for row"),
+-- если ensure_order_partitions вовремя не отработал (нет прав на DDL, процесс не стартовал,
+-- заказ с order_time далеко в будущем). Теперь такие строки ложатся в секции по умолчанию
+-- order_pdefault, orderitem_pdefault, payment_pdefault, а ensure_order_partitions при
+-- создании секции месяца переносит в неё строки этого месяца из секции по умолчанию.
+-- В обычной работе секции по умолчанию пусты: строки в них — знак, что секции не создаются.
+
+-- ===== Секции по умолчанию =====
+DO $$
+DECLARE
+    v_parent TEXT;
+BEGIN
+    -- родитель первым: внешние ключи позиций и платежей ссылаются на секцию заказов
+    FOREACH v_parent IN ARRAY ARRAY['Order', 'orderitem', 'payment'] LOOP
+        IF to_regclass(lower(v_parent) || '_pdefault') IS NULL THEN
+            EXECUTE format('CREATE TABLE %I PARTITION OF %I DEFAULT', lower(v_parent) || '_pdefault', v_parent);
+        END IF;
+    END LOOP;
+END;
+$$;
+
+-- ===== Секции месяца с переносом строк из секции по умолчанию =====
+-- Секцию месяца нельзя создать, пока в секции по умолчанию есть строки этого месяца:
+-- строки копируются во временные таблицы, удаляются из секции по умолчанию, секции месяца
+-- создаются и строки вставляются в них. Пользовательские триггеры (агрегаты продаж,
+-- updated_at, удаления для выгрузки) на время переноса выключены: строки не меняются,
+-- только переезжают.
+CREATE OR REPLACE FUNCTION ensure_order_partitions(p_from DATE, p_to DATE) RETURNS SETOF TEXT AS $$
+DECLARE
+    v_month DATE := date_trunc('month', p_from)::date;
+    v_next DATE;
+    v_parent TEXT;
+    v_table TEXT;
+    v_move BOOLEAN;
+BEGIN
+    -- параллельные вызовы из нескольких процессов создают секции по очереди
+    PERFORM pg_advisory_xact_lock(hashtext('ensure_order_partitions'));
+    WHILE v_month <= p_to LOOP
+        v_next := (v_month + INTERVAL '1 month')::date;
+        v_move := to_regclass('order_p' || to_char(v_month, 'YYYY_MM')) IS NULL
+                  AND EXISTS (SELECT 1 FROM order_pdefault WHERE order_time >= v_month AND order_time < v_next);
+
+        IF v_move THEN
+            -- позиции и платежи лежат в месяце своего заказа: достаточно проверить заказы
+            FOREACH v_parent IN ARRAY ARRAY['Order', 'orderitem', 'payment'] LOOP
+                EXECUTE format('CREATE TEMP TABLE %I ON COMMIT DROP AS
+                                SELECT * FROM %I WHERE order_time >= %L AND order_time < %L',
+                               'move_' || lower(v_parent), lower(v_parent) || '_pdefault', v_month, v_next);
+            END LOOP;
+            -- дети первыми: каскадное удаление из секции заказов их уже не найдёт
+            FOREACH v_parent IN ARRAY ARRAY['payment', 'orderitem', 'Order'] LOOP
+                v_table := lower(v_parent) || '_pdefault';
+                EXECUTE format('ALTER TABLE %I DISABLE TRIGGER USER', v_table);
+                EXECUTE format('DELETE FROM %I WHERE order_time >= %L AND order_time < %L',
+                               v_table, v_month, v_next);
+                EXECUTE format('ALTER TABLE %I ENABLE TRIGGER USER', v_table);
+            END LOOP;
+        END IF;
+
+        FOREACH v_parent IN ARRAY ARRAY['Order', 'orderitem', 'payment'] LOOP
+            v_table := lower(v_parent) || '_p' || to_char(v_month, 'YYYY_MM');
+            IF to_regclass(v_table) IS NULL THEN
+                EXECUTE format('CREATE TABLE %I PARTITION OF %I FOR VALUES FROM (%L) TO (%L)',
+                               v_table, v_parent, v_month, v_next);
+                RETURN NEXT v_table;
+            END IF;
+            IF v_move THEN
+                EXECUTE format('ALTER TABLE %I DISABLE TRIGGER USER', v_table);
+                EXECUTE format('INSERT INTO %I SELECT * FROM %I', v_table, 'move_' || lower(v_parent));
+                EXECUTE format('ALTER TABLE %I ENABLE TRIGGER USER', v_table);
+                EXECUTE format('DROP TABLE %I', 'move_' || lower(v_parent));
+            END IF;
+        END LOOP;
+        v_month := v_next;
+    END LOOP;
+END;
+$$ LANGUAGE plpgsql;
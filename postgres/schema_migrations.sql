@@ -0,0 +1,21 @@
+-- ==============================
+--  Версии миграций, применённых при инициализации контейнера
+-- ==============================
+-- Dockerfile выполняет postgres/migrations/*.sql напрямую, минуя app/migrations.py;
+-- без этих строк python -m app.migrations apply запустил бы все миграции повторно.
+-- Новая миграция добавляется и в Dockerfile, и сюда.
+
+CREATE TABLE IF NOT EXISTS schema_migrations (
+    version VARCHAR(100) PRIMARY KEY,
+    applied_at TIMESTAMP DEFAULT NOW()
+);
+
+INSERT INTO schema_migrations (version) VALUES
+('001_sales_rollups'),
+('002_indexes'),
+('003_order_feed'),
+('004_customer_search'),
+('005_order_partitions'),
+('006_export_changes'),
+('007_order_default_partitions')
+ON CONFLICT (version) DO NOTHING;
@@ -0,0 +1,6 @@
+import os
+import sys
+
+# Тесты запускаются из корня репозитория: python -m pytest -q
+# Пакет app импортируется без установки
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,302 @@
+import os
+import subprocess
+import sys
+import time
+
+import pytest
+from pymongo import UpdateOne
+
+from app import log_spool
+from app.log_spool import (
+    BREAKER_CLOSED, BREAKER_HALF_OPEN, BREAKER_OPEN, OPEN_SUFFIX, SEGMENT_SUFFIX, CircuitBreaker, Spool, read_segment,
+)
+from app.log_storage import LOGS
+
+
+class Clock:
+    def __init__(self):
+        self.now = 100.0
+
+    def __call__(self):
+        return self.now
+
+
+class Logs:
+    """Коллекция logs в памяти: upsert по log_id, как его делает replay."""
+
+    def __init__(self):
+        self.docs = {}
+
+    def bulk_write(self, requests, ordered=True):
+        upserted = 0
+        for request in requests:
+            assert isinstance(request, UpdateOne)
+            log_id = request._filter["log_id"]
+            if log_id not in self.docs:
+                self.docs[log_id] = dict(request._doc["$setOnInsert"], log_id=log_id)
+                upserted += 1
+        return type("Result", (), {"upserted_count": upserted})()
+
+    def insert_many(self, docs, ordered=True):
+        for doc in docs:
+            self.docs[object()] = doc
+        return type("Result", (), {"inserted_ids": list(range(len(docs)))})()
+
+
+@pytest.fixture
+def spool(tmp_path, monkeypatch):
+    spool = Spool(str(tmp_path), segment_bytes=1024)
+    monkeypatch.setattr(log_spool, "_spool", spool)
+    yield spool
+    spool.close()
+
+
+@pytest.fixture
+def logs(monkeypatch):
+    logs = Logs()
+    monkeypatch.setattr(log_spool, "get_mongo_db", lambda: {LOGS: logs})
+    return logs
+
+
+def _doc(i):
+    return {"log_id": f"id-{i}", "user_id": i, "action": "test", "details": {"n": i}}
+
+
+# ===== Автомат =====
+def test_breaker_opens_after_failures_and_recovers_after_probe():
+    clock = Clock()
+    breaker = CircuitBreaker(failures=2, cooldown=10, clock=clock)
+    assert breaker.allow()
+    breaker.record_failure()
+    assert breaker.state == BREAKER_CLOSED
+    breaker.record_failure()
+    assert breaker.state == BREAKER_OPEN
+    assert not breaker.allow()
+
+    clock.now += 9.9
+    assert not breaker.allow()
+    clock.now += 0.1
+    assert breaker.allow()                       # одна проба после cooldown
+    assert breaker.state == BREAKER_HALF_OPEN
+    assert not breaker.allow()                   # пока проба идёт, остальные — в спул
+
+    assert breaker.record_success() is True      # MongoDB вернулась
+    assert breaker.state == BREAKER_CLOSED
+    assert breaker.allow()
+    snapshot = breaker.snapshot()
+    assert snapshot["opened"] == 1
+    assert snapshot["rejected"] == 3
+    assert snapshot["consecutive_failures"] == 0
+
+
+def test_breaker_failed_probe_reopens_for_another_cooldown():
+    clock = Clock()
+    breaker = CircuitBreaker(failures=3, cooldown=5, clock=clock)
+    for _ in range(3):
+        breaker.record_failure()
+    clock.now += 5
+    assert breaker.allow()
+    breaker.record_failure()                     # в half_open хватает одной неудачи
+    assert breaker.state == BREAKER_OPEN
+    assert not breaker.allow()
+    clock.now += 5
+    assert breaker.allow()
+    assert breaker.record_success() is True
+    assert breaker.record_success() is False
+
+
+def test_breaker_success_resets_consecutive_failures():
+    breaker = CircuitBreaker(failures=2, cooldown=5, clock=Clock())
+    breaker.record_failure()
+    breaker.record_success()
+    breaker.record_failure()
+    assert breaker.state == BREAKER_CLOSED
+
+
+# ===== Спул =====
+def test_segments_rotate_by_size(spool, tmp_path):
+    spool.append([_doc(i) for i in range(20)])   # больше segment_bytes
+    assert spool.segments() == []                # текущий сегмент ещё открыт
+    spool.append([_doc(20)])                     # следующая пачка — в новый сегмент
+    closed = spool.segments()
+    assert len(closed) == 1
+    assert closed[0].endswith(SEGMENT_SUFFIX)
+    docs, corrupt = read_segment(closed[0])
+    assert [d["user_id"] for d in docs] == list(range(20))
+    assert corrupt == 0
+
+    spool.rotate()
+    assert len(spool.segments()) == 2
+    assert spool.stats()["spooled"] == 21
+
+
+def test_open_segment_of_dead_process_is_handed_to_replay(spool, tmp_path):
+    child = subprocess.Popen([sys.executable, "-c", "pass"])
+    child.wait()
+    dead = tmp_path / f"{time.time_ns():020d}-{child.pid}{OPEN_SUFFIX}"
+    dead.write_text('{"log_id": "x", "action": "dead"}\n')
+    alive = tmp_path / f"{time.time_ns():020d}-{os.getppid()}{OPEN_SUFFIX}"
+    alive.write_text('{"log_id": "y", "action": "alive"}\n')
+
+    closed = spool.segments()
+    assert closed == [str(dead)[:-len(OPEN_SUFFIX)] + SEGMENT_SUFFIX]
+    assert alive.exists()                        # процесс жив — сегмент он ещё пишет
+
+
+def test_read_segment_skips_truncated_line(tmp_path):
+    path = tmp_path / f"1-1{SEGMENT_SUFFIX}"
+    path.write_text('{"log_id": "a", "user_id": 1}\n\n{"log_id": "b", "user_id": 2}\n{"log_id": "c", "us')
+    docs, corrupt = read_segment(str(path))
+    assert [d["log_id"] for d in docs] == ["a", "b"]
+    assert corrupt == 1
+
+
+def test_unencodable_details_are_stored_as_string(spool):
+    class Opaque:
+        def __repr__(self):
+            return "<opaque>"
+
+    spool.append([{"log_id": "z", "action": "test", "details": {"value": Opaque()}}])
+    spool.rotate()
+    docs, _ = read_segment(spool.segments()[0])
+    assert docs[0]["details"] == "{'value': <opaque>}"
+
+
+# ===== replay =====
+def test_replay_is_idempotent_by_log_id(spool, logs):
+    spool.append([_doc(1), _doc(2)])
+    spool.rotate()
+    # пачка, записанная в MongoDB, но не подтверждённая до таймаута, попала и в спул
+    spool.append([_doc(2), _doc(3)])
+
+    report = log_spool.replay()
+    assert report["segments"] == 2
+    assert report["entries"] == 4
+    assert report["inserted"] == 3
+    assert sorted(logs.docs) == ["id-1", "id-2", "id-3"]
+    assert spool.segments() == []
+
+    spool.append([_doc(1), _doc(3)])             # повтор уже перенесённых записей
+    report = log_spool.replay()
+    assert report["entries"] == 2
+    assert report["inserted"] == 0
+    assert len(logs.docs) == 3
+
+
+# ===== write_logs =====
+@pytest.fixture
+def breaker(monkeypatch):
+    breaker = CircuitBreaker(failures=1, cooldown=60, clock=Clock())
+    monkeypatch.setattr(log_spool, "_breaker", breaker)
+    monkeypatch.setattr(log_spool, "start_replay", lambda: None)
+    return breaker
+
+
+@pytest.fixture
+def replay_state(monkeypatch):
+    # replay уже отработал при старте процесса: повод для нового прохода — только pending
+    state = dict(log_spool._replay_state, started=True, pending=False, thread=None, errors=0, last_error=None)
+    monkeypatch.setattr(log_spool, "_replay_state", state)
+    return state
+
+
+def test_write_logs_spools_when_mongo_fails(spool, breaker, monkeypatch):
+    from pymongo import errors
+
+    def down(batch):
+        raise errors.ServerSelectionTimeoutError("нет MongoDB")
+
+    monkeypatch.setattr(log_spool, "_insert", down)
+    log_spool.write_logs([{"action": "a"}])
+    assert breaker.state == BREAKER_OPEN
+    log_spool.write_logs([{"action": "b"}])      # автомат разомкнут — сразу на диск
+    spool.rotate()
+    docs, _ = read_segment(spool.segments()[0])
+    assert [d["action"] for d in docs] == ["a", "b"]
+    assert all(d["log_id"] for d in docs)
+
+
+def test_write_logs_spools_batch_with_invalid_bson(spool, breaker, replay_state, monkeypatch):
+    import bson
+
+    def invalid(batch):
+        raise bson.errors.InvalidDocument("cannot encode object")
+
+    monkeypatch.setattr(log_spool, "_insert", invalid)
+    log_spool.write_logs([{"action": "a", "details": {"x": object()}}, {"action": "b"}])
+    assert breaker.state == BREAKER_CLOSED       # MongoDB здорова
+    spool.rotate()
+    docs, _ = read_segment(spool.segments()[0])
+    assert [d["action"] for d in docs] == ["a", "b"]
+    assert isinstance(docs[0]["details"], str)
+    assert replay_state["pending"]              # следующая успешная пачка запустит replay
+
+
+def _join_replay(state):
+    thread = state["thread"]
+    assert thread is not None, "replay не запущен"
+    thread.join(5)
+
+
+def test_failure_below_threshold_is_replayed_after_next_good_batch(spool, logs, replay_state, monkeypatch):
+    from pymongo import errors
+
+    monkeypatch.setattr(log_spool, "_breaker", CircuitBreaker(failures=3, cooldown=60, clock=Clock()))
+    inserted = []
+
+    def flaky(batch):
+        if not inserted:
+            inserted.append(None)
+            raise errors.AutoReconnect("обрыв соединения")
+        inserted.extend(batch)
+
+    monkeypatch.setattr(log_spool, "_insert", flaky)
+    log_spool.write_logs([{"log_id": "lost", "action": "a"}])
+    assert log_spool.get_breaker().state == BREAKER_CLOSED
+    assert replay_state["pending"]
+
+    log_spool.write_logs([{"log_id": "ok", "action": "b"}])
+    _join_replay(replay_state)
+    assert list(logs.docs) == ["lost"]
+    assert spool.segments() == []
+    assert not replay_state["pending"]
+
+
+def test_failed_background_replay_is_retried(spool, logs, replay_state, monkeypatch):
+    spool.append([_doc(1)])
+    monkeypatch.setattr(log_spool, "_insert", lambda batch: None)
+    monkeypatch.setattr(log_spool, "_breaker", CircuitBreaker(failures=3, cooldown=60, clock=Clock()))
+    replay_segment = log_spool._replay_segment
+    failures = [RuntimeError("MongoDB упала посреди replay")]
+
+    def flaky(path, batch_size):
+        if failures:
+            raise failures.pop()
+        return replay_segment(path, batch_size)
+
+    monkeypatch.setattr(log_spool, "_replay_segment", flaky)
+    log_spool.start_replay()
+    _join_replay(replay_state)
+    assert replay_state["errors"] == 1
+    assert replay_state["pending"]               # сегмент остался — нужен ещё проход
+
+    log_spool.write_logs([_doc(2)])
+    _join_replay(replay_state)
+    assert list(logs.docs) == ["id-1"]
+    assert spool.segments() == []
+
+
+def test_spool_overflow_does_not_wait_for_the_spool(spool, replay_state):
+    with spool._lock:                            # сегмент занят записью другой пачки
+        started = time.perf_counter()
+        log_spool.spool_overflow([{"action": "overflow"}])
+        assert time.perf_counter() - started < 0.1
+        assert spool._stats["spooled"] == 0
+    deadline = time.monotonic() + 5
+    while spool.stats()["spooled"] == 0 and time.monotonic() < deadline:
+        time.sleep(0.01)
+    spool.rotate()
+    docs, _ = read_segment(spool.segments()[0])
+    assert [d["action"] for d in docs] == ["overflow"]
+    assert docs[0]["log_id"]
+    assert replay_state["pending"]
@@ -0,0 +1,164 @@
+import queue
+import threading
+import time
+
+import pytest
+
+from app import log_writer
+from app.log_writer import OVERFLOW_BLOCK, OVERFLOW_DROP_OLDEST, OVERFLOW_SAMPLE, BatchWriter
+
+# Большие batch_size и flush_interval: воркер сам пачку не заберёт, пока его не попросят flush()
+
+
+class Recorder:
+    """write_batch, который запоминает пачки; gate задерживает запись, fail — роняет её."""
+
+    def __init__(self):
+        self.batches = []
+        self.gate = threading.Event()
+        self.gate.set()
+        self.started = threading.Event()
+        self.fail = False
+
+    def __call__(self, batch):
+        self.started.set()
+        self.gate.wait()
+        if self.fail:
+            raise RuntimeError("запись не удалась")
+        self.batches.append(list(batch))
+
+    @property
+    def docs(self):
+        return [doc for batch in self.batches for doc in batch]
+
+
+def make_writer(recorder, **kwargs):
+    options = {"batch_size": 100, "flush_interval": 60, "max_queue": 3}
+    options.update(kwargs)
+    return BatchWriter(recorder, **options)
+
+
+def test_rejects_unknown_policy_and_sizes():
+    with pytest.raises(ValueError):
+        BatchWriter(list, overflow="ignore")
+    with pytest.raises(ValueError):
+        BatchWriter(list, batch_size=0)
+
+
+def test_batches_by_size():
+    recorder = Recorder()
+    writer = make_writer(recorder, batch_size=2, max_queue=10)
+    for i in range(4):
+        writer.enqueue(i)
+    assert writer.flush(timeout=5)
+    assert recorder.docs == [0, 1, 2, 3]
+    assert all(len(batch) <= 2 for batch in recorder.batches)
+    assert writer.stats()["flushed"] == 4
+    writer.close(timeout=5)
+
+
+def test_drop_oldest_keeps_newest():
+    recorder = Recorder()
+    writer = make_writer(recorder, overflow=OVERFLOW_DROP_OLDEST)
+    assert all(writer.enqueue(i) for i in range(5))
+    assert writer.flush(timeout=5)
+    assert recorder.docs == [2, 3, 4]
+    assert writer.stats()["dropped"] == 2
+    writer.close(timeout=5)
+
+
+def test_sample_drops_new_record_outside_sample(monkeypatch):
+    recorder = Recorder()
+    writer = make_writer(recorder, overflow=OVERFLOW_SAMPLE, sample_rate=0.5)
+    for i in range(3):
+        writer.enqueue(i)
+    monkeypatch.setattr(log_writer.random, "random", lambda: 0.9)
+    assert writer.enqueue(3) is False            # вне выборки: новая запись отброшена
+    monkeypatch.setattr(log_writer.random, "random", lambda: 0.1)
+    assert writer.enqueue(4) is True             # в выборке: вытесняет самую старую
+    assert writer.flush(timeout=5)
+    assert recorder.docs == [1, 2, 4]
+    assert writer.stats()["dropped"] == 2
+    writer.close(timeout=5)
+
+
+def test_block_waits_for_room():
+    recorder = Recorder()
+    writer = make_writer(recorder, overflow=OVERFLOW_BLOCK, max_queue=1)
+    writer.enqueue(1)
+    producer = threading.Thread(target=writer.enqueue, args=(2,))
+    producer.start()
+    producer.join(0.2)
+    assert producer.is_alive()                   # очередь полна — продюсер ждёт
+    assert writer.flush(timeout=5)
+    producer.join(5)
+    assert not producer.is_alive()
+    assert writer.flush(timeout=5)
+    assert recorder.docs == [1, 2]
+    assert writer.stats()["dropped"] == 0
+    writer.close(timeout=5)
+
+
+def test_block_without_waiting_raises_full():
+    recorder = Recorder()
+    writer = make_writer(recorder, overflow=OVERFLOW_BLOCK, max_queue=1)
+    writer.enqueue(1)
+    with pytest.raises(queue.Full):
+        writer.enqueue(2, block=False)
+    assert writer.stats()["queued"] == 1
+    writer.close(timeout=5)
+
+
+def test_flush_timeout():
+    recorder = Recorder()
+    recorder.gate.clear()
+    writer = make_writer(recorder)
+    writer.enqueue(1)
+    started = time.monotonic()
+    assert writer.flush(timeout=0.2) is False
+    assert time.monotonic() - started < 2
+    recorder.gate.set()
+    assert writer.flush(timeout=5)
+    assert recorder.docs == [1]
+    writer.close(timeout=5)
+
+
+def test_close_timeout_and_enqueue_after_close():
+    recorder = Recorder()
+    recorder.gate.clear()
+    writer = make_writer(recorder)
+    writer.enqueue(1)
+    assert writer.flush(timeout=0.1) is False
+    assert recorder.started.wait(5)
+    started = time.monotonic()
+    writer.close(timeout=0.2)                    # запись висит — close не ждёт дольше timeout
+    assert time.monotonic() - started < 2
+    with pytest.raises(RuntimeError):
+        writer.enqueue(2)
+    recorder.gate.set()
+
+
+def test_close_flushes_queue():
+    recorder = Recorder()
+    writer = make_writer(recorder)
+    writer.enqueue(1)
+    writer.enqueue(2)
+    writer.close(timeout=5)
+    assert recorder.docs == [1, 2]
+
+
+def test_failed_batch_is_counted_and_writer_keeps_going():
+    recorder = Recorder()
+    recorder.fail = True
+    writer = make_writer(recorder)
+    writer.enqueue(1)
+    writer.enqueue(2)
+    assert writer.flush(timeout=5)
+    assert writer.stats()["failed"] == 2
+    assert writer.stats()["flushed"] == 0
+    recorder.fail = False
+    writer.enqueue(3)
+    assert writer.flush(timeout=5)
+    assert recorder.docs == [3]
+    assert writer.stats()["flushed"] == 1
+    writer.close(timeout=5)
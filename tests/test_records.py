@@ -0,0 +1,79 @@
+from datetime import date, datetime
+from decimal import Decimal
+
+import numpy as np
+
+from app import records
+from app.records import SHAPE_COLUMNS, column_array, shape_rows, to_columns
+
+
+class Result:
+    """Результат SQLAlchemy в памяти: keys() и partitions(), как у курсора"""
+
+    def __init__(self, names, rows):
+        self.names = names
+        self.rows = rows
+
+    def keys(self):
+        return self.names
+
+    def partitions(self, size):
+        for start in range(0, len(self.rows), size):
+            yield self.rows[start:start + size]
+
+
+NAMES = ["order_id", "branch_id", "total_amount", "paid", "order_time", "status"]
+
+
+def _rows(n):
+    rows = []
+    for i in range(n):
+        rows.append((
+            i,
+            None if 4 <= i < 7 else i % 3,          # NULL только во второй порции
+            Decimal(f"{i}.10"),
+            i % 2 == 0 if i != 9 else None,
+            datetime(2025, 1, 1 + i % 28, 12),
+            "created" if i % 2 else None,
+        ))
+    return rows
+
+
+def test_columns_by_partition_match_whole_result(monkeypatch):
+    monkeypatch.setattr(records, "PARTITION_SIZE", 4)
+    rows = _rows(11)
+    columns = shape_rows(Result(NAMES, rows), SHAPE_COLUMNS)
+    expected = to_columns(NAMES, rows)
+    assert columns.keys() == expected.keys()
+    for name in NAMES:
+        got, want = columns[name], expected[name]
+        assert type(got) is type(want), name
+        if isinstance(want, np.ndarray):
+            assert got.dtype == want.dtype, name
+            np.testing.assert_array_equal(got, want)
+        else:
+            assert got == want, name
+    assert columns["order_id"].dtype == np.int64
+    assert columns["branch_id"].dtype == np.float64
+    assert np.isnan(columns["branch_id"][4])
+    assert columns["paid"] == [r[3] for r in rows]   # bool с NULL — список
+
+
+def test_empty_result_keeps_column_names():
+    columns = shape_rows(Result(NAMES, []), SHAPE_COLUMNS)
+    assert list(columns) == NAMES
+    assert all(len(v) == 0 for v in columns.values())
+
+
+def test_decimal_money_is_not_rounded_to_float():
+    values = [Decimal("0.10"), Decimal("0.20"), None, Decimal("0.30")]
+    column = column_array(values)
+    assert column.dtype == object
+    assert column[2] is None
+    assert column[[0, 1, 3]].sum() == Decimal("0.60")
+
+
+def test_dates_and_plain_numbers():
+    assert column_array([date(2025, 1, 1), None]).dtype == np.dtype("datetime64[D]")
+    assert column_array([1, 2.5]).dtype == np.float64
+    assert column_array(["a", 1]) == ["a", 1]
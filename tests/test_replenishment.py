@@ -0,0 +1,85 @@
+import numpy as np
+
+from app.replenishment import _build_orders, _cheapest_suppliers, _compute
+
+# Филиалы 1, 2; пункты меню 10, 20, 30, 40. lead 2 + safety 1 дня — точка заказа,
+# + cover 4 — уровень, до которого заказываем; расход считается за 10 дней
+BRANCHES = np.array([1, 2], dtype=np.int64)
+ITEMS = np.array([10, 20, 30, 40], dtype=np.int64)
+WINDOW, LEAD, SAFETY, COVER = 10, 2, 1, 4
+
+# (филиал, пункт, остаток ингредиента, расход ингредиента на порцию)
+RECIPES = [
+    (1, 10, 10, 2),     # 5 порций
+    (1, 10, 9, 1),      # 9 порций: запас по пункту — минимум, 5
+    (1, 20, 100, 1),
+    (2, 10, -3, 1),     # отрицательный остаток считается нулём
+    (2, 40, 1, 1),
+    (99, 10, 1000, 1),  # филиал вне расчёта
+]
+# (филиал, пункт, продано порций за окно)
+SALES = [(1, 10, 20), (1, 20, 10), (1, 30, 50), (2, 10, 30), (2, 40, 10)]
+# (филиал, пункт, порций в незакрытых поставках)
+ON_ORDER = [(2, 10, 4)]
+# (пункт, поставщик, цена)
+PRICES = [
+    (10, 7, 1.5), (10, 5, 1.5), (10, 9, 2.0),   # равная цена — меньший supplier_id
+    (20, 3, 4.0),
+    (30, 1, 1.0),
+    (99, 2, 0.1),                                 # пункта нет в меню
+]
+
+
+def compute():
+    return _compute(BRANCHES, ITEMS, RECIPES, SALES, ON_ORDER, PRICES, WINDOW, LEAD, SAFETY, COVER)
+
+
+def test_cheapest_supplier_with_tie_break_on_supplier_id():
+    supplier, price = _cheapest_suppliers(ITEMS, PRICES)
+    assert supplier.tolist() == [5, 3, 1, -1]
+    assert price[:3].tolist() == [1.5, 4.0, 1.0]
+    assert np.isnan(price[3])
+
+
+def test_cheapest_supplier_without_prices():
+    supplier, price = _cheapest_suppliers(ITEMS, [])
+    assert supplier.tolist() == [-1, -1, -1, -1]
+    assert np.isnan(price).all()
+
+
+def test_stock_is_min_over_ingredients_and_untracked_items_are_zero():
+    _, _, _, _, stock, pending, rate, days_of_cover, _ = compute()
+    assert stock.tolist() == [[5, 100, 0, 0], [0, 0, 0, 1]]
+    assert pending.tolist() == [[0, 0, 0, 0], [4, 0, 0, 0]]
+    assert rate.tolist() == [[2, 1, 5, 0], [3, 0, 0, 1]]
+    assert days_of_cover[0, 0] == 2.5
+    assert days_of_cover[0, 3] == np.inf        # нет расхода — запаса хватит всегда
+
+
+def test_reorder_quantities_and_masks():
+    need, quantity, supplier, _, _, _, _, _, stats = compute()
+    # 1/10: запас 5 < точки заказа 2*3=6 -> до 2*7=14, заказ 9
+    # 2/10: запас 0 + в пути 4 < 3*3=9 -> до 3*7=21, заказ 17
+    # 1/20: 100 порций — не нужно; 1/30 — рецепта нет, не отслеживается;
+    # 2/40: запас 1 < 1*3, но поставщика нет
+    assert need.tolist() == [[True, False, False, False], [True, False, False, False]]
+    assert quantity[0, 0] == 9
+    assert quantity[1, 0] == 17
+    assert supplier[0] == 5
+    assert stats == {"branches": 2, "items": 4, "tracked": 4, "below_reorder_point": 3, "no_supplier": 1}
+
+
+def test_position_at_reorder_point_is_not_ordered():
+    on_order = [(1, 10, 1), (2, 10, 4)]          # 1/10: 5 + 1 = 6 = точка заказа
+    need, *_ = _compute(BRANCHES, ITEMS, RECIPES, SALES, on_order, PRICES, WINDOW, LEAD, SAFETY, COVER)
+    assert not need[0, 0]
+    assert need[1, 0]
+
+
+def test_orders_grouped_by_branch_and_supplier():
+    need, quantity, supplier, price, stock, pending, rate, days_of_cover, _ = compute()
+    orders = _build_orders(BRANCHES, ITEMS, need, quantity, supplier, price, stock, pending, rate, days_of_cover)
+    assert [(o["branch_id"], o["supplier_id"], o["total_cost"]) for o in orders] == [(1, 5, 13.5), (2, 5, 25.5)]
+    line = orders[1]["items"][0]
+    assert line == {"item_id": 10, "quantity": 17, "supply_price": 1.5, "on_hand": 0.0, "on_order": 4.0,
+                    "daily_usage": 3.0, "days_of_cover": 0.0}